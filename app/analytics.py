@@ -0,0 +1,172 @@
+"""Analytics over the bot's logs and captured update streams
+
+    python -m app.analytics ingest [FILE ...] [--follow SECONDS]
+    python -m app.analytics sources
+    python -m app.analytics names [--since 1d]
+    python -m app.analytics throughput [--name update] [--bucket 1h] [--since 7d]
+    python -m app.analytics latency [--name email.delivery] [--by content_type] [--bucket 1d] [--since 7d]
+    python -m app.analytics errors [--by name] [--since 1d]
+    python -m app.analytics chats [--top 20] [--since 7d]
+
+LOG_FILE and ANALYTICS_SOURCES are ingested into ANALYTICS_DB (see
+app/models/event_store.py) before every query, which only reads what was
+appended since the last run; --no-ingest queries the store as it is.
+--since/--until take a duration back from now (90s, 30m, 2h, 7d), a date
+or time (2026-10-01, 2026-10-01T12:00, local time) or a Unix timestamp.
+
+The bot logs an ``update`` record (chat, content type, step, duration) for
+every update it handles, and each line of a captured update stream counts as
+one too, so throughput and latency work on a stock install; ingesting a
+capture of traffic the log already covers counts those updates twice.
+"""
+import argparse
+import re
+import sys
+import time
+from datetime import datetime
+from config.settings import ANALYTICS_DB, ANALYTICS_SOURCES, LOG_FILE
+from app.models.event_store import EventStore, GROUP_COLUMNS
+
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_duration(text):
+    """Seconds in '90s', '30m', '2h', '7d', '1w' (or a bare number of seconds)"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw]?)', text.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"not a duration: {text!r}")
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def parse_time(text):
+    """A Unix timestamp for a duration back from now, an ISO date/time or a timestamp"""
+    try:
+        return float(text) if float(text) > 10 ** 8 else time.time() - float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    return time.time() - parse_duration(text)
+
+
+def format_time(ts, bucket=None):
+    if ts is None:
+        return '-'
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d' if bucket and bucket >= 86400 else '%Y-%m-%d %H:%M:%S')
+
+
+def format_ms(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+def print_table(headers, rows):
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max([len(header)] + [len(row[i]) for row in rows]) for i, header in enumerate(headers)]
+    print('  '.join(header.ljust(width) if i == 0 else header.rjust(width)
+                    for i, (header, width) in enumerate(zip(headers, widths))))
+    for row in rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                        for i, (cell, width) in enumerate(zip(row, widths))))
+    if not rows:
+        print('(no events)')
+
+
+def ingest(store, paths, quiet=False):
+    total = {'lines': 0, 'skipped': 0, 'bytes': 0}
+    for path in paths:
+        start = time.perf_counter()
+        stats = store.ingest(path)
+        for key in total:
+            total[key] += stats[key]
+        if not quiet and stats['bytes']:
+            elapsed = time.perf_counter() - start
+            print(f"{path}: {stats['lines']} events, {stats['skipped']} lines skipped, "
+                  f"{stats['bytes'] / 1024 / 1024:.1f} MB in {elapsed:.2f}s", file=sys.stderr)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.analytics', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=ANALYTICS_DB)
+    parser.add_argument('--no-ingest', action='store_true', help="query without ingesting new lines first")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('ingest', help="read new lines of the sources into the store")
+    command.add_argument('paths', nargs='*', help="files to ingest (default: LOG_FILE and ANALYTICS_SOURCES)")
+    command.add_argument('--follow', type=parse_duration, metavar='SECONDS',
+                         help="keep ingesting at this interval until interrupted")
+    commands.add_parser('sources', help="files ingested so far")
+
+    def query(command_name, description, **options):
+        command = commands.add_parser(command_name, help=description)
+        command.add_argument('--since', type=parse_time, default=parse_time('7d'))
+        command.add_argument('--until', type=parse_time, default=None)
+        for option, settings in options.items():
+            command.add_argument(f'--{option}', **settings)
+        return command
+
+    query('names', "events by name, with their error counts")
+    query('throughput', "events per time bucket", name={'default': 'update'},
+          bucket={'type': parse_duration, 'default': parse_duration('1h')})
+    query('latency', "duration percentiles (p50/p95/p99/max, ms)", name={'default': 'email.delivery'},
+          by={'choices': sorted(GROUP_COLUMNS)}, bucket={'type': parse_duration})
+    query('errors', "error rates: records at WARNING or above, failed spans and deliveries",
+          by={'choices': sorted(GROUP_COLUMNS), 'default': 'name'})
+    query('chats', "the most active chats", top={'type': int, 'default': 20})
+    args = parser.parse_args(argv)
+
+    store = EventStore(args.db)
+    try:
+        if args.command == 'ingest':
+            paths = args.paths or [LOG_FILE] + ANALYTICS_SOURCES
+            while True:
+                ingest(store, paths)
+                if not args.follow:
+                    break
+                time.sleep(args.follow)
+            return 0
+        if not args.no_ingest:
+            ingest(store, [LOG_FILE] + ANALYTICS_SOURCES, quiet=True)
+        if args.command == 'sources':
+            print_table(['source', 'MB', 'events', 'skipped', 'ingested'],
+                        [(path, f"{offset / 1024 / 1024:.1f}", lines, skipped, format_time(updated))
+                         for path, offset, lines, skipped, updated in store.sources()])
+            return 0
+
+        since, until = args.since, args.until or time.time() + 1
+        if args.command == 'names':
+            print_table(['name', 'events', 'errors'], store.names(since, until))
+        elif args.command == 'throughput':
+            rows = store.throughput(args.name, since, until, args.bucket)
+            print_table(['from', 'events', 'per s'],
+                        [(format_time(ts, args.bucket), count, f"{count / args.bucket:.2f}") for ts, count in rows])
+        elif args.command == 'latency':
+            headers = ([] if not args.bucket else ['from']) + ([] if not args.by else [args.by])
+            rows = []
+            for key, count, p50, p95, p99, slowest in store.latency(args.name, since, until, args.by, args.bucket):
+                key = list(key)
+                if args.bucket:
+                    key[0] = format_time(key[0], args.bucket)
+                rows.append(key[:len(headers)] + [count] + [format_ms(v) for v in (p50, p95, p99, slowest)])
+            print_table((headers or [args.name]) + ['count', 'p50', 'p95', 'p99', 'max'],
+                        rows if headers else [[args.name] + row for row in rows])
+        elif args.command == 'errors':
+            print_table([args.by, 'events', 'errors', 'rate'],
+                        [(key, total, errors, f"{errors / total:.2%}")
+                         for key, total, errors in store.error_rates(since, until, args.by)])
+        elif args.command == 'chats':
+            print_table(['chat_id', 'events', 'updates', 'deliveries', 'errors', 'first', 'last'],
+                        [row[:5] + (format_time(row[5]), format_time(row[6]))
+                         for row in store.chat_activity(since, until, args.top)])
+        return 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Optional asyncio server mode serving the same /message contract as the Flask blueprint.
+
+Run with: uvicorn app.asgi:app --port 5002  (or SERVER_MODE=asgi python main.py)
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from app.controllers.async_handlers import handle_command_async, close, warm_up
+from app.controllers.handlers import (
+    finish_update,
+    replay_journal,
+    journal,
+    outbound,
+    delivery_queue,
+    reminders,
+    attachment_cache,
+    spool,
+)
+from utils.metrics import REGISTRY, CONTENT_TYPE
+
+
+async def message(request):
+    try:
+        data = await request.json()  # Get the incoming data
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return PlainTextResponse(await handle_command_async(data))  # the usual error reply, not journaled
+    # The commit wait happens off the event loop; concurrent requests share one commit
+    if not await asyncio.to_thread(journal.record, data):
+        return PlainTextResponse("Duplicate update ignored.")
+    try:
+        return PlainTextResponse(await handle_command_async(data))
+    finally:
+        await asyncio.to_thread(finish_update, data)
+
+
+async def stats(request):
+    return JSONResponse({'delivery': delivery_queue.metrics(), 'attachment_cache': attachment_cache.stats(),
+                         'journal': journal.stats(), 'outbound': outbound.stats(), 'spool': spool.stats()})
+
+
+async def metrics(request):
+    return Response(REGISTRY.render(), headers={'Content-Type': CONTENT_TYPE})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    reminders.start()
+    REGISTRY.start_flusher()
+    await asyncio.to_thread(replay_journal)
+    warm_up()
+    yield
+    await close()
+
+
+app = Starlette(
+    routes=[
+        Route('/message', message, methods=["POST"]),
+        Route('/stats', stats, methods=["GET"]),
+        Route('/metrics', metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
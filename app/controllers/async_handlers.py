@@ -0,0 +1,252 @@
+import asyncio
+import os
+import time
+from config.settings import DELIVERY_MAX_ATTEMPTS
+from app.controllers import handlers
+from app.controllers.handlers import (
+    user_sessions,
+    reply_outbox,
+    describe_upload,
+    prepare_email,
+    DOWNLOAD_CHUNK_SIZE,
+    MAX_RECIPIENT_CSV_SIZE,
+    attachment_cache,
+    spool,
+    SPOOL_FULL_MESSAGE,
+    FILE_TOO_LARGE_MESSAGE,
+    download_size,
+    UPDATE_SECONDS,
+    UPDATE_ERRORS,
+)
+from app.models.bulk_mail import parse_recipient_csv
+from app.models.delivery_queue import send_failure
+from app.models.session import Step
+from app.models.spool import SpoolFull
+from app.models.telegram_client import FileTooLarge
+from app.models.async_telegram_client import AsyncTelegramClient, load_aiohttp
+from utils.lazy import Lazy
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def _create_email_sender():
+    from app.models.async_mail_sender import AsyncEmailSender
+    return AsyncEmailSender()
+
+
+# aiohttp and aiosmtplib are imported on first use (or by warm_up), not at startup
+telegram = AsyncTelegramClient()
+email_sender = Lazy(_create_email_sender)
+
+# Delivery tasks run detached from the request; keep references so they aren't GC'd
+_delivery_tasks = set()
+
+
+async def send_message(chat_id, text):
+    """Queue a message on the shared outbound scheduler (never blocks the loop)"""
+    return handlers.send_message(chat_id, text)
+
+
+async def handle_command_async(data):
+    """Async twin of handle_command
+
+    Steps that do network I/O have async handlers below.  Everything else
+    (session steps, commands such as /calculate and /remindme) runs through
+    the regular handler table in a worker thread, with its replies captured
+    and then queued from the loop.  Session store, spool, cache and journal
+    calls can block (a Redis or session-server round trip, disk I/O), so
+    they run in worker threads too.
+    """
+    try:
+        message = data['message']
+        chat_id = message['chat']['id']
+        session = await asyncio.to_thread(user_sessions.get, chat_id)
+        if session is not None and message.get('text') != '/cancel':
+            handler = ASYNC_STEP_HANDLERS.get(session.step)
+            if handler:
+                start = time.perf_counter()
+                success = False
+                try:
+                    result = await handler(chat_id, message, session)
+                    success = True
+                    return result
+                except Exception:
+                    UPDATE_ERRORS.inc(session.step.value)
+                    raise
+                finally:
+                    UPDATE_SECONDS.observe(time.perf_counter() - start, session.step.value)
+                    handlers.log_update(data, session.step.value, success, start)
+    except Exception:
+        log.exception("handle_command_async failed")
+        return f"An error occurred. Please try again with /send_mail"
+
+    return await run_sync_handler(handlers.handle_command, data)
+
+
+async def handle_file_upload_async(chat_id, message, session):
+    """Process file or photo upload"""
+    try:
+        upload = describe_upload(message, session)
+        if upload is None:
+            return await send_message(chat_id, "Please send a valid file or photo.")
+        file_id, file_type, filename, file_unique_id = upload
+
+        local_filename = await asyncio.to_thread(spool.allocate, chat_id, filename, handlers.upload_size(message))
+        try:
+            file_key = attachment_cache.key_for(file_unique_id)
+            if not await asyncio.to_thread(attachment_cache.get, file_key, local_filename):
+                file_info = await telegram.get_file(file_id)
+                tmp_path = await asyncio.to_thread(attachment_cache.temp_path) or local_filename
+                try:
+                    await telegram.download_file(file_info['file_path'], tmp_path, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                                 max_size=download_size(file_info, handlers.upload_size(message)))
+                except BaseException:
+                    if tmp_path != local_filename:
+                        await asyncio.to_thread(_remove, tmp_path)
+                    raise
+                # put() may hash the file when there is no file_unique_id
+                file_key = await asyncio.to_thread(attachment_cache.put, file_key, tmp_path, local_filename) \
+                    if tmp_path != local_filename else None
+        except BaseException:
+            await asyncio.to_thread(spool.release, local_filename)
+            raise
+        await asyncio.to_thread(spool.settle, local_filename)
+
+        return await run_sync_handler(handlers.file_received, chat_id, session, local_filename, file_type, file_key)
+
+    except SpoolFull:
+        return await send_message(chat_id, SPOOL_FULL_MESSAGE)
+    except FileTooLarge:
+        return await send_message(chat_id, FILE_TOO_LARGE_MESSAGE)
+    except Exception:
+        log.exception("File upload failed", extra={'fields': {'chat_id': chat_id}})
+        return await send_message(chat_id, "Failed to process the file. Please try again.")
+
+
+async def handle_recipients_async(chat_id, message, session):
+    """Download an uploaded recipient CSV without blocking the loop; typed lists go the sync way"""
+    document = message.get('document') or {}
+    if not document.get('file_name', '').lower().endswith('.csv') or document.get('file_size', 0) > MAX_RECIPIENT_CSV_SIZE:
+        return await run_sync_handler(handlers.handle_recipients, chat_id, message, session)
+    try:
+        local_filename = await asyncio.to_thread(spool.allocate, chat_id, 'recipients.csv',
+                                                 document.get('file_size', 0))
+        try:
+            file_info = await telegram.get_file(document['file_id'])
+            await telegram.download_file(file_info['file_path'], local_filename, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                         max_size=download_size(file_info, document.get('file_size', 0),
+                                                                MAX_RECIPIENT_CSV_SIZE))
+            recipients, invalid = await asyncio.to_thread(parse_recipient_csv, local_filename)
+        finally:
+            await asyncio.to_thread(spool.release, local_filename)
+    except SpoolFull:
+        return await send_message(chat_id, SPOOL_FULL_MESSAGE)
+    except FileTooLarge:
+        return await send_message(chat_id, "That CSV file is too large.")
+    except Exception as e:
+        log.warning("Recipient CSV failed", extra={'fields': {'chat_id': chat_id, 'error': str(e)}})
+        return await send_message(chat_id, "Failed to read the CSV file. Please try again.")
+
+    if not recipients:
+        return await send_message(chat_id, "No valid email addresses found in that file.")
+    return await run_sync_handler(handlers.recipients_received, chat_id, session, recipients, invalid)
+
+
+async def run_sync_handler(handler, *args):
+    """Run a sync handler in a worker thread with its replies captured, then send them"""
+    replies = []
+    token = reply_outbox.set(replies)
+    try:
+        # to_thread runs the handler in a copy of this context, so reply_outbox still captures
+        result = await asyncio.to_thread(handler, *args)
+    finally:
+        reply_outbox.reset(token)
+    for reply_chat_id, text in replies:
+        result = await send_message(reply_chat_id, text)
+    return result
+
+
+async def send_content_async(chat_id, message, session):
+    """Start delivery in a background task and acknowledge right away"""
+    if 'text' not in message:
+        return await send_message(chat_id, "Please enter a subject for your email.")
+    try:
+        email = await asyncio.to_thread(prepare_email, session, message['text'])
+    except FileNotFoundError as e:
+        return await send_message(chat_id, str(e))
+
+    await asyncio.to_thread(user_sessions.delete, chat_id)
+    # Counted as in flight until deliver() ends, so the journal keeps the chat's updates
+    # and the spool sweeper keeps the attachment through retries
+    handlers.delivery_started(chat_id)
+    task = asyncio.create_task(deliver(chat_id, email, session.content_type))
+    _delivery_tasks.add(task)
+    task.add_done_callback(_delivery_tasks.discard)
+    return await send_message(chat_id, f"Sending your email to {email.to_email}...")
+
+
+async def deliver(chat_id, email, content_type=None, base_delay=1.0):
+    """Send with exponential backoff, then report the outcome to the chat
+
+    As in DeliveryQueue, an exception counts as a failed attempt and only
+    transient failures are retried.  However the sending ends, the outcome
+    is logged, the email's files are removed and the chat is told.
+    """
+    queued_at = time.perf_counter()
+    success, result = False, "Failed to send email"
+    try:
+        for attempt in range(DELIVERY_MAX_ATTEMPTS):
+            try:
+                if email.file_path or email.bulk is not None:
+                    # Attachments keep the streaming, constant-memory sender and bulk
+                    # sends pipeline over one smtplib session; both run in a worker
+                    # thread so the event loop is never blocked on them
+                    success, result = await asyncio.to_thread(handlers.deliver_email, email)
+                else:
+                    success, result = await email_sender.send_text_email(email.to_email, email.subject, email.body)
+            except Exception as e:
+                success, result = False, send_failure(e)
+            if success or not getattr(result, 'transient', True):
+                break
+            if attempt + 1 < DELIVERY_MAX_ATTEMPTS:
+                await asyncio.sleep(base_delay * 2 ** attempt)
+        if not success:
+            log.warning("Delivery failed", extra={'fields': {
+                'chat_id': chat_id, 'attempts': attempt + 1, 'error': result}})
+    finally:
+        try:
+            handlers.log_delivery(chat_id, content_type, email, success, queued_at)
+            await asyncio.to_thread(email.cleanup)
+            await send_message(chat_id, email.result_text(success, result))
+        finally:
+            # May close the chat's journal entries (SQLite)
+            await asyncio.to_thread(handlers.delivery_finished, chat_id)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def close():
+    """Finish in-flight deliveries and close network clients"""
+    if _delivery_tasks:
+        await asyncio.gather(*_delivery_tasks, return_exceptions=True)
+    await asyncio.to_thread(handlers.outbound.flush, handlers.outbound.exit_timeout)
+    if email_sender.resolved:
+        await email_sender.close()
+    await telegram.close()
+
+
+def warm_up():
+    """handlers.warm_up plus the async clients' stacks"""
+    return handlers.warm_up(email_sender.resolve, load_aiohttp)
+
+
+# Steps whose work is network-bound get native async handlers
+ASYNC_STEP_HANDLERS = {
+    Step.WAITING_FOR_EMAIL: handle_recipients_async,
+    Step.WAITING_FOR_FILE: handle_file_upload_async,
+    Step.WAITING_FOR_SUBJECT: send_content_async,
+}
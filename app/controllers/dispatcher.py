@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from config.settings import DISPATCH_WORKERS, DISPATCH_QUEUE_SIZE
+from app.controllers.handlers import handle_command
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class Shard:
+    """One worker thread with its own bounded queue and timing counters"""
+
+    def __init__(self, index, queue_size):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.errors = 0
+        self.wait_total = 0.0
+        self.busy_total = 0.0
+        self.busy_max = 0.0
+        self.thread = None
+
+    def stats(self):
+        processed = self.processed or 1
+        return {
+            'shard': self.index,
+            'depth': self.queue.qsize(),
+            'processed': self.processed,
+            'errors': self.errors,
+            'avg_wait': self.wait_total / processed,
+            'avg_processing': self.busy_total / processed,
+            'max_processing': self.busy_max,
+        }
+
+
+class Dispatcher:
+    """Shards updates by chat_id onto a fixed pool of workers
+
+    All updates of one chat land on the same shard, so they are handled
+    strictly in arrival order and never race on that chat's session, while
+    different chats proceed in parallel on other shards.  Each shard queue
+    is bounded; ``submit`` reports a full shard instead of growing memory.
+    """
+
+    def __init__(self, handler=handle_command, workers=None, queue_size=DISPATCH_QUEUE_SIZE):
+        self.handler = handler
+        self.shards = [Shard(i, queue_size) for i in range(workers or DISPATCH_WORKERS or 1)]
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Start the shard workers (idempotent, so it is safe to call after fork)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for shard in self.shards:
+                shard.thread = threading.Thread(target=self._worker, args=(shard,),
+                                                name=f"dispatch-{shard.index}", daemon=True)
+                shard.thread.start()
+
+    def shard_for(self, chat_id):
+        """The chat's shard; updates without a usable chat id all go to shard 0"""
+        try:
+            return self.shards[hash(chat_id) % len(self.shards)] if chat_id is not None else self.shards[0]
+        except TypeError:  # unhashable id in a malformed update
+            return self.shards[0]
+
+    def submit(self, update, timeout=0.5):
+        """Queue an update on its chat's shard; returns False if the shard stayed full"""
+        self.start()
+        message = update.get('message')
+        chat = message.get('chat') if isinstance(message, dict) else None
+        chat_id = chat.get('id') if isinstance(chat, dict) else None
+        try:
+            self.shard_for(chat_id).queue.put((update, time.monotonic()), timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def _worker(self, shard):
+        while True:
+            update, enqueued_at = shard.queue.get()
+            started = time.monotonic()
+            try:
+                self.handler(update)
+            except Exception:
+                shard.errors += 1
+                log.exception("Update handler failed", extra={'fields': {'shard': shard.index}})
+            finally:
+                busy = time.monotonic() - started
+                shard.processed += 1
+                shard.wait_total += started - enqueued_at
+                shard.busy_total += busy
+                shard.busy_max = max(shard.busy_max, busy)
+                shard.queue.task_done()
+
+    def join(self):
+        """Wait until every queued update has been handled"""
+        for shard in self.shards:
+            shard.queue.join()
+
+    def stats(self):
+        shards = [shard.stats() for shard in self.shards]
+        return {
+            'workers': len(self.shards),
+            'depth': sum(s['depth'] for s in shards),
+            'processed': sum(s['processed'] for s in shards),
+            'shards': shards,
+        }
@@ -1,84 +1,250 @@
-import requests
 import time
-from config.settings import BOT_TOKEN
-from app.models.mail_sender import EmailSender
+import threading
+import contextvars
+from collections import Counter as _Counter
+from config.settings import (
+    DELIVERY_WORKERS,
+    DELIVERY_QUEUE_SIZE,
+    DELIVERY_MAX_ATTEMPTS,
+    BULK_MAX_RECIPIENTS,
+    SESSION_BACKEND,
+    STARTUP_WARMUP,
+)
+from app.models.delivery_queue import DeliveryQueue, DeliveryJob
+from app.models.bulk_mail import BulkMessage, parse_recipients, parse_recipient_csv
+from app.models.attachment_cache import AttachmentCache
+from app.models.attachment_preprocessor import AttachmentPreprocessor
+from app.models.telegram_client import TelegramClient, FileTooLarge
+from app.models.rate_limiter import OutboundScheduler
+from app.models.session_store import create_session_store
+from app.models.spool import Spool, SpoolFull
+from app.models.session import Session, Step
+from app.models.reminder import scheduler as reminders, parse_duration, MAX_DELAY
+from app.models.calculator import evaluate, CalculationError
+from app.models.update_journal import UpdateJournal
+from app.models.event_store import update_kind
 from app.views import messages
+from utils.lazy import Lazy, in_background
+from utils.logger import get_logger, span
+from utils.metrics import Counter, Gauge, Histogram, directory_size
 import os
 
-# Initialize EmailSender
-email_sender = EmailSender()
+log = get_logger(__name__)
 
-# Store user sessions
-user_sessions = {}
+
+def _create_email_sender():
+    from app.models.mail_sender import EmailSender
+    return EmailSender()
+
+
+# Built on first use: importing the mail stack (smtplib, email.mime) is left
+# out of startup, see warm_up
+email_sender = Lazy(_create_email_sender)
+
+# Shared keep-alive client for every Bot API call (requests is imported on the first call)
+telegram = TelegramClient()
+
+# Replies are queued and sent within Telegram's rate limits; the scheduler
+# retries 429s itself, so the client must not sleep on them
+outbound = OutboundScheduler(
+    lambda chat_id, text: telegram.call('sendMessage', {'chat_id': chat_id, 'text': text}, max_retries=0)
+)
+
+# Emails are sent by background workers so the webhook returns immediately
+delivery_queue = DeliveryQueue(
+    workers=DELIVERY_WORKERS,
+    max_depth=DELIVERY_QUEUE_SIZE,
+    max_attempts=DELIVERY_MAX_ATTEMPTS
+)
+
+# Read size for streaming Telegram file downloads to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+SPOOL_FULL_MESSAGE = "Too many uploads are being processed right now. Please send the file again in a moment."
+FILE_TOO_LARGE_MESSAGE = "That file is too large."
+
+# Re-sent files are linked from here instead of downloaded (and encoded) again
+attachment_cache = AttachmentCache()
+
+# Photos and large documents are shrunk (or split) before sending, by a
+# process pool the delivery workers hand them to (if PREPROCESS_ATTACHMENTS)
+preprocessor = AttachmentPreprocessor()
+
+# When set, send_message collects replies here instead of calling the Bot API
+reply_outbox = contextvars.ContextVar('reply_outbox', default=None)
+
+# Uploads are downloaded into the spool: unique paths, a byte quota, and a
+# sweeper for files nobody is using any more (see upload_in_use)
+spool = Spool()
+
+# Store user sessions (expired sessions get their temp files removed)
+user_sessions = create_session_store(on_evict=lambda session: spool.release(session.file_path))
+
+# Incoming updates are journaled: redeliveries are dropped and unfinished
+# conversations are replayed after a restart
+journal = UpdateJournal()
+
+# chat_id -> emails queued but not yet reported back; the chat's journal
+# entries are kept until these finish so a crash re-sends rather than loses them
+deliveries_in_flight = _Counter()
+_deliveries_lock = threading.Lock()
+
+# Per-update cost by conversation step ('command' = no conversation in progress)
+UPDATE_SECONDS = Histogram('tsb_update_seconds', 'Time to handle one update, by session step', ['step'])
+UPDATE_ERRORS = Counter('tsb_update_errors_total', 'Updates whose handler raised, by session step', ['step'])
+Gauge('tsb_active_sessions', 'Conversations in progress', lambda: len(user_sessions),
+      mode='max' if SESSION_BACKEND == 'redis' else 'sum')
+Gauge('tsb_disk_usage_bytes', 'Bytes held by spooled uploads and the attachment cache',
+      lambda: {('spool',): sum(directory_size(root) for root in spool.roots),
+               ('attachment_cache',): attachment_cache.stats()['bytes']},
+      ['directory'], mode='max')
 
 def handle_command(data):
     """Process incoming message and execute corresponding command"""
+    step = 'command'
+    success = True
+    start = time.perf_counter()
     try:
         message = data['message']
         chat_id = message['chat']['id']
+        text = message.get('text')
 
         # Check for cancel command first
-        if 'text' in message and message['text'] == '/cancel':
-            if chat_id in user_sessions:
+        if text == '/cancel':
+            session = user_sessions.get(chat_id)
+            if session is not None:
+                spool.release(session.file_path)
                 del user_sessions[chat_id]
                 return send_message(chat_id, "Operation cancelled. You can start again with /send_mail")
 
-        # Handle ongoing session
-        if chat_id in user_sessions:
-            session = user_sessions[chat_id]
-
-            # Handle each state
-            if session['step'] == 'waiting_for_email':
-                if 'text' not in message:
-                    return send_message(chat_id, "Please enter a valid email address.")
-                return ask_for_content_type(chat_id, message['text'])
-                
-            elif session['step'] == 'waiting_for_content_type':
-                if 'text' not in message:
-                    return send_message(chat_id, "Please enter a number between 1 and 3.")
-                return ask_for_subject(chat_id, message['text'])
-                
-            elif session['step'] == 'waiting_for_text_message':
-                if 'text' not in message:
-                    return send_message(chat_id, "Please enter your message text.")
-                return handle_text_message(chat_id, message['text'])
-
-            elif session['step'] == 'waiting_for_rename':
-                return handle_rename_choice(chat_id, message)
-
-            elif session['step'] == 'waiting_for_new_name':
-                return handle_new_name(chat_id, message)
-                
-            elif session['step'] == 'waiting_for_file':
-                return handle_file_upload(chat_id, message)
-                
-            elif session['step'] == 'waiting_for_description':
-                return handle_description(chat_id, message)
-                
-            elif session['step'] == 'waiting_for_subject':
-                if 'text' not in message:
-                    return send_message(chat_id, "Please enter a subject for your email.")
-                return send_content(chat_id, message['text'])
+        # Handle ongoing session: one table lookup picks the step handler
+        session = user_sessions.get(chat_id)
+        if session is not None:
+            step = session.step.value
+            return STEP_HANDLERS[session.step](chat_id, message, session)
 
         # Handle initial commands
-        if 'text' in message:
-            text = message['text']
-            if text.startswith('/start'):
-                return handle_start(chat_id)
-            elif text.startswith('/help'):
-                return handle_help(chat_id)
-            elif text.startswith('/send_mail'):
-                return initiate_send_mail(chat_id)
-            else:
-                return send_message(chat_id, "Sorry, I don't recognize that command. Type /help for a list of commands.")
+        if text is not None:
+            parts = text.split(maxsplit=1)
+            command = parts[0].split('@', 1)[0] if parts else ''
+            handler = COMMAND_HANDLERS.get(command)
+            if handler:
+                return handler(chat_id, parts[1] if len(parts) > 1 else '')
+            return send_message(chat_id, "Sorry, I don't recognize that command. Type /help for a list of commands.")
         
         return send_message(chat_id, "Please send a text message or use /help for available commands.")
             
-    except Exception as e:
-        print(f"Error in handle_command: {str(e)}")
+    except Exception:
+        success = False
+        UPDATE_ERRORS.inc(step)
+        log.exception("handle_command failed")
         return f"An error occurred. Please try again with /send_mail"
-
-def handle_start(chat_id):
+    finally:
+        UPDATE_SECONDS.observe(time.perf_counter() - start, step)
+        log_update(data, step, success, start)
+
+def log_update(data, step, success, start):
+    """Record one handled update and how long it took (the analytics CLI's default throughput)"""
+    message = data.get('message') if isinstance(data, dict) else None
+    message = message if isinstance(message, dict) else {}
+    chat = message.get('chat')
+    log.info("update", extra={'fields': {
+        'span': 'update', 'chat_id': chat.get('id') if isinstance(chat, dict) else None,
+        'content_type': update_kind(message), 'step': step, 'success': success,
+        'duration_ms': round((time.perf_counter() - start) * 1000, 3)}})
+
+def process_update(data):
+    """handle_command for an update already accepted by journal.record"""
+    try:
+        return handle_command(data)
+    finally:
+        finish_update(data)
+
+def finish_update(data):
+    """Journal bookkeeping once an update has been handled"""
+    if not journal.enabled:
+        return
+    journal.handled(data)
+    chat_id = ((data.get('message') or {}).get('chat') or {}).get('id')
+    if chat_id is not None:
+        close_if_idle(chat_id)
+
+def close_if_idle(chat_id):
+    """Let the journal drop a chat's updates once no conversation or delivery is left"""
+    with _deliveries_lock:
+        busy = deliveries_in_flight[chat_id] > 0
+    if not busy and user_sessions.get(chat_id) is None:
+        journal.close(chat_id)
+
+def delivery_started(chat_id):
+    with _deliveries_lock:
+        deliveries_in_flight[chat_id] += 1
+
+def delivery_finished(chat_id, close=True):
+    with _deliveries_lock:
+        deliveries_in_flight[chat_id] -= 1
+        if deliveries_in_flight[chat_id] <= 0:
+            del deliveries_in_flight[chat_id]
+    if close and journal.enabled:
+        close_if_idle(chat_id)
+
+_replayed = False
+
+def replay_journal():
+    """Rebuild unfinished conversations from the journal after a restart (once per process)
+
+    Updates that were handled before are replayed with their replies
+    swallowed, since the user has seen them; updates that never finished
+    are handled normally.  An email whose delivery was not confirmed is
+    queued again.  Only in-memory sessions are rebuilt: Redis sessions
+    survive restarts on their own.  With the shared session server only the
+    first worker to start replays, and only while the server is fresh - a
+    worker replaced in a graceful reload finds the sessions still there.
+    """
+    global _replayed
+    if _replayed or not journal.enabled or SESSION_BACKEND not in ('memory', 'shared'):
+        return 0
+    _replayed = True
+    if SESSION_BACKEND == 'shared' and not user_sessions.claim('journal-replay'):
+        return 0
+    pending = journal.pending()
+    for update, handled in pending:
+        token = reply_outbox.set([]) if handled else None
+        try:
+            process_update(update)
+        finally:
+            if token is not None:
+                reply_outbox.reset(token)
+    if pending:
+        log.info("Journal replayed", extra={'fields': {'updates': len(pending)}})
+    return len(pending)
+
+def warm_up(*steps):
+    """Build the lazy singletons in a background thread once the server is up (if STARTUP_WARMUP)
+
+    Startup skips importing the mail stack and requests; this loads them
+    right after, so the first email or Bot API call finds them ready.
+    ``steps`` are extra callables to run in the same thread.
+    """
+    if not STARTUP_WARMUP:
+        return None
+    return in_background('warmup', email_sender.resolve, lambda: telegram.session, *steps)
+
+def shutdown(timeout=30):
+    """Finish queued emails and replies before the process exits; False if time ran out
+
+    For graceful restarts: a worker that is being replaced stops taking
+    requests, then calls this so nothing it accepted is lost.
+    """
+    deadline = time.monotonic() + timeout
+    delivered = delivery_queue.join(timeout)
+    if not delivered:
+        delivery_queue.cancel_retries()
+    replied = outbound.flush(max(0.0, deadline - time.monotonic()))
+    log.info("Drained", extra={'fields': {'deliveries': delivered, 'replies': replied}})
+    return delivered and replied
+
+def handle_start(chat_id, args=''):
     """Send welcome message"""
     start_text = (
         "Welcome to TaskSimplifierBot!\n"
@@ -87,13 +253,17 @@ def handle_start(chat_id):
     )
     return send_message(chat_id, start_text)
 
-def handle_help(chat_id):
+def handle_help(chat_id, args=''):
     """Send help message"""
     help_message = (
         "Available commands:\n\n"
         "/start - Start the bot\n"
         "/help - Show this help message\n"
-        "/send_mail - Send an email\n"
+        "/send_mail - Send an email (to several people: separate addresses with commas or upload a CSV)\n"
+        "/remindme <time> <task> - Set a reminder (e.g. /remindme 10m check the oven)\n"
+        "/reminders - List your pending reminders\n"
+        "/cancel_reminder <id> - Cancel a reminder\n"
+        "/calculate <expression> - Evaluate math (e.g. /calculate sum(x^2 for x in 1..100))\n"
         "/cancel - Cancel current operation\n\n"
         "When sending mail, you can:\n"
         "1. Send text messages\n"
@@ -102,25 +272,71 @@ def handle_help(chat_id):
     )
     return send_message(chat_id, help_message)
 
-def initiate_send_mail(chat_id):
+def initiate_send_mail(chat_id, args=''):
     """Start email sending process"""
-    user_sessions[chat_id] = {
-        'step': 'waiting_for_email',
-        'start_time': time.time()
-    }
-    return send_message(chat_id, "Please enter the recipient's email address:")
+    user_sessions[chat_id] = Session(step=Step.WAITING_FOR_EMAIL)
+    return send_message(chat_id, "Please enter the recipient's email address (separate several with commas, or upload a CSV file):")
 
-def ask_for_content_type(chat_id, email):
+def ask_for_content_type(chat_id, email, session):
     """Handle email input and ask for content type"""
-    if '@' not in email or '.' not in email:
+    recipients, invalid = parse_recipients(email)
+    if not recipients:
         return send_message(chat_id, "Please enter a valid email address.")
+    return recipients_received(chat_id, session, recipients, invalid)
+
+# Upper bound on the size of an uploaded recipient CSV
+MAX_RECIPIENT_CSV_SIZE = 1024 * 1024
+
+def handle_recipients(chat_id, message, session):
+    """Read recipients from an uploaded CSV file, or fall back to a typed address list"""
+    if 'text' in message:
+        return ask_for_content_type(chat_id, message['text'], session)
 
-    user_sessions[chat_id].update({
-        'email': email,
-        'step': 'waiting_for_content_type'
-    })
+    document = message.get('document') or {}
+    if not document.get('file_name', '').lower().endswith('.csv'):
+        return send_message(chat_id, "Please enter a valid email address or upload a CSV file of addresses.")
+    if document.get('file_size', 0) > MAX_RECIPIENT_CSV_SIZE:
+        return send_message(chat_id, "That CSV file is too large.")
 
+    try:
+        local_filename = spool.allocate(chat_id, 'recipients.csv', document.get('file_size', 0))
+        try:
+            file_info = telegram.get_file(document['file_id'])
+            telegram.download_file(file_info['file_path'], local_filename, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                   max_size=download_size(file_info, document.get('file_size', 0),
+                                                         MAX_RECIPIENT_CSV_SIZE))
+            recipients, invalid = parse_recipient_csv(local_filename)
+        finally:
+            spool.release(local_filename)
+    except SpoolFull:
+        return send_message(chat_id, SPOOL_FULL_MESSAGE)
+    except FileTooLarge:
+        return send_message(chat_id, "That CSV file is too large.")
+    except Exception as e:
+        log.warning("Recipient CSV failed", extra={'fields': {'chat_id': chat_id, 'error': str(e)}})
+        return send_message(chat_id, "Failed to read the CSV file. Please try again.")
+
+    if not recipients:
+        return send_message(chat_id, "No valid email addresses found in that file.")
+    return recipients_received(chat_id, session, recipients, invalid)
+
+def recipients_received(chat_id, session, recipients, invalid):
+    """Record one or more recipients on the session and ask for the content type"""
+    if len(recipients) > BULK_MAX_RECIPIENTS:
+        return send_message(chat_id, f"Too many recipients ({len(recipients)}). The limit is {BULK_MAX_RECIPIENTS}.")
+
+    session.email = recipients[0]
+    session.recipients = recipients if len(recipients) > 1 else None
+    session.step = Step.WAITING_FOR_CONTENT_TYPE
+    user_sessions[chat_id] = session
+
+    notes = ""
+    if session.recipients:
+        notes += f"Bulk mode: {len(recipients)} recipients.\n"
+    if invalid:
+        notes += f"Skipped {len(invalid)} invalid address(es): {', '.join(invalid[:5])}\n"
     content_message = (
+        f"{notes}"
         "What type of content would you like to send?\n"
         "1. Text message\n"
         "2. Photo\n"
@@ -129,217 +345,370 @@ def ask_for_content_type(chat_id, email):
     )
     return send_message(chat_id, content_message)
 
-def ask_for_subject(chat_id, content_type):
-    """Process content type selection"""
-    try:
-        choice = content_type.strip()
-        if choice not in ['1', '2', '3']:
-            return send_message(chat_id, "Invalid choice. Please enter a number between 1 and 3.")
-
-        content_types = {
-            '1': ('text', 'waiting_for_text_message', "Please enter the text message you want to send:"),
-            '2': ('photo', 'waiting_for_rename', "Would you like to rename your photo?\n1. Yes\n2. No (use original name)"),
-            '3': ('file', 'waiting_for_rename', "Would you like to rename your file?\n1. Yes\n2. No (use original name)")
-        }
-
-        content_type, step, message = content_types[choice]
-        user_sessions[chat_id].update({
-            'content_type': content_type,
-            'step': step
-        })
-        return send_message(chat_id, message)
+# Content type menu: choice -> (content type, next step, prompt)
+CONTENT_TYPES = {
+    '1': ('text', Step.WAITING_FOR_TEXT_MESSAGE, "Please enter the text message you want to send:"),
+    '2': ('photo', Step.WAITING_FOR_RENAME, "Would you like to rename your photo?\n1. Yes\n2. No (use original name)"),
+    '3': ('file', Step.WAITING_FOR_RENAME, "Would you like to rename your file?\n1. Yes\n2. No (use original name)")
+}
 
-    except Exception as e:
-        print(f"Error in ask_for_subject: {str(e)}")
+def ask_for_subject(chat_id, content_type, session):
+    """Process content type selection"""
+    choice = CONTENT_TYPES.get(content_type.strip())
+    if choice is None:
         return send_message(chat_id, "Invalid choice. Please enter a number between 1 and 3.")
 
-def handle_text_message(chat_id, message):
+    session.content_type, session.step, message = choice
+    user_sessions[chat_id] = session
+    return send_message(chat_id, message)
+
+def handle_text_message(chat_id, message, session):
     """Handle text message input"""
-    user_sessions[chat_id].update({
-        'text_message': message,
-        'step': 'waiting_for_subject'
-    })
+    session.text_message = message
+    session.step = Step.WAITING_FOR_SUBJECT
+    user_sessions[chat_id] = session
     return send_message(chat_id, "Please enter the subject for your email (or type 'skip' for default subject):")
 
-def handle_rename_choice(chat_id, message):
+def handle_rename_choice(chat_id, choice, session):
     """Handle file rename choice"""
-    if 'text' not in message:
-        return send_message(chat_id, "Please enter 1 for Yes or 2 for No.")
-
-    choice = message['text'].strip()
+    choice = choice.strip()
     if choice not in ['1', '2']:
         return send_message(chat_id, "Invalid choice. Please enter 1 for Yes or 2 for No.")
 
+    noun = 'photo' if session.content_type == 'photo' else 'file'
     if choice == '1':
-        user_sessions[chat_id].update({
-            'step': 'waiting_for_new_name'
-        })
-        content_type = user_sessions[chat_id]['content_type']
-        message = "Please enter the new name for your photo:" if content_type == 'photo' else "Please enter the new name for your file:"
-        return send_message(chat_id, message)
+        session.step = Step.WAITING_FOR_NEW_NAME
+        message = f"Please enter the new name for your {noun}:"
     else:
-        user_sessions[chat_id].update({
-            'step': 'waiting_for_file'
-        })
-        content_type = user_sessions[chat_id]['content_type']
-        message = "Please upload the photo:" if content_type == 'photo' else "Please upload the file:"
-        return send_message(chat_id, message)
-
-def handle_new_name(chat_id, message):
-    """Handle new filename input"""
-    if 'text' not in message:
-        return send_message(chat_id, "Please enter a valid name.")
-
-    new_name = message['text'].strip()
-    user_sessions[chat_id].update({
-        'new_filename': new_name,
-        'step': 'waiting_for_file'
-    })
-    
-    content_type = user_sessions[chat_id]['content_type']
-    message = "Please upload the photo:" if content_type == 'photo' else "Please upload the file:"
+        session.step = Step.WAITING_FOR_FILE
+        message = f"Please upload the {noun}:"
+    user_sessions[chat_id] = session
     return send_message(chat_id, message)
 
-def handle_file_upload(chat_id, message):
-    """Process file or photo upload"""
-    try:
-        print(f"Message data: {message}")  # Debug print
-        
-        file_id = None
-        file_type = None
-        file_extension = None
-
-        if 'photo' in message:
-            file_id = message['photo'][-1]['file_id']
-            file_type = 'photo'
-            file_extension = '.jpg'
-            original_filename = f'photo_{int(time.time())}.jpg'
-        elif 'document' in message:
-            file_id = message['document']['file_id']
-            file_type = 'document'
-            original_filename = message['document']['file_name']
-            file_extension = os.path.splitext(original_filename)[1]
-        else:
-            return send_message(chat_id, "Please send a valid file or photo.")
-
-        # Use custom filename if provided
-        session = user_sessions[chat_id]
-        if 'new_filename' in session:
-            # Add original extension to new filename if needed
-            if not session['new_filename'].endswith(file_extension):
-                filename = session['new_filename'] + file_extension
-            else:
-                filename = session['new_filename']
-        else:
-            filename = original_filename
-
-        # Get file info from Telegram
-        file_info_url = f'https://api.telegram.org/bot{BOT_TOKEN}/getFile?file_id={file_id}'
-        file_info = requests.get(file_info_url).json()
-        
-        print(f"File info: {file_info}")  # Debug print
-        
-        if file_info.get('ok'):
-            file_path = file_info['result']['file_path']
-            file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-            
-            print(f"File URL: {file_url}")  # Debug print
-            
-            # Download the file
-            response = requests.get(file_url)
-            file_content = response.content
-            
-            # Create temp directory if it doesn't exist
-            os.makedirs('temp_files', exist_ok=True)
-            
-            # Save file locally with absolute path
-            local_filename = os.path.abspath(os.path.join('temp_files', filename))
-            with open(local_filename, 'wb') as f:
-                f.write(file_content)
-            
-            user_sessions[chat_id].update({
-                'file_path': local_filename,
-                'file_type': file_type,
-                'step': 'waiting_for_description'
-            })
+def handle_new_name(chat_id, new_name, session):
+    """Handle new filename input"""
+    session.new_filename = new_name.strip()
+    session.step = Step.WAITING_FOR_FILE
+    user_sessions[chat_id] = session
+
+    noun = 'photo' if session.content_type == 'photo' else 'file'
+    return send_message(chat_id, f"Please upload the {noun}:")
+
+def describe_upload(message, session):
+    """Return (file_id, file_type, filename, file_unique_id) for an uploaded photo/document, or None"""
+    if 'photo' in message:
+        file_id = message['photo'][-1]['file_id']
+        file_unique_id = message['photo'][-1].get('file_unique_id')
+        file_type = 'photo'
+        file_extension = '.jpg'
+        original_filename = f'photo_{int(time.time())}.jpg'
+    elif 'document' in message:
+        file_id = message['document']['file_id']
+        file_unique_id = message['document'].get('file_unique_id')
+        file_type = 'document'
+        original_filename = message['document']['file_name']
+        file_extension = os.path.splitext(original_filename)[1]
+    else:
+        return None
 
-            return send_message(chat_id, f"{file_type.title()} received! Would you like to add a description? (or type 'skip' to proceed without description):")
+    # Use custom filename if provided
+    if session.new_filename:
+        # Add original extension to new filename if needed
+        if not session.new_filename.endswith(file_extension):
+            filename = session.new_filename + file_extension
         else:
-            return send_message(chat_id, "Failed to process the file. Please try again.")
+            filename = session.new_filename
+    else:
+        filename = original_filename
+    return file_id, file_type, filename, file_unique_id
+
+def upload_size(message):
+    """The size Telegram reports for an uploaded photo/document (0 if it does not say)"""
+    if 'photo' in message:
+        return message['photo'][-1].get('file_size', 0)
+    return (message.get('document') or {}).get('file_size', 0)
+
+def download_size(file_info, reported, ceiling=None):
+    """Most bytes a download may write: the size getFile or the message reports, within ceiling
+
+    None when neither says, so the client applies TELEGRAM_DOWNLOAD_MAX_MB.
+    """
+    size = file_info.get('file_size') or reported or ceiling
+    return min(size, ceiling) if size and ceiling else size
+
+def upload_in_use(chat_id, path):
+    """Whether a spooled file still belongs to a conversation or to an email being sent"""
+    session = user_sessions.peek(chat_id)
+    if session is not None and session.file_path == path:
+        return True
+    with _deliveries_lock:
+        return deliveries_in_flight[chat_id] > 0
+
+def file_received(chat_id, session, local_filename, file_type, file_key=None):
+    """Record a downloaded file on the session and ask for a description"""
+    session.file_path = local_filename
+    session.file_type = file_type
+    session.file_key = file_key
+    session.step = Step.WAITING_FOR_DESCRIPTION
+    user_sessions[chat_id] = session
+
+    return send_message(chat_id, f"{file_type.title()} received! Would you like to add a description? (or type 'skip' to proceed without description):")
+
+def handle_file_upload(chat_id, message, session):
+    """Process file or photo upload"""
+    try:
+        log.debug("File upload", extra={'fields': {'chat_id': chat_id}})
 
-    except Exception as e:
-        print(f"Error in handle_file_upload: {str(e)}")  # Debug print
+        upload = describe_upload(message, session)
+        if upload is None:
+            return send_message(chat_id, "Please send a valid file or photo.")
+        file_id, file_type, filename, file_unique_id = upload
+
+        def download(path):
+            # Get file info from Telegram
+            with span(log, 'telegram.getFile'):
+                file_info = telegram.get_file(file_id)
+
+            # Stream the download straight to disk instead of holding it in memory
+            with span(log, 'telegram.download', bytes=file_info.get('file_size')):
+                telegram.download_file(file_info['file_path'], path, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                       max_size=download_size(file_info, upload_size(message)))
+
+        # A file seen before is linked from the cache without touching the Bot API
+        local_filename = spool.allocate(chat_id, filename, upload_size(message))
+        try:
+            file_key = attachment_cache.fetch(attachment_cache.key_for(file_unique_id), download, local_filename)
+        except BaseException:
+            spool.release(local_filename)
+            raise
+        spool.settle(local_filename)
+
+        return file_received(chat_id, session, local_filename, file_type, file_key)
+
+    except SpoolFull:
+        # Keep the session waiting for the file so the user can just send it again
+        return send_message(chat_id, SPOOL_FULL_MESSAGE)
+    except FileTooLarge:
+        return send_message(chat_id, FILE_TOO_LARGE_MESSAGE)
+    except Exception:
+        log.exception("File upload failed", extra={'fields': {'chat_id': chat_id}})
         return send_message(chat_id, "Failed to process the file. Please try again.")
 
-def handle_description(chat_id, message):
+def handle_description(chat_id, description, session):
     """Handle file/photo description input"""
-    if 'text' not in message:
-        return send_message(chat_id, "Please enter a description or type 'skip'.")
-
-    description = message['text']
-    user_sessions[chat_id].update({
-        'description': None if description.lower() == 'skip' else description,
-        'step': 'waiting_for_subject'
-    })
+    session.description = None if description.lower() == 'skip' else description
+    session.step = Step.WAITING_FOR_SUBJECT
+    user_sessions[chat_id] = session
 
     return send_message(chat_id, "Please enter the subject for your email (or type 'skip' for default subject):")
 
-def send_content(chat_id, subject):
-    """Send the email with content"""
+class OutgoingEmail:
+    """Everything needed to send the email a finished conversation describes"""
+
+    __slots__ = ('to_email', 'subject', 'body', 'file_path', 'file_key', 'bulk', 'parts', 'parts_sent')
+
+    def __init__(self, to_email, subject, body, file_path=None, file_key=None, bulk=None):
+        self.to_email = to_email
+        self.subject = subject
+        self.body = body
+        self.file_path = file_path
+        self.file_key = file_key
+        self.bulk = bulk
+        self.parts = None      # the attachment files to send once preprocessed
+        self.parts_sent = 0    # of a split attachment, kept across retries
+
+    def cleanup(self):
+        """Remove the temp attachment once delivery has finished"""
+        if self.bulk is not None:
+            self.bulk.close()
+        preprocessor.cleanup(self.file_path)
+        spool.release(self.file_path)
+
+    def result_text(self, success, message):
+        if self.bulk is not None:
+            return f"Bulk email finished.\n{message}"
+        status = "sent successfully to" if success else "failed to send to"
+        return f"Content {status} {self.to_email}\n{message}"
+
+def prepare_email(session, subject):
+    """Build the OutgoingEmail for a session; raises FileNotFoundError if the upload is gone"""
+    # Use default subject if skipped
+    if subject.lower() == 'skip':
+        subject = "Message from TaskSimplifier Bot"
+
+    if session.content_type == 'text':
+        email = OutgoingEmail(session.email, subject, session.text_message)
+    else:
+        file_path = session.file_path
+        if not file_path or not os.path.exists(file_path):
+            raise FileNotFoundError("Error: File not found")
+
+        # Create email body with description if provided
+        body = f"Please see the attached {session.file_type}"
+        if session.description:
+            body += f"\n\nDescription: {session.description}"
+        email = OutgoingEmail(session.email, subject, body, file_path, session.file_key)
+
+    if session.recipients:
+        # One message, many recipients: the attachment is encoded once for all of them
+        email.to_email = f"{len(session.recipients)} recipients"
+        email.bulk = BulkMessage(email_sender.sender_email, session.recipients, email.subject,
+                                 email.body, email.file_path)
+    return email
+
+def deliver_email(email):
+    """Send an OutgoingEmail the way its content calls for (runs on a delivery worker)"""
+    if email.file_path and email.parts is None:
+        # Once per email, retries reuse the result; bulk mail is never split
+        email.parts = preprocessor.process(email.file_path, split=email.bulk is None)
+        if email.bulk is not None:
+            email.bulk.file_path = email.parts[0]
+            email.bulk.filename = os.path.basename(email.parts[0])
+    # The cached base64 body is the original file's, so it only fits an unprocessed attachment
+    unchanged = email.parts == [email.file_path]
+    encoded_path = attachment_cache.encoded_path(email.file_key) if email.file_path and unchanged else None
+    if email.bulk is not None:
+        email.bulk.encoded_path = email.bulk.encoded_path or encoded_path
+        return email_sender.send_bulk_email(email.bulk)
+    if email.file_path and len(email.parts) > 1:
+        return send_parts(email)
+    if email.file_path:
+        return email_sender.send_attachment_email(email.to_email, email.subject, email.body, email.parts[0],
+                                                  encoded_path=encoded_path)
+    return email_sender.send_text_email(email.to_email, email.subject, email.body)
+
+def log_delivery(chat_id, content_type, email, success, queued_at):
+    """Record the outcome of a delivery, timed from the moment it was queued (for analytics)"""
+    log.info("email.delivery", extra={'fields': {
+        'span': 'email.delivery', 'chat_id': chat_id, 'content_type': content_type,
+        'bulk': email.bulk is not None, 'parts': len(email.parts or ()), 'success': success,
+        'duration_ms': round((time.perf_counter() - queued_at) * 1000, 3)}})
+
+def send_parts(email):
+    """Send a split attachment as one email per part, skipping parts a previous attempt sent"""
+    count = len(email.parts)
+    joined = os.path.splitext(os.path.basename(email.parts[0]))[0]
+    for index in range(email.parts_sent, count):
+        body = (f"{email.body}\n\nPart {index + 1} of {count} of {joined}. Save all parts and join them "
+                f"in order to restore it (e.g. cat {joined}.* > {joined}).")
+        success, message = email_sender.send_attachment_email(
+            email.to_email, f"{email.subject} ({index + 1}/{count})", body, email.parts[index])
+        if not success:
+            return success, message
+        email.parts_sent = index + 1
+    return True, f"Email with attachment sent successfully in {count} parts!"
+
+def send_content(chat_id, subject, session):
+    """Queue the email for delivery; the result is reported when the job finishes"""
     try:
-        session = user_sessions[chat_id]
-        to_email = session['email']
-        
-        # Use default subject if skipped
-        if subject.lower() == 'skip':
-            subject = "Message from TaskSimplifier Bot"
-
-        # Send based on content type
-        if session['content_type'] == 'text':
-            success, message = email_sender.send_text_email(
-                to_email,
-                subject,
-                session['text_message']
-            )
-        else:
-            file_path = session.get('file_path')
-            if not file_path or not os.path.exists(file_path):
-                return send_message(chat_id, "Error: File not found")
-
-            # Create email body with description if provided
-            description = session.get('description')
-            body = f"Please see the attached {session['file_type']}"
-            if description:
-                body += f"\n\nDescription: {description}"
-
-            success, message = email_sender.send_attachment_email(
-                to_email,
-                subject,
-                body,
-                file_path
-            )
-            try:
-                if file_path and os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                print(f"Error cleaning up file: {str(e)}")
+        try:
+            email = prepare_email(session, subject)
+        except FileNotFoundError as e:
+            return send_message(chat_id, str(e))
+
+        content_type, queued_at = session.content_type, time.perf_counter()
+
+        def on_done(success, message):
+            log_delivery(chat_id, content_type, email, success, queued_at)
+            email.cleanup()
+            send_message(chat_id, email.result_text(success, message))
+            delivery_finished(chat_id)
+
+        delivery_started(chat_id)
+        if not delivery_queue.submit(DeliveryJob(chat_id, lambda: deliver_email(email), on_done)):
+            delivery_finished(chat_id, close=False)
+            # Keep the session so the user can simply resend the subject
+            return send_message(chat_id, "The mail queue is busy right now. Please send the subject again in a moment.")
         del user_sessions[chat_id]
-        
-        status = "sent successfully to" if success else "failed to send to"
-        return send_message(chat_id, f"Content {status} {to_email}\n{message}")
+
+        return send_message(chat_id, f"Sending your email to {email.to_email}...")
 
     except Exception as e:
-        print(f"Error in send_content: {str(e)}")
+        log.exception("send_content failed", extra={'fields': {'chat_id': chat_id}})
         return send_message(chat_id, f"Failed to send email: {str(e)}")
 
-def send_message(chat_id, text):
-    """Send message via Telegram API"""
+def handle_remindme(chat_id, args=''):
+    """Schedule a reminder: /remindme <time> <task>"""
+    parts = args.split(maxsplit=1)
+    delay = parse_duration(parts[0]) if parts else None
+    if delay is None or len(parts) < 2:
+        return send_message(chat_id, "Usage: /remindme <time> <task>\nTime can be minutes (10) or a duration like 30s, 10m, 2h, 1h30m.")
+    if delay > MAX_DELAY:
+        return send_message(chat_id, f"Reminders can be set at most {MAX_DELAY // 86400} days ahead.")
+
+    reminder_id = reminders.schedule(chat_id, parts[1], delay)
+    return send_message(chat_id, f"Reminder set! (id {reminder_id})")
+
+def handle_list_reminders(chat_id, args=''):
+    """List the chat's pending reminders"""
+    pending = reminders.pending(chat_id)
+    if not pending:
+        return send_message(chat_id, "You have no pending reminders.")
+    lines = [f"{reminder_id}: {task} (at {time.strftime('%Y-%m-%d %H:%M', time.localtime(due_at))})"
+             for reminder_id, task, due_at in pending]
+    return send_message(chat_id, "Pending reminders:\n" + "\n".join(lines))
+
+def handle_cancel_reminder(chat_id, args=''):
+    """Cancel one of the chat's reminders by id"""
+    if not args.strip().isdigit():
+        return send_message(chat_id, "Usage: /cancel_reminder <id>")
+    if reminders.cancel(int(args.strip()), chat_id=chat_id):
+        return send_message(chat_id, "Reminder cancelled.")
+    return send_message(chat_id, "No pending reminder with that id.")
+
+def handle_calculate(chat_id, args=''):
+    """Evaluate an expression: /calculate <expression>"""
+    if not args.strip():
+        return send_message(chat_id, "Usage: /calculate <expression>\nExample: /calculate sqrt(2) * 10")
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {"chat_id": chat_id, "text": text}
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
+        result = evaluate(args)
+    except CalculationError as e:
+        return send_message(chat_id, f"Error in calculation: {e}")
+    return send_message(chat_id, f"{args.strip()} = {result}")
+
+def text_step(handler, prompt):
+    """Adapt a handler that needs message text, replying with prompt when there is none"""
+    def step(chat_id, message, session):
+        if 'text' not in message:
+            return send_message(chat_id, prompt)
+        return handler(chat_id, message['text'], session)
+    return step
+
+# Transition table for the /send_mail conversation: step -> handler(chat_id, message, session)
+STEP_HANDLERS = {
+    Step.WAITING_FOR_EMAIL: handle_recipients,
+    Step.WAITING_FOR_CONTENT_TYPE: text_step(ask_for_subject, "Please enter a number between 1 and 3."),
+    Step.WAITING_FOR_TEXT_MESSAGE: text_step(handle_text_message, "Please enter your message text."),
+    Step.WAITING_FOR_RENAME: text_step(handle_rename_choice, "Please enter 1 for Yes or 2 for No."),
+    Step.WAITING_FOR_NEW_NAME: text_step(handle_new_name, "Please enter a valid name."),
+    Step.WAITING_FOR_FILE: handle_file_upload,
+    Step.WAITING_FOR_DESCRIPTION: text_step(handle_description, "Please enter a description or type 'skip'."),
+    Step.WAITING_FOR_SUBJECT: text_step(send_content, "Please enter a subject for your email."),
+}
+
+# Commands available outside of a conversation
+COMMAND_HANDLERS = {
+    '/start': handle_start,
+    '/help': handle_help,
+    '/send_mail': initiate_send_mail,
+    '/remindme': handle_remindme,
+    '/reminders': handle_list_reminders,
+    '/cancel_reminder': handle_cancel_reminder,
+    '/calculate': handle_calculate,
+}
+
+def send_message(chat_id, text):
+    """Queue a message for the chat; the outbound scheduler sends it"""
+    outbox = reply_outbox.get()
+    if outbox is not None:
+        outbox.append((chat_id, text))
         return "Message sent successfully."
-    except Exception as e:
-        print(f"Error sending message: {str(e)}")
-        return "Failed to send message."
\ No newline at end of file
+    if outbound.submit(chat_id, text):
+        return "Message queued."
+    return "Failed to send message."
+
+# Reminders are delivered through the same reply path as everything else
+reminders.send_func = send_message
+
+# The spool sweeper asks before it removes an upload
+spool.in_use = upload_in_use
@@ -0,0 +1,103 @@
+import os
+import threading
+from config.settings import POLL_TIMEOUT, POLL_LIMIT, POLL_WORKERS, POLL_OFFSET_FILE, TELEGRAM_CONNECT_TIMEOUT
+from app.controllers.handlers import process_update, replay_journal, warm_up, journal, telegram, reminders
+from app.controllers.dispatcher import Dispatcher
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class OffsetStore:
+    """Durably remembers the next getUpdates offset in a small file"""
+
+    def __init__(self, path=POLL_OFFSET_FILE):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def write(self, offset):
+        """Atomically replace the stored offset (write, fsync, rename)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class UpdatePoller:
+    """getUpdates long-poll loop feeding batches of updates to handle_command
+
+    Batches are fanned out through a Dispatcher, so every chat's updates run
+    in order on one shard while different chats run in parallel.  The offset
+    is committed only after the whole batch has been handled, so a crash
+    replays the batch rather than losing it.
+    """
+
+    def __init__(self, client=None, handler=process_update, offset_store=None, workers=POLL_WORKERS,
+                 timeout=POLL_TIMEOUT, limit=POLL_LIMIT):
+        self.client = client or telegram
+        self.handler = handler
+        self.offset_store = offset_store or OffsetStore()
+        self.timeout = timeout
+        self.limit = limit
+        self.dispatcher = Dispatcher(handler=handler, workers=workers)
+        self.stop_event = threading.Event()
+        self.processed = 0
+
+    def fetch(self, offset):
+        """Long-poll for the next batch of updates"""
+        return self.client.call(
+            'getUpdates',
+            {'offset': offset, 'timeout': self.timeout, 'limit': self.limit, 'allowed_updates': ['message']},
+            timeout=(TELEGRAM_CONNECT_TIMEOUT, self.timeout + 10)
+        )
+
+    def process_batch(self, updates):
+        """Handle a batch: sequential within a chat, parallel across chats"""
+        messages = [update for update in updates if update.get('message')]
+        # One journal commit for the whole batch; updates handled before a crash are skipped
+        for update, accepted in zip(messages, journal.record_many(messages)):
+            if accepted:
+                # Block rather than drop: the poller is the only producer
+                self.dispatcher.submit(update, timeout=None)
+        self.dispatcher.join()
+        self.processed += len(updates)
+
+    def run(self, delete_webhook=True):
+        """Poll until stop() is called"""
+        if delete_webhook:
+            # getUpdates is refused while a webhook is registered
+            self.client.call('deleteWebhook')
+        reminders.start()
+        replay_journal()
+        warm_up()
+        offset = self.offset_store.read()
+        backoff = 1
+        while not self.stop_event.is_set():
+            try:
+                updates = self.fetch(offset)
+            except Exception as e:
+                log.warning("getUpdates failed", extra={'fields': {'error': str(e), 'backoff': backoff}})
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+            if not updates:
+                continue
+            self.process_batch(updates)
+            offset = updates[-1]['update_id'] + 1
+            self.offset_store.write(offset)
+
+    def stop(self):
+        self.stop_event.set()
+        self.dispatcher.join()
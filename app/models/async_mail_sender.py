@@ -0,0 +1,106 @@
+import asyncio
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import aiosmtplib
+from app.models.mail_sender import (
+    smtp_host,
+    smtp_port,
+    smtp_user,
+    smtp_pass,
+    smtp_starttls,
+    smtp_timeout,
+    smtp_pool_size,
+    CONNECT_SECONDS,
+    SEND_SECONDS,
+    SMTP_ERRORS,
+)
+from app.models.delivery_queue import is_transient, send_failure
+
+
+def _is_transient(error):
+    """is_transient for aiosmtplib's exceptions, whose replies carry ``code`` instead of ``smtp_code``"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(400 <= refused.code < 500 for refused in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 400 <= error.code < 500
+    return is_transient(error)
+
+
+class AsyncEmailSender:
+    """aiosmtplib-based sender for the ASGI server
+
+    Keeps up to ``pool_size`` authenticated connections open and reuses
+    them, mirroring SMTPConnectionPool on the threaded side.
+    """
+
+    def __init__(self, pool_size=smtp_pool_size):
+        self.sender_email = smtp_user
+        self.sender_password = smtp_pass
+        self._idle = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _connect(self):
+        start = time.perf_counter()
+        client = aiosmtplib.SMTP(hostname=smtp_host, port=smtp_port, timeout=smtp_timeout,
+                                 start_tls=smtp_starttls)
+        try:
+            await client.connect()
+            if self.sender_password:
+                await client.login(self.sender_email, self.sender_password)
+        except Exception:
+            SMTP_ERRORS.inc('connect')
+            raise
+        finally:
+            CONNECT_SECONDS.observe(time.perf_counter() - start)
+        return client
+
+    async def _send(self, msg):
+        async with self._slots:
+            client = None
+            while self._idle and client is None:
+                candidate = self._idle.pop()
+                if candidate.is_connected:
+                    client = candidate
+            if client is None:
+                client = await self._connect()
+            try:
+                await client.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected:
+                client = await self._connect()
+                await client.send_message(msg)
+            except Exception:
+                client.close()
+                raise
+            self._idle.append(client)
+
+    async def send_text_email(self, to_email, subject, body):
+        """Send a simple text email"""
+        try:
+            if not all([to_email, subject, body]):
+                raise ValueError("Missing required fields (to_email, subject, or body)")
+
+            msg = MIMEMultipart()
+            msg['From'] = self.sender_email
+            msg['To'] = to_email
+            msg['Subject'] = subject
+            msg.attach(MIMEText(body, 'plain'))
+
+            start = time.perf_counter()
+            try:
+                await self._send(msg)
+            finally:
+                SEND_SECONDS.observe(time.perf_counter() - start, 'text')
+            return True, "Email sent successfully!"
+
+        except Exception as e:
+            SMTP_ERRORS.inc('send')
+            return False, send_failure(e, _is_transient(e))
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for client in idle:
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from config.settings import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_CONNECT_TIMEOUT,
+    TELEGRAM_READ_TIMEOUT,
+    TELEGRAM_MAX_RETRIES,
+)
+from app.models.telegram_client import (
+    TelegramAPIError,
+    FileTooLarge,
+    REQUEST_SECONDS,
+    REQUEST_ERRORS,
+    content_length,
+    download_limit,
+    record_download,
+)
+
+
+def load_aiohttp():
+    """The aiohttp module, imported on first use so the server starts without it"""
+    import aiohttp
+    return aiohttp
+
+
+class AsyncTelegramClient:
+    """aiohttp-based counterpart of TelegramClient for the ASGI server
+
+    Same retry policy: 429 waits for ``retry_after``, 5xx and connection
+    errors back off exponentially.  The ClientSession is created on first
+    use because it has to belong to the server's event loop.
+    """
+
+    def __init__(self, token=None, base_url=None, pool_size=None, max_retries=None, backoff=0.5):
+        self.token = token or BOT_TOKEN
+        self.base_url = (base_url or TELEGRAM_API_URL).rstrip('/')
+        self.max_retries = TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size or TELEGRAM_POOL_SIZE
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            aiohttp = load_aiohttp()
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=TELEGRAM_CONNECT_TIMEOUT,
+                                              sock_read=TELEGRAM_READ_TIMEOUT)
+            )
+        return self._session
+
+    async def _request(self, method, url, read, **kwargs):
+        """Issue a request and return read(response), retrying on 429, 5xx and connection errors"""
+        aiohttp = load_aiohttp()
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if response.status == 429:
+                        try:
+                            retry_after = float((await response.json(content_type=None))['parameters']['retry_after'])
+                        except Exception:
+                            retry_after = self.backoff
+                        if attempt >= self.max_retries:
+                            raise TelegramAPIError("Too Many Requests", 429, retry_after)
+                        delay = retry_after
+                    elif response.status >= 500 and attempt < self.max_retries:
+                        delay = self.backoff * 2 ** attempt
+                    else:
+                        return await read(response)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries:
+                    raise TelegramAPIError(f"Request failed: {str(e)}")
+                delay = self.backoff * 2 ** attempt
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def call(self, method, params=None):
+        """Call a Bot API method and return its ``result``"""
+        start = time.perf_counter()
+        try:
+            return await self._call(method, params)
+        except TelegramAPIError as e:
+            REQUEST_ERRORS.inc(method, str(e.error_code or 'network'))
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method)
+
+    async def _call(self, method, params=None):
+        url = f"{self.base_url}/bot{self.token}/{method}"
+
+        async def read(response):
+            try:
+                return response.status, await response.json(content_type=None)
+            except ValueError:
+                raise TelegramAPIError(f"Invalid response from {method}", response.status)
+
+        status, data = await self._request('POST', url, read, json=params or {})
+        if not data.get('ok'):
+            parameters = data.get('parameters') or {}
+            raise TelegramAPIError(
+                data.get('description', f"{method} failed"),
+                data.get('error_code', status),
+                parameters.get('retry_after')
+            )
+        return data['result']
+
+    async def send_message(self, chat_id, text, **params):
+        return await self.call('sendMessage', {'chat_id': chat_id, 'text': text, **params})
+
+    async def get_file(self, file_id):
+        return await self.call('getFile', {'file_id': file_id})
+
+    async def download_file(self, file_path, destination, chunk_size=64 * 1024, max_size=None):
+        """Stream a file to disk without blocking the event loop on the network
+
+        Same ``max_size`` limit as TelegramClient.download_file.
+        """
+        url = f"{self.base_url}/file/bot{self.token}/{file_path}"
+        limit = download_limit(max_size)
+
+        async def read(response):
+            if response.status != 200:
+                REQUEST_ERRORS.inc('download', str(response.status))
+                raise TelegramAPIError(f"File download failed with HTTP {response.status}",
+                                       response.status)
+            if (content_length(response.headers) or 0) > limit:
+                REQUEST_ERRORS.inc('download', 'too_large')
+                raise FileTooLarge(limit)
+            written = 0
+            with open(destination, 'wb') as f:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    written += len(chunk)
+                    if written > limit:
+                        REQUEST_ERRORS.inc('download', 'too_large')
+                        raise FileTooLarge(limit)
+                    f.write(chunk)
+            return written
+
+        start = time.perf_counter()
+        written = await self._request('GET', url, read)
+        record_download(written, time.perf_counter() - start)
+        return written
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
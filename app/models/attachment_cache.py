@@ -0,0 +1,234 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config.settings import ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MAX_MB, ATTACHMENT_CACHE_ENCODED
+from app.models.mime_stream import iter_base64
+from utils.logger import get_logger, span
+
+ENCODED_SUFFIX = '.b64'
+# Seconds after which a .tmp file is taken to be abandoned rather than a download in progress
+TMP_MAX_AGE = 3600
+_UNSAFE = re.compile(r'[^A-Za-z0-9_-]')
+
+log = get_logger(__name__)
+
+
+def _link(source, destination):
+    """Hard-link source to destination (copying across filesystems), replacing destination"""
+    directory = os.path.dirname(destination)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AttachmentCache:
+    """Content-addressed, size-capped LRU of downloaded attachments on disk
+
+    Files are keyed by Telegram's ``file_unique_id`` (stable across
+    forwards and re-uploads of the same file), or by their SHA-256 when no id
+    is available.  A cached file is hard-linked into the caller's temp path,
+    so the usual cleanup after sending only drops the link and eviction never
+    pulls a file out from under a send in progress.  New entries are written
+    to a temp name and renamed into place, so a crash never leaves a
+    truncated file under a real key.  Optionally the base64 body of the MIME
+    attachment part is cached next to the file, so repeated sends skip the
+    encoding too.  The LRU order is kept in memory and mirrored in file
+    mtimes, so it survives restarts.
+    """
+
+    def __init__(self, directory=ATTACHMENT_CACHE_DIR, max_bytes=ATTACHMENT_CACHE_MAX_MB * 1024 * 1024,
+                 cache_encoded=ATTACHMENT_CACHE_ENCODED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache_encoded = cache_encoded
+        self._entries = OrderedDict()  # key -> bytes on disk (file + encoded copy), oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'encoded_hits': 0, 'encoded_misses': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_locked(self):
+        """Rebuild the index from the files already on disk, oldest mtime first"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.directory, exist_ok=True)
+        found = {}
+        for name in os.listdir(self.directory):
+            path = self._path(name)
+            if name.endswith('.tmp'):
+                # Left over from an interrupted write - unless another worker is writing it right now
+                try:
+                    if time.time() - os.stat(path).st_mtime > TMP_MAX_AGE:
+                        os.remove(path)
+                except OSError:
+                    pass
+                continue
+            key = name[:-len(ENCODED_SUFFIX)] if name.endswith(ENCODED_SUFFIX) else name
+            stat = os.stat(path)
+            size, mtime = found.get(key, (0, 0))
+            found[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        for key, (size, _) in sorted(found.items(), key=lambda item: item[1][1]):
+            self._entries[key] = size
+            self._size += size
+
+    def _evict_locked(self, keep):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                self._entries.move_to_end(key)
+                continue
+            del self._entries[key]
+            self._size -= size
+            self._counts['evictions'] += 1
+            for path in (self._path(key), self._path(key) + ENCODED_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _touch_locked(self, key):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def key_for(self, file_unique_id):
+        """Filesystem-safe cache key for a Telegram file_unique_id"""
+        return 'tg-' + _UNSAFE.sub('_', file_unique_id) if file_unique_id else None
+
+    def get(self, key, destination):
+        """Link a cached file to destination; returns False on a miss"""
+        if not self.enabled or key is None:
+            return False
+        with self._lock:
+            self._load_locked()
+            if key not in self._entries or not os.path.exists(self._path(key)):
+                self._counts['misses'] += 1
+                return False
+            self._counts['hits'] += 1
+            self._touch_locked(key)
+            _link(self._path(key), destination)
+            return True
+
+    def temp_path(self):
+        """A fresh path inside the cache directory to download into"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load_locked()
+        return self._path(f"{uuid.uuid4().hex}.tmp")
+
+    def put(self, key, tmp_path, destination):
+        """Move a finished download into the cache and link it to destination
+
+        With no key the file is addressed by its SHA-256.  Returns the key,
+        or None when caching is disabled (the file is just moved).
+        """
+        if not self.enabled:
+            os.replace(tmp_path, destination)
+            return None
+        key = key or f"sha256-{_sha256(tmp_path)}"
+        path = self._path(key)
+        with self._lock:
+            self._load_locked()
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path) - self._entries.get(key, 0)
+            self._entries[key] = os.path.getsize(path)
+            self._touch_locked(key)
+            _link(path, destination)
+            self._evict_locked(keep=key)
+        return key
+
+    def fetch(self, key, download, destination):
+        """Put the file for key at destination, calling download(path) only on a miss
+
+        Returns the cache key (None when caching is disabled).
+        """
+        if self.get(key, destination):
+            return key
+        tmp_path = self.temp_path() or destination
+        try:
+            download(tmp_path)
+        except BaseException:
+            if tmp_path != destination and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if tmp_path == destination:
+            return None
+        return self.put(key, tmp_path, destination)
+
+    def encoded_path(self, key):
+        """Path of the cached base64 body for key, encoding it on first use
+
+        Returns None when encoded caching is off or the file is no longer
+        cached; callers then encode on the fly as before.
+        """
+        if not (self.enabled and self.cache_encoded and key):
+            return None
+        path = self._path(key)
+        encoded = path + ENCODED_SUFFIX
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if os.path.exists(encoded):
+                self._counts['encoded_hits'] += 1
+                self._touch_locked(key)
+                return encoded
+            self._counts['encoded_misses'] += 1
+
+        tmp_path = self._path(f"{uuid.uuid4().hex}.tmp")
+        try:
+            with span(log, 'mime.encode', cached=True), \
+                    open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+                for chunk in iter_base64(source):
+                    target.write(chunk)
+        except FileNotFoundError:
+            # Evicted while we were encoding
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        with self._lock:
+            if key not in self._entries or os.path.exists(encoded):
+                # Evicted meanwhile, or another thread encoded it first
+                os.remove(tmp_path)
+                return encoded if key in self._entries else None
+            os.replace(tmp_path, encoded)
+            size = os.path.getsize(encoded)
+            self._entries[key] += size
+            self._size += size
+            self._touch_locked(key)
+            self._evict_locked(keep=key)
+        return encoded
+
+    def stats(self):
+        """Hit/miss/eviction counters plus current occupancy"""
+        with self._lock:
+            stats = dict(self._counts)
+            stats.update({'entries': len(self._entries), 'bytes': self._size, 'max_bytes': self.max_bytes})
+        return stats
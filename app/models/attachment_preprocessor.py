@@ -0,0 +1,153 @@
+import os
+import shutil
+import threading
+from config.settings import (
+    PREPROCESS_ATTACHMENTS,
+    PREPROCESS_WORKERS,
+    PREPROCESS_TIMEOUT,
+    PREPROCESS_IMAGE_TARGET_KB,
+    PREPROCESS_IMAGE_MAX_SIDE,
+    PREPROCESS_IMAGE_QUALITY,
+    PREPROCESS_ZIP_TYPES,
+    PREPROCESS_ZIP_MIN_KB,
+    PREPROCESS_SPLIT_MB,
+)
+from app.models.attachment_transforms import preprocess
+from utils.logger import get_logger, span
+from utils.metrics import Counter, Histogram
+
+log = get_logger(__name__)
+
+PREPROCESS_SECONDS = Histogram('tsb_preprocess_seconds', 'Time to preprocess one attachment, queueing included')
+PREPROCESS_BYTES = Counter('tsb_preprocess_bytes_total', 'Attachment bytes before and after preprocessing',
+                           ['stage'])
+PREPROCESS_STEPS = Counter('tsb_preprocess_steps_total', 'Attachments changed by each transform', ['step'])
+PREPROCESS_ERRORS = Counter('tsb_preprocess_errors_total', 'Attachments sent unprocessed because preprocessing failed')
+
+# Transformed files go to this directory next to the upload
+OUTPUT_DIRECTORY = 'processed'
+
+
+class AttachmentPreprocessor:
+    """Shrinks attachments before they are sent, in a pool of worker processes
+
+    Recompressing a photo or deflating a document is CPU-bound, so it runs in
+    a ``ProcessPoolExecutor`` (started on first use, with the forkserver
+    method: forking this multi-threaded process could copy held locks) and
+    never on a webhook thread - ``process`` is called by the delivery
+    workers, which wait for the result.  With ``workers=0`` the transforms
+    run on the calling thread instead.
+
+    If preprocessing fails or takes longer than ``timeout`` seconds, the
+    original file is sent.  A job still running at the timeout cannot be
+    interrupted, so the pool is replaced and its processes stopped (jobs
+    other threads had in it also fall back to their originals).
+    ``cleanup`` removes what ``process`` wrote.
+    """
+
+    def __init__(self, enabled=PREPROCESS_ATTACHMENTS, workers=PREPROCESS_WORKERS, timeout=PREPROCESS_TIMEOUT,
+                 image_target_bytes=PREPROCESS_IMAGE_TARGET_KB * 1024, image_max_side=PREPROCESS_IMAGE_MAX_SIDE,
+                 image_quality=PREPROCESS_IMAGE_QUALITY, zip_types=PREPROCESS_ZIP_TYPES,
+                 zip_min_bytes=PREPROCESS_ZIP_MIN_KB * 1024, split_bytes=PREPROCESS_SPLIT_MB * 1024 * 1024):
+        self.enabled = enabled
+        self.workers = workers
+        self.timeout = timeout
+        self.options = {
+            'image_target_bytes': image_target_bytes,
+            'image_max_side': image_max_side,
+            'image_quality': image_quality,
+            'zip_types': tuple(t.strip() for t in zip_types if t.strip()),
+            'zip_min_bytes': zip_min_bytes,
+            'split_bytes': split_bytes,
+        }
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """The process pool, started on first use"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    context = multiprocessing.get_context('forkserver')
+                    # Workers start from a server that has the transforms (and Pillow) loaded
+                    context.set_forkserver_preload(['app.models.attachment_transforms', 'PIL.Image'])
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self._executor
+
+    def process(self, path, split=True):
+        """The files to send for the attachment at ``path``, in order (``[path]`` if unchanged)
+
+        Without ``split`` an attachment over the size limit is left whole
+        (bulk mail sends one message per recipient).
+        """
+        if not self.enabled or not path:
+            return [path]
+        out_dir = os.path.join(os.path.dirname(path), OUTPUT_DIRECTORY)
+        options = dict(self.options, split_bytes=self.options['split_bytes'] if split else 0)
+        before = os.path.getsize(path)
+        try:
+            with span(log, 'attachment.preprocess', bytes=before, pooled=bool(self.workers)), \
+                    PREPROCESS_SECONDS.time():
+                if self.workers:
+                    paths, steps = self._run_pooled(path, out_dir, options)
+                else:
+                    paths, steps = preprocess(path, out_dir, **options)
+        except Exception as e:
+            PREPROCESS_ERRORS.inc()
+            log.warning("Attachment preprocessing failed, sending the original",
+                        extra={'fields': {'path': path, 'error': f"{type(e).__name__}: {e}"}})
+            self.cleanup(path)
+            return [path]
+
+        after = sum(os.path.getsize(p) for p in paths)
+        PREPROCESS_BYTES.add(before, 'in')
+        PREPROCESS_BYTES.add(after, 'out')
+        for step in steps:
+            PREPROCESS_STEPS.inc(step)
+        if steps:
+            log.info("Attachment preprocessed", extra={'fields': {
+                'steps': steps, 'bytes_in': before, 'bytes_out': after, 'parts': len(paths)}})
+        return paths
+
+    def cleanup(self, path):
+        """Remove the files ``process`` wrote for the attachment at ``path``"""
+        if path:
+            shutil.rmtree(os.path.join(os.path.dirname(path), OUTPUT_DIRECTORY), ignore_errors=True)
+
+    def _run_pooled(self, path, out_dir, options):
+        from concurrent.futures import TimeoutError as FutureTimeout
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self.executor
+        future = executor.submit(preprocess, path, out_dir, **options)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            if not future.cancel():
+                # Running: it would hold its worker until done, so the pool goes with it
+                self._restart(executor, terminate=True)
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): the pool refuses new work until it is replaced
+            self._restart(executor)
+            raise
+
+    def _restart(self, executor, terminate=False):
+        with self._lock:
+            if self._executor is not executor:
+                return  # another thread replaced it already
+            self._executor = None
+        if terminate:
+            # ProcessPoolExecutor has no public way to stop a running job
+            for process in list(executor._processes.values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,155 @@
+"""Attachment transforms run by the preprocessing pool (see attachment_preprocessor)
+
+These run in worker processes, so the module imports nothing from the bot
+(no logging or metrics setup in the workers).  The bot imports it at
+startup too, so Pillow and zipfile are only imported once a transform needs
+them.  Every transform writes into ``out_dir`` and returns the paths to
+send; the input is never modified.
+"""
+import os
+
+Image = None  # Pillow, imported by _pillow() on the first image
+_pillow_imported = False
+
+# Below this, further downscaling makes a photo useless rather than smaller
+MIN_IMAGE_SIDE = 640
+# Lowest JPEG quality tried before the image is downscaled further
+MIN_JPEG_QUALITY = 60
+# A zip must save at least this fraction of the file to be sent instead of it
+MIN_ZIP_SAVING = 0.1
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _pillow():
+    """The PIL.Image module, imported on first use (None if Pillow is not installed)"""
+    global Image, _pillow_imported
+    if not _pillow_imported:
+        try:
+            from PIL import Image as pil_image
+        except ImportError:  # photos are sent as they are
+            pil_image = None
+        Image, _pillow_imported = pil_image, True
+    return Image
+
+
+def _save(image, path, fmt, quality):
+    if fmt == 'JPEG':
+        image.save(path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(path, 'PNG', compress_level=6)
+    return os.path.getsize(path)
+
+
+def recompress_image(path, out_dir, target_bytes, max_side, quality):
+    """Downscale/recompress a JPEG or PNG until it fits ``target_bytes``; returns the new path or None
+
+    The image is first fitted into ``max_side``.  JPEGs then step their
+    quality down to MIN_JPEG_QUALITY before they are made smaller; PNGs
+    (screenshots, transparency) stay lossless and are only downscaled, by
+    the factor the last size suggests.  Metadata is dropped after the EXIF
+    orientation has been applied.  None means the original is as good: not
+    an image Pillow can open, already small, or no smaller once re-encoded.
+    """
+    pil = _pillow()
+    if pil is None:
+        return None
+    from PIL import ImageOps
+    try:
+        image = pil.open(path)
+    except (OSError, pil.DecompressionBombError):
+        return None
+    with image:
+        fmt = image.format
+        original = os.path.getsize(path)
+        if fmt not in ('JPEG', 'PNG') or (original <= target_bytes and max(image.size) <= max_side):
+            return None
+        if fmt == 'JPEG':
+            # Let the decoder scale down by a power of two on the way in: far less to decode
+            image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        side = min(max(image.size), max_side)
+        out = os.path.join(out_dir, os.path.basename(path))
+        while True:
+            scaled = image
+            if max(image.size) > side:
+                scaled = image.copy()
+                scaled.thumbnail((side, side), pil.Resampling.LANCZOS)
+            size = _save(scaled, out, fmt, quality)
+            if fmt == 'JPEG':
+                step = quality
+                while size > target_bytes and step > MIN_JPEG_QUALITY:
+                    step = max(MIN_JPEG_QUALITY, step - 10)
+                    size = _save(scaled, out, fmt, step)
+            if size <= target_bytes or side <= MIN_IMAGE_SIDE:
+                break
+            # Bytes grow with the pixel count: aim a little under the target
+            side = max(MIN_IMAGE_SIDE, int(side * min(0.9, 0.95 * (target_bytes / size) ** 0.5)))
+    if size >= original:
+        os.remove(out)
+        return None
+    return out
+
+
+def zip_file(path, out_dir):
+    """Deflate a file into ``<name>.zip``; returns the zip's path, or None if it saves too little"""
+    import zipfile
+    out = os.path.join(out_dir, os.path.basename(path) + '.zip')
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as archive:
+        archive.write(path, os.path.basename(path))
+    if os.path.getsize(out) > os.path.getsize(path) * (1 - MIN_ZIP_SAVING):
+        os.remove(out)
+        return None
+    return out
+
+
+def split_file(path, out_dir, part_bytes):
+    """Cut a file into ``<name>.001``, ``<name>.002``... of at most ``part_bytes``
+
+    Joining the parts in order (``cat name.0* > name``) restores the file.
+    """
+    parts = []
+    name = os.path.basename(path)
+    with open(path, 'rb') as source:
+        while True:
+            out = os.path.join(out_dir, f"{name}.{len(parts) + 1:03d}")
+            written = 0
+            with open(out, 'wb') as part:
+                while written < part_bytes:
+                    data = source.read(min(COPY_CHUNK_SIZE, part_bytes - written))
+                    if not data:
+                        break
+                    part.write(data)
+                    written += len(data)
+            if not written:
+                os.remove(out)
+                break
+            parts.append(out)
+    return parts
+
+
+def preprocess(path, out_dir, image_target_bytes, image_max_side, image_quality,
+               zip_types, zip_min_bytes, split_bytes):
+    """Run the transforms that apply to one attachment
+
+    Returns ``(paths, steps)``: the files to send in order (just ``[path]``
+    when nothing applied) and the names of the transforms that changed it.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    steps = []
+    current = recompress_image(path, out_dir, image_target_bytes, image_max_side, image_quality)
+    if current is not None:
+        steps.append('image')
+    else:
+        current = path
+        extension = os.path.splitext(path)[1].lower()
+        if extension in zip_types and os.path.getsize(path) >= zip_min_bytes:
+            zipped = zip_file(path, out_dir)
+            if zipped is not None:
+                current = zipped
+                steps.append('zip')
+    if split_bytes and os.path.getsize(current) > split_bytes:
+        steps.append('split')
+        return split_file(current, out_dir, split_bytes), steps
+    return [current], steps
@@ -0,0 +1,215 @@
+import csv
+import os
+import re
+import tempfile
+from config.settings import BULK_SPOOL_MEMORY
+from app.models.mime_stream import CRLF, READ_CHUNK_SIZE, build_skeleton, iter_base64, render_message, send_streamed
+from utils.logger import get_logger, span
+
+EMAIL_PATTERN = re.compile(r'[^@\s,;<>"]+@[^@\s,;<>"]+\.[^@\s,;<>".]+')
+_SEPARATORS = re.compile(r'[,;\s]+')
+
+log = get_logger(__name__)
+
+
+def _dedupe(addresses):
+    seen = set()
+    unique = []
+    for address in addresses:
+        if address.lower() not in seen:
+            seen.add(address.lower())
+            unique.append(address)
+    return unique
+
+
+def parse_recipients(text):
+    """Split a comma/semicolon/whitespace separated list into (valid, invalid) addresses"""
+    valid, invalid = [], []
+    for address in _SEPARATORS.split(text.strip()):
+        if address:
+            (valid if EMAIL_PATTERN.fullmatch(address) else invalid).append(address)
+    return _dedupe(valid), invalid
+
+
+def parse_recipient_csv(path):
+    """Collect addresses from any cell of a CSV file; header cells without '@' are ignored"""
+    valid, invalid = [], []
+    with open(path, newline='', encoding='utf-8-sig', errors='replace') as f:
+        for row in csv.reader(f):
+            for cell in row:
+                cell = cell.strip()
+                if '@' in cell:
+                    (valid if EMAIL_PATTERN.fullmatch(cell) else invalid).append(cell)
+    return _dedupe(valid), invalid
+
+
+class BulkMessage:
+    """One message sent separately to many recipients
+
+    The attachment is base64-encoded once, on first use, into a spooled temp
+    file (in memory up to BULK_SPOOL_MEMORY, on disk beyond that), unless a
+    pre-encoded copy from the attachment cache is passed as ``encoded_path``.  Each
+    recipient only gets freshly generated headers around that shared
+    payload.  ``results`` maps recipient -> (smtp code, detail) and survives
+    between delivery attempts, so a retry only goes to the recipients that
+    are still pending.
+    """
+
+    def __init__(self, sender, recipients, subject, body, file_path=None, encoded_path=None):
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.subject = subject
+        self.body = body
+        self.file_path = file_path
+        self.filename = os.path.basename(file_path) if file_path else None
+        self.encoded_path = encoded_path
+        self.results = {}
+        self.encodings = 0
+        self._payload = None
+
+    @property
+    def payload(self):
+        """The encoded attachment, produced on first access (or opened, if already cached)"""
+        if self._payload is None and self.encoded_path and os.path.exists(self.encoded_path):
+            self._payload = open(self.encoded_path, 'rb')
+        if self._payload is None:
+            spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MEMORY)
+            with span(log, 'mime.encode', cached=False), open(self.file_path, 'rb') as f:
+                for chunk in iter_base64(f):
+                    spool.write(chunk)
+            self.encodings += 1
+            self._payload = spool
+        return self._payload
+
+    def chunks(self, to_email):
+        """Yield the DATA-phase bytes for one recipient"""
+        if not self.file_path:
+            # Imported here so recipient parsing does not load the email package
+            from email.mime.multipart import MIMEMultipart
+            from email.mime.text import MIMEText
+            msg = MIMEMultipart()
+            msg['From'] = self.sender
+            msg['To'] = to_email
+            msg['Subject'] = self.subject
+            msg.attach(MIMEText(self.body, 'plain'))
+            yield render_message(msg)
+            return
+
+        head, tail = build_skeleton(self.sender, to_email, self.subject, self.body,
+                                    self.filename, self.file_path)
+        payload = self.payload
+        payload.seek(0)
+        yield head
+        while True:
+            chunk = payload.read(READ_CHUNK_SIZE * 4)
+            if not chunk:
+                break
+            yield chunk
+        yield tail
+
+    def pending(self):
+        """Recipients without a final answer (never tried, or a transient 4xx/connection failure)"""
+        return [r for r in self.recipients
+                if r not in self.results or not (200 <= self.results[r][0] < 300 or self.results[r][0] >= 500)]
+
+    def report(self, max_failures=20):
+        """Human-readable per-recipient delivery summary"""
+        delivered = sum(1 for r in self.recipients if r in self.results and self.results[r][0] == 250)
+        failed = [r for r in self.recipients if r not in self.results or self.results[r][0] != 250]
+        lines = [f"Delivered to {delivered} of {len(self.recipients)} recipients."]
+        for recipient in failed[:max_failures]:
+            code, detail = self.results.get(recipient, (0, 'not attempted'))
+            lines.append(f"- {recipient}: {code} {detail}" if code else f"- {recipient}: {detail}")
+        if len(failed) > max_failures:
+            lines.append(f"...and {len(failed) - max_failures} more")
+        return "\n".join(lines)
+
+    def close(self):
+        if self._payload is not None:
+            self._payload.close()
+            self._payload = None
+
+
+def _reply_of(reply):
+    code, message = reply
+    return code, message.decode('utf-8', 'replace') if isinstance(message, bytes) else str(message)
+
+
+def _reply(server):
+    return _reply_of(server.getreply())
+
+
+def _send_sequential(server, bulk, recipients):
+    import smtplib
+    for recipient in recipients:
+        try:
+            send_streamed(server, bulk.sender, [recipient], bulk.chunks(recipient))
+            bulk.results[recipient] = (250, 'OK')
+        except smtplib.SMTPRecipientsRefused as e:
+            bulk.results[recipient] = _reply_of(e.recipients[recipient])
+        except smtplib.SMTPResponseException as e:
+            bulk.results[recipient] = _reply_of((e.smtp_code, e.smtp_error))
+
+
+def _send_pipelined(server, bulk, recipients):
+    """RFC 2920 pipelining: MAIL, RCPT and DATA go out in one write, and each
+    message's end-of-data marker rides along with the next group, so a
+    recipient costs one round trip instead of four."""
+    import smtplib
+    sender = smtplib.quoteaddr(bulk.sender).encode()
+    carried = b''   # message tail, end-of-data and/or RSET sent at the start of the next group
+    expected = []   # owners of the replies to those carried commands (None = discard)
+    for recipient in recipients:
+        server.send(carried + b'MAIL FROM:' + sender + CRLF
+                    + b'RCPT TO:' + smtplib.quoteaddr(recipient).encode() + CRLF + b'DATA' + CRLF)
+        for owner in expected:
+            reply = _reply(server)
+            if owner is not None:
+                bulk.results[owner] = reply
+        mail, rcpt, data = _reply(server), _reply(server), _reply(server)
+        carried, expected = b'', []
+
+        if data[0] == 354:
+            # Hold back the last chunk so it leaves in the same write as the
+            # next group; a small message then costs a single send() call
+            last = b''
+            for chunk in bulk.chunks(recipient):
+                if last:
+                    server.send(last)
+                last = chunk
+            carried = last + (b'.\r\n' if last.endswith(CRLF) else b'\r\n.\r\n')
+            if rcpt[0] in (250, 251):
+                expected = [recipient]
+            else:
+                # The server took the data despite refusing the recipient; keep the refusal
+                bulk.results[recipient] = rcpt
+                carried += b'RSET' + CRLF
+                expected = [None, None]
+        else:
+            bulk.results[recipient] = next(reply for reply in (mail, rcpt, data) if reply[0] not in (250, 251))
+            if mail[0] == 250:
+                carried, expected = b'RSET' + CRLF, [None]
+
+    if carried:
+        server.send(carried)
+        for owner in expected:
+            reply = _reply(server)
+            if owner is not None:
+                bulk.results[owner] = reply
+
+
+def send_bulk(server, bulk, recipients=None, pipelining=None):
+    """Send bulk to each recipient over one connection, filling bulk.results
+
+    Pipelining is used when the server advertises PIPELINING, unless
+    ``pipelining`` forces it on or off.
+    """
+    server.ehlo_or_helo_if_needed()
+    if pipelining is None:
+        pipelining = server.has_extn('pipelining')
+    recipients = bulk.pending() if recipients is None else recipients
+    if pipelining:
+        _send_pipelined(server, bulk, recipients)
+    else:
+        _send_sequential(server, bulk, recipients)
+    return bulk.results
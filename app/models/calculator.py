@@ -1,9 +1,541 @@
+import ast
+import math
+import operator
+import re
+import time
+from functools import lru_cache
+
+np = None  # NumPy, imported by _numpy() on the first vectorized range
+_numpy_imported = False
+
+# Evaluation limits
+MAX_OPERATIONS = 100_000      # AST node evaluations per calculation
+MAX_DEPTH = 100               # nesting depth of the expression tree
+MAX_INT_BITS = 10_000         # ~3000 decimal digits
+MAX_RANGE_SIZE = 10_000_000   # elements in a vectorized range
+MAX_PY_RANGE_SIZE = 100_000   # elements when NumPy is unavailable
+MAX_PY_LOOP_OPERATIONS = 2_000_000  # AST node evaluations in one such loop
+MAX_CLOSED_FORM_DEGREE = 10   # polynomials summed over larger ranges without looping
+TIME_BUDGET = 0.5             # seconds per calculation
+
+# int64 results at or above this are recomputed as floats instead of wrapping
+_INT64_SAFE = 2.0 ** 62
+
+# "a..b" is an inclusive range of any two operands (written as "a | b" for the parser, so it
+# binds more loosely than arithmetic: 1..n+1 is 1..(n+1)); "^" is accepted for powers
+_RANGE_SYNTAX = re.compile(r'\.\.')
+
+
+class CalculationError(ValueError):
+    """Raised for expressions that are invalid, unsafe or over budget"""
+
+
+class _Budget:
+    __slots__ = ('ops', 'deadline')
+
+    def __init__(self, max_ops, seconds, deadline=None):
+        self.ops = max_ops
+        self.deadline = deadline if deadline is not None else time.monotonic() + seconds
+
+    def tick(self, n=1):
+        self.ops -= n
+        if self.ops < 0:
+            raise CalculationError("Expression is too complex")
+        if time.monotonic() > self.deadline:
+            raise CalculationError("Calculation took too long")
+
+
+class _Range:
+    """Integer range produced by a..b (inclusive) or range(...)"""
+
+    __slots__ = ('start', 'stop', 'step')
+
+    def __init__(self, start, stop, step=1):
+        self.start, self.stop, self.step = _as_int(start), _as_int(stop), _as_int(step)
+        if self.step == 0:
+            raise CalculationError("Range step cannot be zero")
+
+    def size(self):
+        """Number of elements (len() cannot go past sys.maxsize)"""
+        if self.step > 0:
+            return max(0, (self.stop - self.start + self.step - 1) // self.step)
+        return max(0, (self.start - self.stop - self.step - 1) // -self.step)
+
+
+def _as_int(value, message="Range bounds must be whole numbers"):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise CalculationError(message)
+    return value
+
+
+def _numpy():
+    """The numpy module, imported on first use (None if it is not installed)"""
+    global np, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy
+        except ImportError:  # vectorized ranges fall back to a bounded Python loop
+            numpy = None
+        np, _numpy_imported = numpy, True
+    return np
+
+
+def _is_array(value):
+    return np is not None and isinstance(value, np.ndarray)
+
+
+def _check_int(value):
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise CalculationError("Result is too large")
+    return value
+
+
+def _pow(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        if b < 0:
+            return float(a) ** b
+        if abs(a) > 1 and b * abs(a).bit_length() > MAX_INT_BITS:
+            raise CalculationError("Exponent is too large")
+    return a ** b
+
+
+def _mul(a, b):
+    if isinstance(a, int) and isinstance(b, int) and a.bit_length() + b.bit_length() > MAX_INT_BITS:
+        raise CalculationError("Result is too large")
+    return a * b
+
+
+_SCALAR_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _pow,
+}
+
+_ARRAY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+
+def _array_binop(op_type, a, b):
+    """Elementwise op that stays exact in int64 but never silently wraps around"""
+    op = _ARRAY_OPS[op_type]
+    with np.errstate(divide='raise', invalid='raise', over='raise'):
+        if op_type in (ast.Add, ast.Sub, ast.Mult, ast.Pow):
+            a_int = np.issubdtype(np.asarray(a).dtype, np.integer)
+            b_int = np.issubdtype(np.asarray(b).dtype, np.integer)
+            if a_int and b_int:
+                as_float = op(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+                if op_type is ast.Pow and np.any(np.asarray(b) < 0):
+                    return as_float
+                if not np.all(np.abs(as_float) < _INT64_SAFE):
+                    return as_float
+        return op(a, b)
+
+
+def _binop(op_type, a, b):
+    if isinstance(a, _Range) or isinstance(b, _Range):
+        raise CalculationError("Ranges can only be looped over, e.g. sum(x for x in 1..10)")
+    if _is_array(a) or _is_array(b):
+        return _array_binop(op_type, a, b)
+    return _check_int(_SCALAR_OPS[op_type](a, b))
+
+
+def _elementwise(math_func, numpy_name):
+    """Function that uses NumPy for arrays and math for plain numbers"""
+    def call(*args):
+        if any(_is_array(arg) for arg in args):
+            with np.errstate(divide='raise', invalid='raise', over='raise'):
+                return getattr(np, numpy_name)(*args)
+        return math_func(*args)
+    return call
+
+
+def _factorial(n):
+    n = _as_int(n, "factorial() takes a whole number")
+    if n > 1500:
+        raise CalculationError("Factorial argument is too large")
+    return math.factorial(n)
+
+
+FUNCTIONS = {
+    'abs': _elementwise(abs, 'abs'),
+    'round': _elementwise(round, 'round'),
+    'sqrt': _elementwise(math.sqrt, 'sqrt'),
+    'exp': _elementwise(math.exp, 'exp'),
+    'log': _elementwise(math.log, 'log'),
+    'log10': _elementwise(math.log10, 'log10'),
+    'log2': _elementwise(math.log2, 'log2'),
+    'sin': _elementwise(math.sin, 'sin'),
+    'cos': _elementwise(math.cos, 'cos'),
+    'tan': _elementwise(math.tan, 'tan'),
+    'asin': _elementwise(math.asin, 'arcsin'),
+    'acos': _elementwise(math.acos, 'arccos'),
+    'atan': _elementwise(math.atan, 'arctan'),
+    'floor': _elementwise(math.floor, 'floor'),
+    'ceil': _elementwise(math.ceil, 'ceil'),
+    'min': _elementwise(min, 'minimum'),
+    'max': _elementwise(max, 'maximum'),
+    'factorial': _factorial,
+    'range': lambda *args: _Range(*args) if len(args) > 1 else _Range(0, *args),
+    '_range': lambda start, end: _Range(start, _as_int(end) + 1),  # target of a..b
+}
+
+# Reducers accept a generator expression over a range, e.g. sum(x**2 for x in 1..10), or a
+# list of numbers, e.g. mean([1, 2, 3]); list literals are not allowed anywhere else
+REDUCERS = {'sum', 'min', 'max', 'mean', 'len'}
+
+CONSTANTS = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+
+
+def _reduce_array(name, values):
+    if values.size == 0:
+        if name in ('sum', 'len'):
+            return 0
+        raise CalculationError(f"{name}() of an empty range")
+    if name == 'len':
+        return int(values.size)
+    if name == 'mean':
+        return float(values.mean())
+    if name == 'sum' and np.issubdtype(values.dtype, np.integer):
+        estimate = float(np.abs(values).astype(np.float64).sum())
+        if estimate >= _INT64_SAFE:
+            return float(values.astype(np.float64).sum())
+    return getattr(values, name)().item()
+
+
+def _reduce_values(name, values):
+    if name == 'len':
+        return len(values)
+    if not values:
+        if name == 'sum':
+            return 0
+        raise CalculationError(f"{name}() of an empty range")
+    if name == 'mean':
+        return sum(values) / len(values)
+    return {'sum': sum, 'min': min, 'max': max}[name](values)
+
+
+class _Compiler:
+    """Turns a whitelisted AST into nested closures evaluated against a budget"""
+
+    def __init__(self):
+        self.depth = 0
+
+    def compile(self, node):
+        handler = getattr(self, f'_{type(node).__name__}', None)
+        if handler is None:
+            raise CalculationError(f"Unsupported syntax: {type(node).__name__}")
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise CalculationError("Expression is nested too deeply")
+        try:
+            return handler(node)
+        finally:
+            self.depth -= 1
+
+    def _Expression(self, node):
+        return self.compile(node.body)
+
+    def _Constant(self, node):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CalculationError("Only numbers are allowed")
+        return lambda env, budget: value
+
+    def _Name(self, node):
+        name = node.id
+        if name in CONSTANTS:
+            value = CONSTANTS[name]
+            return lambda env, budget: value
+
+        def lookup(env, budget):
+            try:
+                return env[name]
+            except KeyError:
+                raise CalculationError(f"Unknown name '{name}'")
+        return lookup
+
+    def _BinOp(self, node):
+        op_type = type(node.op)
+        if op_type is ast.BitOr:  # a..b, see _preprocess
+            start, end = self.compile(node.left), self.compile(node.right)
+            make_range = FUNCTIONS['_range']
+            return lambda env, budget: make_range(start(env, budget), end(env, budget))
+        if op_type not in _SCALAR_OPS:
+            raise CalculationError(f"Unsupported operator: {op_type.__name__}")
+        left, right = self.compile(node.left), self.compile(node.right)
+
+        def binop(env, budget):
+            a, b = left(env, budget), right(env, budget)
+            budget.tick()
+            return _binop(op_type, a, b)
+        return binop
+
+    def _UnaryOp(self, node):
+        operand = self.compile(node.operand)
+        if isinstance(node.op, ast.USub):
+            return lambda env, budget: -operand(env, budget)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        raise CalculationError(f"Unsupported operator: {type(node.op).__name__}")
+
+    def _Compare(self, node):
+        ops = [_COMPARE_OPS.get(type(op)) for op in node.ops]
+        if None in ops:
+            raise CalculationError("Unsupported comparison")
+        operands = [self.compile(node.left)] + [self.compile(c) for c in node.comparators]
+
+        def compare(env, budget):
+            values = [operand(env, budget) for operand in operands]
+            budget.tick(len(ops))
+            result = True
+            for op, a, b in zip(ops, values, values[1:]):
+                result = result & op(a, b)
+            return result
+        return compare
+
+    def _BoolOp(self, node):
+        values = [self.compile(v) for v in node.values]
+        is_and = isinstance(node.op, ast.And)
+
+        def boolop(env, budget):
+            result = values[0](env, budget)
+            for value in values[1:]:
+                other = value(env, budget)
+                result = (result & other) if is_and else (result | other)
+            return result
+        return boolop
+
+    def _IfExp(self, node):
+        test, body, orelse = self.compile(node.test), self.compile(node.body), self.compile(node.orelse)
+
+        def ifexp(env, budget):
+            condition = test(env, budget)
+            if _is_array(condition):
+                return np.where(condition, body(env, budget), orelse(env, budget))
+            return body(env, budget) if condition else orelse(env, budget)
+        return ifexp
+
+    def _Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise CalculationError("Only simple function calls are allowed")
+        name = node.func.id
+        if len(node.args) == 1 and isinstance(node.args[0], (ast.GeneratorExp, ast.ListComp)):
+            if name not in REDUCERS:
+                raise CalculationError(f"{name}() cannot take a generator")
+            return self._reduction(name, node.args[0])
+        if len(node.args) == 1 and isinstance(node.args[0], (ast.List, ast.Tuple)):
+            if name not in REDUCERS:
+                raise CalculationError(f"{name}() cannot take a list")
+            return self._list_reduction(name, node.args[0])
+        func = FUNCTIONS.get(name)
+        if func is None:
+            raise CalculationError(f"Unknown function '{name}'")
+        args = [self.compile(arg) for arg in node.args]
+        range_error = None
+        if name in REDUCERS:
+            range_error = f"{name}() takes numbers; loop over a range instead, e.g. {name}(x for x in 1..10)"
+        elif name != 'range':
+            range_error = f"{name}() takes numbers, not a range"
+
+        def call(env, budget):
+            values = [arg(env, budget) for arg in args]
+            budget.tick()
+            if range_error and any(isinstance(value, _Range) for value in values):
+                raise CalculationError(range_error)
+            try:
+                return _check_int(func(*values))
+            except CalculationError:
+                raise
+            except (TypeError, ValueError, OverflowError) as e:
+                raise CalculationError(f"{name}(): {str(e)}")
+        return call
+
+    def _reduction(self, name, comp):
+        if len(comp.generators) != 1:
+            raise CalculationError("Only one 'for' clause is supported")
+        generator = comp.generators[0]
+        if not isinstance(generator.target, ast.Name) or generator.is_async:
+            raise CalculationError("Loop variable must be a simple name")
+        var = generator.target.id
+        iterable = self.compile(generator.iter)
+        conditions = [self.compile(c) for c in generator.ifs]
+        element = self.compile(comp.elt)
+        degree = None
+        if not conditions and name in ('sum', 'mean', 'len'):
+            degree = _polynomial_degree(comp.elt, var)
+
+        def reduce(env, budget):
+            spec = iterable(env, budget)
+            if not isinstance(spec, _Range):
+                raise CalculationError("Generators must loop over a range such as 1..100")
+            size = spec.size()
+            vectorized = _numpy() is not None
+            if size > (MAX_RANGE_SIZE if vectorized else MAX_PY_RANGE_SIZE):
+                if degree is not None:
+                    return _closed_form(name, element, var, env, spec, degree, budget)
+                if vectorized:
+                    raise CalculationError(f"Range is too large (at most {MAX_RANGE_SIZE:,} elements)")
+                raise CalculationError(f"Range is too large to loop over without NumPy "
+                                       f"(at most {MAX_PY_RANGE_SIZE:,} elements)")
+            if vectorized:
+                local = dict(env)
+                local[var] = np.arange(spec.start, spec.stop, spec.step, dtype=np.int64)
+                for condition in conditions:
+                    local[var] = local[var][np.asarray(condition(local, budget), dtype=bool)]
+                values = element(local, budget)
+                if not _is_array(values):
+                    values = np.full(local[var].shape, values)
+                return _reduce_array(name, values)
+
+            # One node per element costs what a whole array operation does with NumPy,
+            # so the loop gets an allowance of its own (the deadline still applies)
+            budget.tick()
+            loop_budget = _Budget(MAX_PY_LOOP_OPERATIONS, 0, deadline=budget.deadline)
+            values = []
+            local = dict(env)
+            for x in range(spec.start, spec.stop, spec.step):
+                local[var] = x
+                if all(condition(local, loop_budget) for condition in conditions):
+                    values.append(element(local, loop_budget))
+            return _reduce_values(name, values)
+        return reduce
+
+    def _list_reduction(self, name, node):
+        if len(node.elts) > MAX_PY_RANGE_SIZE:
+            raise CalculationError("List is too long")
+        items = [self.compile(e) for e in node.elts]
+
+        def reduce(env, budget):
+            values = [item(env, budget) for item in items]
+            budget.tick(len(values))
+            if any(isinstance(value, _Range) or _is_array(value) for value in values):
+                raise CalculationError(f"{name}() takes a list of numbers")
+            return _reduce_values(name, values)
+        return reduce
+
+    def _List(self, node):
+        raise CalculationError("Lists are only allowed as the argument of " + ", ".join(sorted(REDUCERS)))
+
+    _Tuple = _List
+
+
+def _polynomial_degree(node, var):
+    """Degree of ``node`` as a polynomial in ``var`` (None if it is not one or too high)"""
+    if not any(isinstance(child, ast.Name) and child.id == var for child in ast.walk(node)):
+        return 0
+    degree = None
+    if isinstance(node, ast.Name):
+        degree = 1
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        degree = _polynomial_degree(node.operand, var)
+    elif isinstance(node, ast.BinOp):
+        left = _polynomial_degree(node.left, var)
+        right = _polynomial_degree(node.right, var)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            degree = max(left, right)
+        elif isinstance(node.op, ast.Mult):
+            degree = left + right
+        elif isinstance(node.op, ast.Div) and right == 0:
+            degree = left
+        elif isinstance(node.op, ast.Pow) and right == 0 and isinstance(node.right, ast.Constant) \
+                and type(node.right.value) is int and node.right.value >= 0:
+            degree = left * node.right.value
+    return degree if degree is not None and degree <= MAX_CLOSED_FORM_DEGREE else None
+
+
+def _closed_form(name, element, var, env, spec, degree, budget):
+    """sum/mean/len of a polynomial over a range too large to loop over
+
+    With q(k) the element at the k-th value of the range, the sum of q(0..n-1)
+    is the sum over j of C(n, j+1) times the j-th forward difference of q at 0,
+    and differences past the polynomial's degree are zero.
+    """
+    n = spec.size()
+    if name == 'len':
+        return n
+    local = dict(env)
+    row = []
+    for k in range(degree + 1):
+        local[var] = spec.start + k * spec.step
+        value = element(local, budget)
+        if isinstance(value, _Range):
+            raise CalculationError("Ranges can only be looped over, e.g. sum(x for x in 1..10)")
+        row.append(value)
+    total = 0
+    for j in range(degree + 1):
+        budget.tick()
+        total = _check_int(total + _mul(math.comb(n, j + 1), row[0]))
+        row = [b - a for a, b in zip(row, row[1:])]
+    return total / n if name == 'mean' else total
+
+
+def _preprocess(expression):
+    expression = expression.replace('^', '**')
+    return _RANGE_SYNTAX.sub(' | ', expression)
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(expression):
+    """Parse, validate and compile an expression (memoized)"""
+    if len(expression) > 1000:
+        raise CalculationError("Expression is too long")
+    if '|' in expression:
+        raise CalculationError("Unsupported operator: BitOr")  # the parser's spelling of a..b
+    try:
+        tree = ast.parse(_preprocess(expression), mode='eval')
+    except (SyntaxError, RecursionError, MemoryError):
+        raise CalculationError("Invalid expression")
+    return _Compiler().compile(tree)
+
+
+def evaluate(expression, max_operations=MAX_OPERATIONS, time_budget=TIME_BUDGET):
+    """Evaluate an expression safely, raising CalculationError on any problem"""
+    compiled = compile_expression(expression.strip())
+    try:
+        result = compiled({}, _Budget(max_operations, time_budget))
+    except ZeroDivisionError:
+        raise CalculationError("Division by zero")
+    except (OverflowError, FloatingPointError) as e:
+        raise CalculationError(f"Arithmetic error: {str(e)}")
+    except MemoryError:
+        raise CalculationError("Result is too large")
+    if _is_array(result) or isinstance(result, _Range):
+        raise CalculationError("Result must be a single number")
+    if hasattr(result, 'item'):
+        result = result.item()
+    if isinstance(result, bool):
+        return result
+    if isinstance(result, float) and result.is_integer() and abs(result) < 1e15:
+        return int(result)
+    return result
+
+
 def calculate(expression):
     """
     Evaluates a mathematical expression and returns the result.
     """
     try:
-        result = eval(expression)  # Make sure to sanitize input
-        return result
+        return evaluate(expression)
     except Exception as e:
         return f"Error in calculation: {e}"
@@ -0,0 +1,242 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class SendFailure(str):
+    """Error message of a failed send that also says whether retrying it can help"""
+
+    def __new__(cls, message, transient=True):
+        failure = super().__new__(cls, message)
+        failure.transient = transient
+        return failure
+
+
+def is_transient(error):
+    """Whether a send that raised ``error`` may succeed later: 4xx replies, lost connections, timeouts
+
+    5xx replies, authentication and validation errors and a missing upload
+    fail the same way every time.
+    """
+    import smtplib
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, (smtplib.SMTPException, FileNotFoundError)):
+        return False
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+def send_failure(error, transient=None):
+    """The (success, message) message for a send that raised ``error``"""
+    return SendFailure(f"Failed to send email: {str(error)}",
+                       is_transient(error) if transient is None else transient)
+
+
+class DeliveryJob:
+    """A unit of outbound work: a send callable plus a completion callback
+
+    ``send`` must return ``(success, message)`` like the EmailSender methods
+    (a failure is retried unless ``message`` is a non-transient SendFailure);
+    ``on_done(success, message)`` runs exactly once, after the final attempt.
+    """
+
+    __slots__ = ('job_id', 'chat_id', 'send', 'on_done', 'attempts', 'enqueued_at', 'last_error')
+
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id, send, on_done=None):
+        self.job_id = next(self._ids)
+        self.chat_id = chat_id
+        self.send = send
+        self.on_done = on_done
+        self.attempts = 0
+        self.enqueued_at = None
+        self.last_error = None
+
+
+class DeliveryQueue:
+    """Bounded job queue drained by a pool of worker threads
+
+    Transient failures are retried with exponential backoff; once
+    ``max_attempts`` is reached, or right away for a permanent failure, the
+    job is moved to a bounded dead-letter list.  ``submit`` never blocks for
+    longer than ``put_timeout`` - a full queue is reported back to the
+    caller so the webhook can push back on the user instead of stalling.
+
+    A job counts as unfinished from ``submit`` until its final attempt,
+    waiting retries included, so ``join`` covers them too.
+    """
+
+    def __init__(self, workers=4, max_depth=100, max_attempts=4, base_delay=1.0,
+                 max_delay=60.0, put_timeout=0.5, dead_letter_size=100):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._latencies = deque(maxlen=1000)
+        self._counts = {'submitted': 0, 'rejected': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'abandoned': 0}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._timers = {}  # job_id -> (Timer, job) for retries waiting out their backoff
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"delivery-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job):
+        """Enqueue a job; returns False if the queue stayed full (backpressure)"""
+        self.start()
+        job.enqueued_at = time.monotonic()
+        with self._lock:
+            self._unfinished += 1
+        try:
+            self._queue.put(job, timeout=self.put_timeout)
+        except queue.Full:
+            self._finish()
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _finish(self):
+        with self._idle:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._idle.notify_all()
+
+    def _schedule_retry(self, job, delay):
+        timer = threading.Timer(delay, self._retry, args=(job,))
+        timer.daemon = True
+        with self._lock:
+            self._timers[job.job_id] = (timer, job)
+        timer.start()
+
+    def _retry(self, job):
+        with self._lock:
+            if self._timers.pop(job.job_id, None) is None:
+                return  # cancelled by cancel_retries
+        job.enqueued_at = time.monotonic()
+        try:
+            # Never block the timer thread; a full queue just delays the retry
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._schedule_retry(job, self.base_delay)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._latencies.append(time.monotonic() - job.enqueued_at)
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.attempts += 1
+        try:
+            success, message = job.send()
+        except Exception as e:
+            success, message = False, send_failure(e)
+
+        transient = getattr(message, 'transient', True)
+        if not success and transient and job.attempts < self.max_attempts:
+            job.last_error = message
+            self._count('retried')
+            delay = min(self.base_delay * 2 ** (job.attempts - 1), self.max_delay)
+            log.info("Delivery retry scheduled", extra={'fields': {
+                'job_id': job.job_id, 'attempt': job.attempts, 'delay': delay}})
+            self._schedule_retry(job, delay)
+            return
+
+        if success:
+            self._count('sent')
+        else:
+            job.last_error = message
+            self._count('failed')
+            self.dead_letters.append(job)
+            log.warning("Delivery failed", extra={'fields': {
+                'job_id': job.job_id, 'attempts': job.attempts, 'permanent': not transient, 'error': message}})
+
+        try:
+            if job.on_done:
+                try:
+                    job.on_done(success, message)
+                except Exception:
+                    log.exception("Delivery callback failed", extra={'fields': {'chat_id': job.chat_id}})
+        finally:
+            self._finish()
+
+    def join(self, timeout=None):
+        """Block until every submitted job has had its final attempt (retries included); False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._unfinished > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def cancel_retries(self):
+        """Stop the retries still waiting out their backoff and dead-letter them; returns how many
+
+        For shutdown once ``join`` has run out of time.  ``on_done`` is not
+        called: the process is going away, and with the update journal on
+        the email is queued again after the restart.
+        """
+        with self._lock:
+            waiting, self._timers = list(self._timers.values()), {}
+        for timer, job in waiting:
+            timer.cancel()
+            self.dead_letters.append(job)
+            self._count('abandoned')
+            log.warning("Delivery retry abandoned at shutdown", extra={'fields': {
+                'job_id': job.job_id, 'chat_id': job.chat_id, 'attempts': job.attempts, 'error': job.last_error}})
+            self._finish()
+        return len(waiting)
+
+    def metrics(self):
+        """Return counters plus queue-latency percentiles in seconds"""
+        latencies = sorted(self._latencies)
+        with self._lock:
+            stats = dict(self._counts)
+            retrying = len(self._timers)
+        stats.update({
+            'depth': self._queue.qsize(),
+            'retrying': retrying,
+            'max_depth': self._queue.maxsize,
+            'dead_letters': len(self.dead_letters),
+        })
+        if latencies:
+            stats.update({
+                'queue_latency_p50': latencies[len(latencies) // 2],
+                'queue_latency_p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+                'queue_latency_max': latencies[-1],
+            })
+        return stats
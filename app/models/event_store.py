@@ -0,0 +1,314 @@
+import json
+import mmap
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from config.settings import ANALYTICS_DB, ANALYTICS_WINDOW_MB
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# Reused for every line: json.loads/dumps build a new decoder/encoder per call with these options
+_decode = json.JSONDecoder().decode
+_encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+# Log fields with a column of their own; the rest is kept as JSON in ``fields``
+_COLUMNS = {'ts', 'level', 'logger', 'msg', 'span', 'duration_ms', 'chat_id', 'content_type', 'bytes'}
+
+# Lines of the old text log: "2025-01-30 12:00:00,123 - INFO - message"
+_TEXT_LINE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:,(\d{3}))? - ([A-Z]+) - (.*)')
+
+# Columns a latency or error query may group by (besides time buckets)
+GROUP_COLUMNS = {'name': 'n.name', 'logger': 'l.name', 'content_type': 'e.content_type', 'chat_id': 'e.chat_id'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    device INTEGER,
+    inode INTEGER,
+    offset INTEGER NOT NULL,
+    lines INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS events (
+    ts REAL NOT NULL,
+    name INTEGER NOT NULL REFERENCES names(id),
+    logger INTEGER REFERENCES names(id),
+    level INTEGER,
+    duration_ms REAL,
+    chat_id INTEGER,
+    content_type TEXT,
+    bytes INTEGER,
+    error INTEGER NOT NULL DEFAULT 0,
+    fields TEXT
+);
+CREATE INDEX IF NOT EXISTS events_name_ts ON events(name, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events(ts);
+CREATE INDEX IF NOT EXISTS events_chat_ts ON events(chat_id, ts) WHERE chat_id IS NOT NULL;
+"""
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def update_kind(message):
+    """What a captured message carries: command, text, photo, document, ... (None if unknown)"""
+    text = message.get('text')
+    if text is not None:
+        return 'command' if text.startswith('/') else 'text'
+    for kind in ('photo', 'document', 'video', 'voice', 'audio', 'sticker', 'location', 'contact'):
+        if kind in message:
+            return kind
+    return None
+
+
+class EventStore:
+    """Log records and captured updates, ingested into an indexed SQLite file
+
+    ``ingest`` reads only what was appended to a source since the last call:
+    the byte offset of the last complete line is stored per file (with its
+    inode, so a rotated or truncated file is read again from the start),
+    and new data is mapped into memory ``window`` bytes at a time instead of
+    being read line by line.  A window's rows and the new offset commit in
+    one transaction, so an interrupted ingest neither loses nor repeats
+    lines.
+
+    Each line becomes one row of ``events``: JSON log records (span or
+    message as the name, duration, chat, content type, bytes; other fields
+    as JSON), lines of the old ``asctime - LEVEL - message`` text log, and
+    captured Telegram updates (name ``update``, content type = what the
+    message carries).  Names and loggers are stored once in ``names``, so
+    rows stay small, and ``(name, ts)`` is indexed for the queries.
+    """
+
+    def __init__(self, path=ANALYTICS_DB, window=ANALYTICS_WINDOW_MB * 1024 * 1024):
+        self.path = path
+        self.window = max(window, mmap.ALLOCATIONGRANULARITY)
+        self._db = None
+        self._names = {}
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _name_id(self, name):
+        name_id = self._names.get(name)
+        if name_id is None:
+            db = self._db
+            db.execute('INSERT OR IGNORE INTO names (name) VALUES (?)', (name,))
+            name_id = self._names[name] = db.execute('SELECT id FROM names WHERE name = ?', (name,)).fetchone()[0]
+        return name_id
+
+    def _row(self, line, now):
+        """The events row for one line, or None if it is not a record this store understands"""
+        if line.startswith('{'):
+            try:
+                data = _decode(line)
+            except ValueError:
+                return None
+            if 'ts' in data and 'msg' in data:
+                return self._log_row(data)
+            if 'update_id' in data or 'message' in data:
+                return self._update_row(data, now)
+            return None
+        match = _TEXT_LINE.match(line)
+        if match is None:
+            return None
+        stamp, millis, level, message = match.groups()
+        ts = datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S').timestamp() + int(millis or 0) / 1000
+        return (ts, self._name_id(message[:200]), None, LEVELS.get(level),
+                None, None, None, None, int(LEVELS.get(level, 0) >= LEVELS['WARNING']), None)
+
+    def _log_row(self, data):
+        level = LEVELS.get(data.get('level'))
+        extra = {key: value for key, value in data.items() if key not in _COLUMNS}
+        error = (level or 0) >= LEVELS['WARNING'] or 'error' in extra or extra.get('success') is False
+        chat_id = data.get('chat_id')
+        return (data['ts'], self._name_id(data.get('span') or data['msg']),
+                self._name_id(data['logger']) if data.get('logger') else None, level,
+                data.get('duration_ms'), chat_id if isinstance(chat_id, int) else None,
+                data.get('content_type'), data.get('bytes'), int(error),
+                _encode(extra) if extra else None)
+
+    def _update_row(self, data, now):
+        message = data.get('message') or data.get('edited_message') or {}
+        fields = {'update_id': data.get('update_id')}
+        if (message.get('text') or '').startswith('/'):
+            fields['command'] = message['text'].split(maxsplit=1)[0]
+        chat_id = (message.get('chat') or {}).get('id')
+        return (message.get('date') or now, self._name_id('update'), None, None, None,
+                chat_id if isinstance(chat_id, int) else None, update_kind(message), None, 0,
+                _encode(fields))
+
+    def ingest(self, path):
+        """Store what was appended to ``path`` since the last call; returns {'lines', 'skipped', 'bytes'}"""
+        db = self._connect()
+        key = os.path.abspath(path)
+        stats = {'lines': 0, 'skipped': 0, 'bytes': 0}
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return stats
+        with file:
+            stat = os.fstat(file.fileno())
+            row = db.execute('SELECT device, inode, offset FROM sources WHERE path = ?', (key,)).fetchone()
+            offset = 0
+            if row is not None:
+                if (row[0], row[1]) == (stat.st_dev, stat.st_ino) and row[2] <= stat.st_size:
+                    offset = row[2]
+                else:
+                    log.info("Analytics source was rotated or truncated, reading it again",
+                             extra={'fields': {'path': key}})
+            window = self.window
+            while offset < stat.st_size:
+                # mmap offsets must be multiples of the allocation granularity
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                length = min(stat.st_size - start, window + offset - start)
+                with mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ, offset=start) as view:
+                    end = view.rfind(b'\n', offset - start)
+                    if end < 0:
+                        if start + length >= stat.st_size:
+                            break  # the last line is still being written
+                        window *= 2  # a line longer than the window
+                        continue
+                    new_offset = start + end + 1
+                    counts = {'lines': 0, 'skipped': 0}
+                    try:
+                        with db:
+                            # Rows are parsed as SQLite asks for them, never held as a list
+                            db.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                           self._parse(view, offset - start, end, counts))
+                            db.execute("""
+                                INSERT INTO sources (path, device, inode, offset, lines, skipped, updated)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT (path) DO UPDATE SET
+                                    device = excluded.device, inode = excluded.inode,
+                                    offset = excluded.offset, updated = excluded.updated,
+                                    lines = CASE WHEN ? > 0 THEN sources.lines ELSE 0 END + excluded.lines,
+                                    skipped = CASE WHEN ? > 0 THEN sources.skipped ELSE 0 END + excluded.skipped""",
+                                       (key, stat.st_dev, stat.st_ino, new_offset, counts['lines'],
+                                        counts['skipped'], time.time(), offset, offset))
+                    except Exception:
+                        self._names.clear()  # names added by the rolled back window are gone
+                        raise
+                stats['lines'] += counts['lines']
+                stats['skipped'] += counts['skipped']
+                stats['bytes'] += new_offset - offset
+                offset = new_offset
+        return stats
+
+    def _parse(self, view, position, end, counts):
+        """Rows for the lines of ``view[position:end]`` (end is the last newline), counted into ``counts``"""
+        now = time.time()
+        # One decode per window: far cheaper than slicing and decoding line by line
+        text = view[position:end].decode('utf-8', errors='replace')
+        position, end = 0, len(text)
+        while position < end:
+            newline = text.find('\n', position)
+            if newline < 0:
+                newline = end
+            line = text[position:newline].rstrip('\r')
+            position = newline + 1
+            if not line or line.isspace():
+                continue
+            row = self._row(line, now)
+            if row is None:
+                counts['skipped'] += 1
+            else:
+                counts['lines'] += 1
+                yield row
+
+    def sources(self):
+        """[(path, bytes ingested, lines, skipped, last ingest)] for every known source"""
+        db = self._connect()
+        return db.execute('SELECT path, offset, lines, skipped, updated FROM sources ORDER BY path').fetchall()
+
+    def _where(self, since, until, name=None):
+        clauses, params = ['e.ts >= ?', 'e.ts < ?'], [since, until]
+        if name is not None:
+            clauses.append('e.name = (SELECT id FROM names WHERE name = ?)')
+            params.append(name)
+        return ' AND '.join(clauses), params
+
+    def names(self, since, until):
+        """[(name, events, errors)] in the time range, most frequent first"""
+        where, params = self._where(since, until)
+        return self._connect().execute(f"""
+            SELECT n.name, COUNT(*), SUM(e.error) FROM events e JOIN names n ON n.id = e.name
+            WHERE {where} GROUP BY e.name ORDER BY COUNT(*) DESC""", params).fetchall()
+
+    def throughput(self, name, since, until, bucket):
+        """[(bucket start, events)] of ``name`` per ``bucket`` seconds"""
+        where, params = self._where(since, until, name)
+        return self._connect().execute(f"""
+            SELECT CAST(e.ts / ? AS INTEGER) * ?, COUNT(*) FROM events e
+            WHERE {where} GROUP BY 1 ORDER BY 1""", [bucket, bucket] + params).fetchall()
+
+    def latency(self, name, since, until, by=None, bucket=None):
+        """[(group, count, p50, p95, p99, max)] of ``name``'s duration_ms, by a column and/or time bucket"""
+        where, params = self._where(since, until, name)
+        groups = [GROUP_COLUMNS[by]] if by else []
+        if bucket:
+            groups.insert(0, f'CAST(e.ts / {float(bucket)} AS INTEGER) * {float(bucket)}')
+        group = ', '.join(groups) or 'NULL'
+        cursor = self._connect().execute(f"""
+            SELECT {group}, e.duration_ms FROM events e
+            JOIN names n ON n.id = e.name LEFT JOIN names l ON l.id = e.logger
+            WHERE {where} AND e.duration_ms IS NOT NULL ORDER BY {group}, e.duration_ms""", params)
+        results = []
+        current, durations = None, []
+        for row in cursor:
+            key = row[:-1]
+            if key != current and durations:
+                results.append(self._summary(current, durations))
+                durations = []
+            current = key
+            durations.append(row[-1])
+        if durations:
+            results.append(self._summary(current, durations))
+        return results
+
+    @staticmethod
+    def _summary(key, durations):
+        return (key, len(durations), percentile(durations, 0.50), percentile(durations, 0.95),
+                percentile(durations, 0.99), durations[-1])
+
+    def error_rates(self, since, until, by='name'):
+        """[(group, events, errors)] in the time range, most errors first"""
+        where, params = self._where(since, until)
+        column = GROUP_COLUMNS[by]
+        return self._connect().execute(f"""
+            SELECT {column}, COUNT(*), SUM(e.error) FROM events e
+            JOIN names n ON n.id = e.name LEFT JOIN names l ON l.id = e.logger
+            WHERE {where} GROUP BY {column} ORDER BY SUM(e.error) DESC, COUNT(*) DESC""", params).fetchall()
+
+    def chat_activity(self, since, until, limit=20):
+        """[(chat_id, events, updates, deliveries, errors, first ts, last ts)] for the busiest chats"""
+        where, params = self._where(since, until)
+        return self._connect().execute(f"""
+            SELECT e.chat_id, COUNT(*),
+                   SUM(e.name = (SELECT id FROM names WHERE name = 'update')),
+                   SUM(e.name = (SELECT id FROM names WHERE name = 'email.delivery')),
+                   SUM(e.error), MIN(e.ts), MAX(e.ts)
+            FROM events e WHERE {where} AND e.chat_id IS NOT NULL
+            GROUP BY e.chat_id ORDER BY COUNT(*) DESC LIMIT ?""", params + [limit]).fetchall()
@@ -1,28 +1,54 @@
 import smtplib
-import mimetypes
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email import encoders
-import requests
-from dotenv import load_dotenv
 import os
-from typing import Union, Tuple
-from pathlib import Path
-# Load environment variables
-load_dotenv()
-
-# Get SMTP credentials
-smtp_user = os.getenv("SMTP_USER")
-smtp_pass = os.getenv("SMTP_PASS")
-smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
-smtp_port = int(os.getenv("SMTP_PORT", "587"))
+from typing import Tuple
+from config.settings import (
+    SMTP_USER as smtp_user,
+    SMTP_PASS as smtp_pass,
+    SMTP_HOST as smtp_host,
+    SMTP_PORT as smtp_port,
+    SMTP_STARTTLS as smtp_starttls,
+    SMTP_DEBUG as smtp_debug,
+    SMTP_TIMEOUT as smtp_timeout,
+    SMTP_POOL_SIZE as smtp_pool_size,
+    SMTP_POOL_IDLE_TIMEOUT as smtp_pool_idle_timeout,
+    SMTP_POOL_MAX_MESSAGES as smtp_pool_max_messages,
+)
+from app.models.smtp_pool import SMTPConnectionPool
+from app.models.mime_stream import iter_attachment_message, send_streamed
+from app.models.bulk_mail import BulkMessage, send_bulk
+from app.models.delivery_queue import SendFailure, is_transient, send_failure
+from utils.logger import get_logger, span
+from utils.metrics import Counter, Histogram
+
+log = get_logger(__name__)
+
+CONNECT_SECONDS = Histogram('tsb_smtp_connect_seconds', 'Time to open (and authenticate) an SMTP connection')
+SEND_SECONDS = Histogram('tsb_smtp_send_seconds', 'Time to hand one email (or one bulk batch) to the SMTP server',
+                         ['kind'])
+SMTP_ERRORS = Counter('tsb_smtp_errors_total', 'Failed SMTP connects and sends', ['stage'])
+
+# Shared by every EmailSender so connections are reused across instances
+_shared_pool = None
+
+def get_shared_pool(factory):
+    """Return the process-wide SMTP pool, creating it on first use"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = SMTPConnectionPool(
+            factory,
+            max_size=smtp_pool_size,
+            idle_timeout=smtp_pool_idle_timeout,
+            max_messages=smtp_pool_max_messages
+        )
+    return _shared_pool
 
 class EmailSender:
-    def __init__(self):
+    def __init__(self, pool=None):
         self.sender_email = smtp_user
         self.sender_password = smtp_pass
+        self.pool = pool or get_shared_pool(self._create_smtp_server)
         
         # Supported file types
         self.supported_types = {
@@ -34,20 +60,24 @@ class EmailSender:
     def _create_smtp_server(self):
         """Create and return configured SMTP server"""
         try:
-            print(f"Connecting to SMTP server {smtp_host}:{smtp_port}")
-            server = smtplib.SMTP(smtp_host, smtp_port)
-            server.set_debuglevel(1)  # Add this line for detailed SMTP interaction
-            print("Starting TLS...")
-            server.starttls()
-            print(f"Logging in as {self.sender_email}...")
-            server.login(self.sender_email, self.sender_password)
-            print("SMTP login successful")
+            with span(log, 'smtp.connect', host=smtp_host, port=smtp_port, tls=smtp_starttls), \
+                    CONNECT_SECONDS.time():
+                server = smtplib.SMTP(smtp_host, smtp_port, timeout=smtp_timeout)
+                if smtp_debug:
+                    # Dumps the whole SMTP conversation, attachments included; never enable in production
+                    server.set_debuglevel(1)
+                if smtp_starttls:
+                    server.starttls()
+                if self.sender_password:
+                    server.login(self.sender_email, self.sender_password)
             return server
         except smtplib.SMTPAuthenticationError as e:
-            print(f"SMTP Authentication Error: {str(e)}")
+            SMTP_ERRORS.inc('auth')
+            log.error("SMTP authentication failed", extra={'fields': {'error': str(e)}})
             raise ValueError("Failed to authenticate with SMTP server. Check your credentials.")
         except Exception as e:
-            print(f"SMTP Connection Error: {str(e)}")
+            SMTP_ERRORS.inc('connect')
+            log.error("SMTP connection failed", extra={'fields': {'host': smtp_host, 'error': str(e)}})
             raise ConnectionError(f"Failed to connect to SMTP server: {str(e)}")
 
     def send_text_email(self, to_email, subject, body):
@@ -64,14 +94,16 @@ class EmailSender:
             msg['Subject'] = subject
             msg.attach(MIMEText(body, 'plain'))
 
-            # Send email
-            with self._create_smtp_server() as server:
-                server.send_message(msg)
-                
+            # Send email over a pooled connection
+            with span(log, 'smtp.send', attachment=False), SEND_SECONDS.time('text'):
+                self.pool.send(lambda server: server.send_message(msg))
+
             return True, "Email sent successfully!"
             
         except Exception as e:
-            return False, f"Failed to send email: {str(e)}"
+            SMTP_ERRORS.inc('send')
+            log.warning("Text email failed", extra={'fields': {'error': str(e)}})
+            return False, send_failure(e)
 
     def _get_mime_type(self, file_url):
         """Determine MIME type based on file extension"""
@@ -86,73 +118,59 @@ class EmailSender:
         else:
             return None
 
-    def send_attachment_email(self, to_email: str, subject: str, body: str, file_path: str) -> Tuple[bool, str]:
-        """Send email with attachment"""
+    def send_attachment_email(self, to_email: str, subject: str, body: str, file_path: str,
+                              encoded_path: str = None) -> Tuple[bool, str]:
+        """Send email with attachment, streaming the file into the SMTP session"""
         try:
-            print(f"Starting to send email with attachment...")
-            print(f"To: {to_email}")
-            print(f"Subject: {subject}")
-            print(f"File path: {file_path}")
-
             # Validate inputs
             if not all([to_email, subject, body, file_path]):
                 raise ValueError("Missing required fields")
 
-            # Create message
-            msg = MIMEMultipart()
-            msg['From'] = self.sender_email
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            msg.attach(MIMEText(body, 'plain'))
+            if not os.path.isfile(file_path):
+                raise ValueError(f"Failed to read file: {file_path} does not exist")
+
+            # The attachment is base64-encoded from disk (or read pre-encoded
+            # from the attachment cache) while the DATA phase is written, so
+            # memory use does not grow with the file size
+            with span(log, 'smtp.send', attachment=True, bytes=os.path.getsize(file_path),
+                      pre_encoded=bool(encoded_path)), SEND_SECONDS.time('attachment'):
+                self.pool.send(lambda server: send_streamed(
+                    server,
+                    self.sender_email,
+                    [to_email],
+                    iter_attachment_message(self.sender_email, to_email, subject, body, file_path,
+                                            encoded_path=encoded_path)
+                ))
 
-            # Read the file directly
-            try:
-                print("Reading file...")
-                with open(file_path, 'rb') as f:
-                    file_data = f.read()
-                print(f"Read file size: {len(file_data)} bytes")
+            return True, "Email with attachment sent successfully!"
                 
-                filename = os.path.basename(file_path)
-                print(f"Using filename: {filename}")
-
-            except Exception as e:
-                print(f"File read error: {str(e)}")
-                raise ValueError(f"Failed to read file: {str(e)}")
+        except Exception as e:
+            SMTP_ERRORS.inc('send')
+            log.warning("Attachment email failed", extra={'fields': {'error': str(e)}})
+            return False, send_failure(e)
 
-            # Determine MIME type
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if not mime_type:
-                mime_type = 'application/octet-stream'
-            maintype, subtype = mime_type.split('/', 1)
+    def send_bulk_email(self, bulk: BulkMessage) -> Tuple[bool, str]:
+        """Send a BulkMessage to its pending recipients over one pooled connection
 
-            print(f"Detected MIME type: {mime_type}")
-            print("Creating MIME part...")
-            
-            # Create attachment part
-            part = MIMEBase(maintype, subtype)
-            part.set_payload(file_data)
-            encoders.encode_base64(part)
-
-            # Add header with filename
-            part.add_header(
-                'Content-Disposition',
-                'attachment',
-                filename=filename
-            )
-            msg.attach(part)
-            print("File attached to message")
-
-            print("Connecting to SMTP server...")
-            with self._create_smtp_server() as server:
-                print("Sending message...")
-                server.send_message(msg)
-                print("Message sent successfully!")
-                
-            return True, "Email with attachment sent successfully!"
-                
+        Returns success once every recipient has a final answer (delivered or
+        permanently refused); transient failures stay pending for a retry.
+        """
+        pending = bulk.pending()
+        try:
+            with span(log, 'smtp.bulk_send', recipients=len(pending), attachment=bool(bulk.file_path)), \
+                    SEND_SECONDS.time('bulk'):
+                with self.pool.connection() as server:
+                    send_bulk(server, bulk, pending)
         except Exception as e:
-            print(f"Error sending email: {str(e)}")
-            return False, f"Failed to send email: {str(e)}"
+            # Not retried through pool.send: a reconnect would resend to recipients already done
+            SMTP_ERRORS.inc('send')
+            log.warning("Bulk email interrupted", extra={'fields': {'pending': len(bulk.pending()), 'error': str(e)}})
+            for recipient in bulk.pending():
+                bulk.results.setdefault(recipient, (0, f"Failed to send email: {str(e)}"))
+            if not is_transient(e):
+                return False, SendFailure(bulk.report(), transient=False)
+        return not bulk.pending(), bulk.report()
+
 def send_email_via_smtp(from_email, to_email, subject, body):
     email_sender = EmailSender()
     return email_sender.send_text_email(to_email, subject, body)[1]
@@ -0,0 +1,150 @@
+import base64
+import mimetypes
+import os
+import re
+from io import BytesIO
+
+# smtplib and the email package are imported by the functions that use
+# them: the attachment cache and recipient parsing only need the encoders,
+# and the bot should not load a mail stack at startup
+
+# Stands in for the attachment body while the MIME skeleton is generated
+PAYLOAD_MARKER = 'X-STREAMED-ATTACHMENT-PAYLOAD'
+
+# 57 raw bytes encode to exactly one 76-character base64 line, so reading
+# multiples of 57 keeps every chunk on whole lines
+READ_CHUNK_SIZE = 57 * 1024
+
+CRLF = b'\r\n'
+
+
+def _quote_periods(data):
+    """Dot-stuff lines that start with '.' for the SMTP DATA phase"""
+    return re.sub(rb'(?m)^\.', b'..', data)
+
+
+def render_message(msg):
+    """Flatten a message to CRLF, dot-stuffed bytes ready for the DATA phase"""
+    from email.generator import BytesGenerator
+    buffer = BytesIO()
+    BytesGenerator(buffer, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+    return _quote_periods(buffer.getvalue())
+
+
+def build_skeleton(sender, to_email, subject, body, filename, file_path=None):
+    """Return the (head, tail) bytes that surround the base64 attachment body
+
+    The message is generated by the email package with a marker where the
+    attachment payload goes, then split on that marker.  Headers, boundaries
+    and the text part are therefore exactly what MIMEMultipart would produce.
+    """
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+
+    mime_type, _ = mimetypes.guess_type(file_path or filename)
+    if not mime_type:
+        mime_type = 'application/octet-stream'
+    maintype, subtype = mime_type.split('/', 1)
+
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(PAYLOAD_MARKER)
+    part['Content-Transfer-Encoding'] = 'base64'
+    disposition_name = filename if filename.isascii() else ('utf-8', '', filename)
+    part.add_header('Content-Disposition', 'attachment', filename=disposition_name)
+    msg.attach(part)
+
+    head, tail = render_message(msg).split(PAYLOAD_MARKER.encode(), 1)
+    return head, tail
+
+
+def iter_base64(file_obj, chunk_size=READ_CHUNK_SIZE):
+    """Yield CRLF-terminated 76-column base64 lines for a file, one chunk at a time"""
+    chunk_size = max(57, chunk_size - chunk_size % 57)
+    while True:
+        data = file_obj.read(chunk_size)
+        if not data:
+            break
+        encoded = base64.b64encode(data)
+        # Base64 output never starts a line with '.', so no dot-stuffing needed
+        yield CRLF.join(encoded[i:i + 76] for i in range(0, len(encoded), 76)) + CRLF
+
+
+def iter_encoded(file_obj, chunk_size=READ_CHUNK_SIZE):
+    """Yield an already base64-encoded body (as written by iter_base64) in chunks"""
+    while True:
+        data = file_obj.read(chunk_size)
+        if not data:
+            break
+        yield data
+
+
+def iter_attachment_message(sender, to_email, subject, body, file_path, filename=None,
+                            chunk_size=READ_CHUNK_SIZE, encoded_path=None):
+    """Yield a complete multipart message in chunks, reading the file lazily
+
+    With ``encoded_path`` the base64 body is streamed from that pre-encoded
+    file instead of being encoded from ``file_path`` again.
+    """
+    filename = filename or os.path.basename(file_path)
+    head, tail = build_skeleton(sender, to_email, subject, body, filename, file_path)
+    try:
+        encoded = open(encoded_path, 'rb') if encoded_path else None
+    except FileNotFoundError:
+        encoded = None  # evicted from the attachment cache meanwhile
+    yield head
+    if encoded is not None:
+        with encoded:
+            yield from iter_encoded(encoded, chunk_size)
+    else:
+        with open(file_path, 'rb') as f:
+            yield from iter_base64(f, chunk_size)
+    yield tail
+
+
+def send_streamed(server, from_addr, to_addrs, chunks):
+    """Send an already dot-stuffed, CRLF message to an smtplib.SMTP in chunks
+
+    This is smtplib.SMTP.sendmail with the DATA phase written straight to the
+    socket, so the message is never held in memory as a whole.  Returns the
+    dict of refused recipients, like sendmail does.
+    """
+    import smtplib
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = server.docmd('data')
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+
+    last = b''
+    for chunk in chunks:
+        if chunk:
+            server.send(chunk)
+            last = chunk
+    server.send(b'.\r\n' if last.endswith(CRLF) else b'\r\n.\r\n')
+
+    code, resp = server.getreply()
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
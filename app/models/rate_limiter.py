@@ -0,0 +1,283 @@
+import atexit
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from config.settings import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE,
+    OUTBOX_COALESCE_WINDOW,
+    OUTBOX_SENDERS,
+)
+from app.models.telegram_client import TelegramAPIError
+from utils.logger import get_logger
+from utils.metrics import Counter, Histogram
+
+log = get_logger(__name__)
+
+# Telegram rejects longer texts, so coalescing stops there
+MAX_MESSAGE_LENGTH = 4096
+SEPARATOR = '\n\n'
+
+MESSAGES = Counter('tsb_outbound_messages_total', 'Replies handled by the outbound scheduler, by outcome', ['result'])
+SENDS = Counter('tsb_outbound_sends_total', 'sendMessage calls made by the outbound scheduler, by outcome', ['result'])
+QUEUE_SECONDS = Histogram('tsb_outbound_queue_seconds', 'Time a reply waited before it was sent')
+
+
+class TokenBucket:
+    """``rate`` tokens per second, at most ``capacity`` saved up; a rate of 0 is unlimited"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is now)"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Take a token if one is available; otherwise return how long to wait for it"""
+        wait = self.wait_time(now)
+        if not wait and self.rate:
+            self.tokens -= 1
+        return wait
+
+    def full(self, now):
+        return self.wait_time(now) == 0 and (not self.rate or self.tokens >= self.capacity)
+
+
+class _Chat:
+    __slots__ = ('chat_id', 'bucket', 'messages', 'not_before', 'scheduled', 'sending', 'failures')
+
+    def __init__(self, chat_id, bucket):
+        self.chat_id = chat_id
+        self.bucket = bucket
+        self.messages = deque()  # (text, queued at)
+        self.not_before = 0.0
+        self.scheduled = False
+        self.sending = False
+        self.failures = 0
+
+
+class OutboundScheduler:
+    """Sends replies through ``send(chat_id, text)`` within Telegram's rate limits
+
+    ``submit`` only queues a reply.  Sender threads take the chat whose next
+    reply may go first: each chat has its own token bucket (``chat_rate``
+    per second with ``chat_burst`` saved up, ``group_rate`` for groups) and
+    every send also takes a token from the global bucket.  Replies that
+    pile up for a chat while it waits - or arrive within ``coalesce_window``
+    of the first - are joined into one message.  A 429 puts them back at the
+    front of the chat's queue until ``retry_after`` has passed, so throttling
+    delays replies instead of losing them; network errors and 5xx responses
+    are retried with backoff up to ``max_attempts``.
+    """
+
+    def __init__(self, send, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, group_rate=TELEGRAM_GROUP_RATE,
+                 coalesce_window=OUTBOX_COALESCE_WINDOW, senders=OUTBOX_SENDERS, max_attempts=4,
+                 backoff=0.5, exit_timeout=5.0):
+        self.send = send
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.coalesce_window = coalesce_window
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.exit_timeout = exit_timeout
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._heap = []  # (ready at, seq, chat) for chats with replies waiting
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0  # replies queued or being sent
+        self._counts = {'submitted': 0, 'sent': 0, 'sends': 0, 'throttled': 0, 'retried': 0, 'dropped': 0}
+        self._threads = []
+        self._started = False
+        self._closed = False
+
+    def start(self):
+        """Start the sender threads (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for i in range(self.senders):
+                thread = threading.Thread(target=self._sender, name=f"outbound-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        atexit.register(self.flush, self.exit_timeout)
+
+    def submit(self, chat_id, text):
+        """Queue a reply; returns False once the scheduler is closed"""
+        self.start()
+        with self._lock:
+            if self._closed:
+                return False
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                rate, burst = (self.group_rate, 1) if chat_id < 0 else (self.chat_rate, self.chat_burst)
+                chat = self._chats[chat_id] = _Chat(chat_id, TokenBucket(rate, burst))
+            chat.messages.append((text, time.monotonic()))
+            self._pending += 1
+            self._counts['submitted'] += 1
+            if not chat.scheduled and not chat.sending:
+                self._schedule(chat)
+        return True
+
+    def _schedule(self, chat):
+        # Lock held.  A chat is in the heap at most once, while it has replies and none in flight
+        now = time.monotonic()
+        ready_at = max(chat.messages[0][1] + self.coalesce_window, chat.not_before,
+                       now + chat.bucket.wait_time(now))
+        chat.scheduled = True
+        heapq.heappush(self._heap, (ready_at, next(self._seq), chat))
+        self._ready.notify()
+
+    def _next(self):
+        """Block until some chat may send; returns (chat, replies), or (None, None) when closed"""
+        with self._lock:
+            while True:
+                timeout = None
+                if self._heap:
+                    ready_at, _, chat = self._heap[0]
+                    now = time.monotonic()
+                    if ready_at > now:
+                        timeout = ready_at - now
+                    else:
+                        wait = chat.bucket.wait_time(now)
+                        if wait:
+                            heapq.heapreplace(self._heap, (now + wait, next(self._seq), chat))
+                            continue
+                        timeout = self._global.take(now)
+                        if not timeout:
+                            heapq.heappop(self._heap)
+                            chat.bucket.take(now)
+                            chat.scheduled = False
+                            chat.sending = True
+                            return chat, self._batch(chat)
+                elif self._closed:
+                    return None, None
+                self._ready.wait(timeout)
+
+    def _batch(self, chat):
+        batch = [chat.messages.popleft()]
+        length = len(batch[0][0])
+        while chat.messages and length + len(SEPARATOR) + len(chat.messages[0][0]) <= MAX_MESSAGE_LENGTH:
+            length += len(SEPARATOR) + len(chat.messages[0][0])
+            batch.append(chat.messages.popleft())
+        return batch
+
+    def _sender(self):
+        while True:
+            chat, batch = self._next()
+            if chat is None:
+                return
+            try:
+                self.send(chat.chat_id, SEPARATOR.join(text for text, _ in batch))
+            except TelegramAPIError as e:
+                self._failed(chat, batch, e)
+            except Exception as e:
+                self._failed(chat, batch, TelegramAPIError(str(e)))
+            else:
+                self._sent(chat, batch)
+
+    def _sent(self, chat, batch):
+        now = time.monotonic()
+        SENDS.inc('sent')
+        MESSAGES.add(len(batch), 'sent')
+        for _, queued_at in batch:
+            QUEUE_SECONDS.observe(now - queued_at)
+        with self._lock:
+            chat.failures = 0
+            self._counts['sends'] += 1
+            self._counts['sent'] += len(batch)
+            self._done(chat, len(batch))
+            if self._counts['sends'] % 1024 == 0:
+                self._forget_idle(now)
+
+    def _failed(self, chat, batch, error):
+        now = time.monotonic()
+        with self._lock:
+            if error.error_code == 429:
+                # Flood control: same replies, same order, once the API lets us
+                delay = float(error.retry_after or 1)
+                self._counts['throttled'] += 1
+                SENDS.inc('throttled')
+            elif (error.error_code is None or error.error_code >= 500) and chat.failures + 1 < self.max_attempts:
+                chat.failures += 1
+                delay = self.backoff * 2 ** (chat.failures - 1)
+                self._counts['retried'] += 1
+                SENDS.inc('retried')
+            else:
+                chat.failures = 0
+                self._counts['dropped'] += len(batch)
+                SENDS.inc('failed')
+                MESSAGES.add(len(batch), 'dropped')
+                log.warning("sendMessage failed", extra={'fields': {
+                    'chat_id': chat.chat_id, 'replies': len(batch), 'error': str(error)}})
+                self._done(chat, len(batch))
+                return
+            log.info("sendMessage deferred", extra={'fields': {
+                'chat_id': chat.chat_id, 'code': error.error_code, 'delay': delay}})
+            chat.messages.extendleft(reversed(batch))
+            chat.not_before = now + delay
+            self._done(chat, 0)
+
+    def _done(self, chat, finished):
+        # Lock held
+        chat.sending = False
+        self._pending -= finished
+        if chat.messages:
+            self._schedule(chat)
+        elif not self._pending:
+            self._idle.notify_all()
+
+    def _forget_idle(self, now):
+        # Lock held.  A chat whose bucket has refilled behaves exactly like a new one
+        for chat_id, chat in list(self._chats.items()):
+            if not (chat.messages or chat.sending or chat.scheduled) and chat.not_before <= now \
+                    and chat.bucket.full(now):
+                del self._chats[chat_id]
+
+    def flush(self, timeout=None):
+        """Block until every queued reply has been sent or given up on; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Stop accepting replies, send what is queued, then stop the senders"""
+        with self._lock:
+            self._closed = True
+            self._ready.notify_all()
+        return self.flush(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts, queued=self._pending, chats=len(self._chats))
+        stats['coalesced'] = stats['sent'] - stats['sends']
+        return stats
@@ -1,13 +1,159 @@
+import heapq
+import os
+import re
+import sqlite3
 import time
 import threading
+from config.settings import REMINDER_DB, REMINDER_MAX_DAYS
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# "90", "30s", "10m", "2h", "1d", "1h30m" -> seconds (a bare number means minutes)
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)([smhd])')
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Longest accepted delay; far-future due times overflow the platform's time_t in Condition.wait
+MAX_DELAY = REMINDER_MAX_DAYS * 86400
+
+
+def parse_duration(text):
+    """Parse a reminder delay into seconds, or return None if it isn't one"""
+    text = text.strip().lower()
+    if re.fullmatch(r'\d+(?:\.\d+)?', text):
+        return float(text) * 60
+    if not text or not re.fullmatch(r'(?:\d+(?:\.\d+)?[smhd])+', text):
+        return None
+    return sum(float(value) * _UNIT_SECONDS[unit] for value, unit in _DURATION_PART.findall(text))
+
+
+class ReminderScheduler:
+    """One timer thread over a heap of due times, persisted to SQLite
+
+    The heap only holds (due_at, reminder_id); the task text lives in the
+    database and is read back when the reminder fires, so pending reminders
+    cost one shared thread plus a small heap entry each.  Cancelling deletes
+    the row and leaves a stale heap entry that is skipped when it comes due
+    (the heap is rebuilt if stale entries pile up).  Pending reminders are
+    reloaded from the database on start, so they survive restarts.
+
+    Reminders are delivered through ``send_func(chat_id, text)``, or through
+    the function passed to ``schedule`` for that reminder; such a function
+    only lives in memory, so after a restart the reminder falls back to
+    ``send_func``.
+    """
+
+    def __init__(self, send_func=None, db_path=REMINDER_DB):
+        self.send_func = send_func
+        self.db_path = db_path
+        self._heap = []
+        self._senders = {}  # reminder_id -> send function of that reminder
+        self._stale = 0
+        self._cond = threading.Condition()
+        self._db = None
+        self._thread = None
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS reminders ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, '
+                'task TEXT NOT NULL, due_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS reminders_chat ON reminders (chat_id)')
+            self._heap = [tuple(row) for row in self._db.execute('SELECT due_at, id FROM reminders')]
+            heapq.heapify(self._heap)
+        return self._db
+
+    def start(self):
+        """Load persisted reminders and start the timer thread (idempotent)"""
+        with self._cond:
+            self._connect()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reminders', daemon=True)
+                self._thread.start()
+
+    def schedule(self, chat_id, task, delay_seconds, send_func=None):
+        """Persist a reminder and return its id; raises ValueError past MAX_DELAY
+
+        ``send_func`` delivers this reminder instead of the scheduler's own.
+        """
+        if not 0 <= delay_seconds <= MAX_DELAY:
+            raise ValueError(f"Reminder delay must be between 0 and {REMINDER_MAX_DAYS} days")
+        due_at = time.time() + delay_seconds
+        with self._cond:
+            cursor = self._connect().execute(
+                'INSERT INTO reminders (chat_id, task, due_at) VALUES (?, ?, ?)', (chat_id, task, due_at))
+            reminder_id = cursor.lastrowid
+            if send_func is not None:
+                self._senders[reminder_id] = send_func
+            heapq.heappush(self._heap, (due_at, reminder_id))
+            if self._heap[0][1] == reminder_id:
+                self._cond.notify()  # new earliest deadline
+        self.start()
+        return reminder_id
+
+    def cancel(self, reminder_id, chat_id=None):
+        """Cancel a pending reminder; chat_id restricts it to the owner's reminders"""
+        with self._cond:
+            query, params = 'DELETE FROM reminders WHERE id = ?', (reminder_id,)
+            if chat_id is not None:
+                query, params = query + ' AND chat_id = ?', params + (chat_id,)
+            if self._connect().execute(query, params).rowcount == 0:
+                return False
+            self._senders.pop(reminder_id, None)
+            self._stale += 1
+            if self._stale > 1000 and self._stale > len(self._heap) // 2:
+                self._heap = [tuple(row) for row in self._db.execute('SELECT due_at, id FROM reminders')]
+                heapq.heapify(self._heap)
+                self._stale = 0
+            return True
+
+    def pending(self, chat_id):
+        """Return [(id, task, due_at)] for a chat, soonest first"""
+        with self._cond:
+            return self._connect().execute(
+                'SELECT id, task, due_at FROM reminders WHERE chat_id = ? ORDER BY due_at',
+                (chat_id,)).fetchall()
+
+    def __len__(self):
+        with self._cond:
+            return self._connect().execute('SELECT COUNT(*) FROM reminders').fetchone()[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    # capped so a far-future row (one saved before MAX_DELAY existed) can't overflow the wait
+                    self._cond.wait(min(self._heap[0][0] - time.time(), threading.TIMEOUT_MAX)
+                                    if self._heap else None)
+                _, reminder_id = heapq.heappop(self._heap)
+                row = self._db.execute(
+                    'DELETE FROM reminders WHERE id = ? RETURNING chat_id, task', (reminder_id,)).fetchone()
+                if row is None:
+                    self._stale = max(0, self._stale - 1)
+                    continue
+                send = self._senders.pop(reminder_id, None) or self.send_func
+            chat_id, task = row
+            try:
+                send(chat_id, f"Reminder: {task}")
+            except Exception as e:
+                log.warning("Reminder delivery failed", extra={'fields': {'reminder_id': reminder_id, 'error': str(e)}})
+
+
+# Process-wide scheduler used by set_reminder and the /remindme command
+scheduler = ReminderScheduler()
+
 
 def set_reminder(time_in_minutes, task, chat_id, send_message_func):
     """
-    Sends a reminder after the specified time.
+    Sends a reminder after the specified time through send_message_func.
     """
-    def remind():
-        time.sleep(time_in_minutes * 60)  # Wait for the specified time
-        send_message_func(chat_id, f"Reminder: {task}")
-    
-    threading.Thread(target=remind).start()
+    scheduler.schedule(chat_id, task, time_in_minutes * 60, send_func=send_message_func)
     return "Reminder set!"
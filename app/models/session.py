@@ -0,0 +1,51 @@
+import time
+from dataclasses import dataclass, field, fields
+from enum import Enum
+from typing import Optional
+
+
+class Step(str, Enum):
+    """States of the /send_mail conversation"""
+    WAITING_FOR_EMAIL = 'waiting_for_email'
+    WAITING_FOR_CONTENT_TYPE = 'waiting_for_content_type'
+    WAITING_FOR_TEXT_MESSAGE = 'waiting_for_text_message'
+    WAITING_FOR_RENAME = 'waiting_for_rename'
+    WAITING_FOR_NEW_NAME = 'waiting_for_new_name'
+    WAITING_FOR_FILE = 'waiting_for_file'
+    WAITING_FOR_DESCRIPTION = 'waiting_for_description'
+    WAITING_FOR_SUBJECT = 'waiting_for_subject'
+
+
+@dataclass(slots=True)
+class Session:
+    """Compact per-chat conversation record
+
+    A slotted dataclass has no per-instance ``__dict__`` or hash table, so a
+    session costs less memory than the free-form dict it replaces.
+    """
+    step: Step = Step.WAITING_FOR_EMAIL
+    start_time: float = field(default_factory=time.time)
+    email: Optional[str] = None
+    recipients: Optional[list] = None  # set only in bulk mode (more than one address)
+    content_type: Optional[str] = None
+    text_message: Optional[str] = None
+    new_filename: Optional[str] = None
+    file_path: Optional[str] = None
+    file_type: Optional[str] = None
+    file_key: Optional[str] = None  # attachment cache key of the uploaded file
+    description: Optional[str] = None
+
+    def to_dict(self):
+        """Serialize to a JSON-friendly dict, omitting unset fields"""
+        data = {}
+        for f in fields(self):
+            value = getattr(self, f.name)
+            if value is not None:
+                data[f.name] = value.value if isinstance(value, Step) else value
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['step'] = Step(data.get('step', Step.WAITING_FOR_EMAIL))
+        return cls(**data)
@@ -0,0 +1,351 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from config.settings import SESSION_BACKEND, SESSION_TTL, SESSION_MAX, SESSION_SOCKET, SESSION_AUTHKEY, REDIS_URL
+from app.models.session import Session
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+def remove_session_file(session):
+    """Delete the temp file an abandoned session was holding on to"""
+    file_path = session.file_path if session else None
+    try:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+    except Exception as e:
+        log.warning("Temp file cleanup failed", extra={'fields': {'error': str(e)}})
+
+
+class SessionStore:
+    """Conversation state keyed by chat_id
+
+    Supports the dict operations the handlers use (``in``, ``[]``, ``del``)
+    plus ``update`` to set fields on a stored session.  Values are Session
+    records and must be written back with ``update`` or assignment -
+    mutating a returned record is not guaranteed to persist.
+    """
+
+    def get(self, chat_id, default=None):
+        raise NotImplementedError
+
+    def peek(self, chat_id, default=None):
+        """Like get, but without counting as activity (the session's TTL is not extended)"""
+        return self.get(chat_id, default)
+
+    def set(self, chat_id, session):
+        raise NotImplementedError
+
+    def delete(self, chat_id):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def update(self, chat_id, fields):
+        """Set fields on an existing session and store it"""
+        session = self[chat_id]
+        for name, value in fields.items():
+            setattr(session, name, value)
+        self.set(chat_id, session)
+        return session
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def __getitem__(self, chat_id):
+        session = self.get(chat_id)
+        if session is None:
+            raise KeyError(chat_id)
+        return session
+
+    def __setitem__(self, chat_id, session):
+        self.set(chat_id, session)
+
+    def __delitem__(self, chat_id):
+        if not self.delete(chat_id):
+            raise KeyError(chat_id)
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store with sliding TTL and LRU eviction
+
+    Entries live in an OrderedDict ordered by last access, so the least
+    recently used session is always at the front and, because the TTL is
+    sliding, it is also the first to expire.  Eviction therefore only ever
+    pops from the front: O(1) amortized, never a full scan.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX, on_evict=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _expire_locked(self, now):
+        evicted = []
+        while self._data:
+            chat_id, (expires_at, session) = next(iter(self._data.items()))
+            if expires_at > now and len(self._data) <= self.max_sessions:
+                break
+            self._data.popitem(last=False)
+            evicted.append(session)
+        return evicted
+
+    def _evict(self, sessions):
+        if self.on_evict:
+            for session in sessions:
+                self.on_evict(session)
+
+    def get(self, chat_id, default=None):
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._expire_locked(now)
+            entry = self._data.get(chat_id)
+            if entry is not None:
+                self._data[chat_id] = (now + self.ttl, entry[1])
+                self._data.move_to_end(chat_id)
+        self._evict(evicted)
+        return entry[1] if entry is not None else default
+
+    def peek(self, chat_id, default=None):
+        with self._lock:
+            evicted = self._expire_locked(time.monotonic())
+            entry = self._data.get(chat_id)
+        self._evict(evicted)
+        return entry[1] if entry is not None else default
+
+    def set(self, chat_id, session):
+        now = time.monotonic()
+        with self._lock:
+            self._data[chat_id] = (now + self.ttl, session)
+            self._data.move_to_end(chat_id)
+            evicted = self._expire_locked(now)
+        self._evict(evicted)
+
+    def delete(self, chat_id):
+        with self._lock:
+            return self._data.pop(chat_id, None) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class RedisSessionStore(SessionStore):
+    """Redis-backed store so several workers and hosts can share sessions
+
+    Redis expires the session keys itself.  Live chat_ids are also kept in a
+    sorted set scored by expiry time, so ``len`` is one ZCOUNT instead of a
+    keyspace scan.  Temp files referenced by a session are tracked the same
+    way; ``sweep`` (run opportunistically on writes) removes files whose
+    session is gone and trims expired chat_ids.  Works with any redis-py
+    compatible client, including fakeredis.
+    """
+
+    def __init__(self, client, ttl=SESSION_TTL, prefix='tsb:session:', on_evict=None,
+                 sweep_interval=30):
+        self.client = client
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.files_key = prefix + 'files'
+        self.active_key = prefix + 'active'
+        self.on_evict = on_evict
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+
+    def _key(self, chat_id):
+        return f"{self.prefix}{chat_id}"
+
+    def get(self, chat_id, default=None):
+        raw = self.client.get(self._key(chat_id))
+        if raw is None:
+            return default
+        pipe = self.client.pipeline()
+        pipe.expire(self._key(chat_id), self.ttl)
+        pipe.zadd(self.active_key, {str(chat_id): time.time() + self.ttl})
+        pipe.execute()
+        return Session.from_dict(json.loads(raw))
+
+    def peek(self, chat_id, default=None):
+        raw = self.client.get(self._key(chat_id))
+        return Session.from_dict(json.loads(raw)) if raw is not None else default
+
+    def set(self, chat_id, session):
+        expires_at = time.time() + self.ttl
+        pipe = self.client.pipeline()
+        pipe.set(self._key(chat_id), json.dumps(session.to_dict()), ex=self.ttl)
+        pipe.zadd(self.active_key, {str(chat_id): expires_at})
+        if session.file_path:
+            member = json.dumps([str(chat_id), session.file_path])
+            pipe.zadd(self.files_key, {member: expires_at})
+        pipe.execute()
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.sweep()
+
+    def delete(self, chat_id):
+        session = self.peek(chat_id)
+        if session is None:
+            return False
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(chat_id))
+        pipe.zrem(self.active_key, str(chat_id))
+        if session.file_path:
+            # The file now belongs to whoever deleted the session
+            pipe.zrem(self.files_key, json.dumps([str(chat_id), session.file_path]))
+        pipe.execute()
+        return True
+
+    def sweep(self, limit=100):
+        """Clean up files of sessions that expired; returns how many were removed"""
+        now = time.time()
+        self.client.zremrangebyscore(self.active_key, 0, now)
+        removed = 0
+        for member in self.client.zrangebyscore(self.files_key, 0, now, start=0, num=limit):
+            chat_id, file_path = json.loads(member)
+            # peek: looking at a session must not keep it alive
+            session = self.peek(chat_id)
+            if session is not None and session.file_path == file_path:
+                # Still in use (it was read since): check again once its current TTL runs out
+                expires_at = self.client.zscore(self.active_key, str(chat_id)) or now + self.ttl
+                self.client.zadd(self.files_key, {member: max(expires_at, now + 1)})
+                continue
+            if self.client.zrem(self.files_key, member):
+                if self.on_evict:
+                    self.on_evict(Session(file_path=file_path))
+                removed += 1
+        return removed
+
+    def __len__(self):
+        return self.client.zcount(self.active_key, time.time(), '+inf')
+
+
+class ServedSessionStore(MemorySessionStore):
+    """The session server's store: a MemorySessionStore plus what its workers coordinate on"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._claimed = set()
+
+    def size(self):
+        return len(self)
+
+    def claim(self, name):
+        """True for the first caller only, so a once-per-server task (journal replay) runs once"""
+        with self._lock:
+            if name in self._claimed:
+                return False
+            self._claimed.add(name)
+            return True
+
+
+_SERVED_METHODS = ('get', 'peek', 'set', 'delete', 'size', 'claim')
+
+
+class SessionManager(BaseManager):
+    """multiprocessing manager exposing the session server's store as ``sessions()``"""
+
+
+SessionManager.register('sessions', exposed=_SERVED_METHODS)
+
+
+def serve_sessions(address=SESSION_SOCKET, authkey=SESSION_AUTHKEY, ttl=SESSION_TTL, max_sessions=SESSION_MAX):
+    """Run the session server on a Unix socket until the process that started it exits
+
+    Expired sessions are just dropped: their uploads are left to the workers'
+    spool sweepers, which see that no session claims them any more.
+    """
+    store = ServedSessionStore(ttl=ttl, max_sessions=max_sessions)
+
+    class Server(SessionManager):
+        pass
+
+    Server.register('sessions', callable=lambda: store, exposed=_SERVED_METHODS)
+    directory = os.path.dirname(address)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(address):
+        os.remove(address)  # left behind by a server that was killed
+    server = Server(address=address, authkey=authkey.encode()).get_server()
+
+    parent = os.getppid()
+
+    def watch_parent():
+        # Do not outlive the gunicorn master (or whoever started us), even if it was killed
+        while os.getppid() == parent:
+            time.sleep(1)
+        log.info("Session server parent exited, stopping")
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, name='parent-watch', daemon=True).start()
+    log.info("Session server listening", extra={'fields': {'address': address}})
+    server.serve_forever()
+
+
+class SharedSessionStore(SessionStore):
+    """Client of the session server, so every worker process sees the same sessions
+
+    Each call is one round trip over the server's Unix socket (every thread
+    gets its own connection).  Sessions come back as copies, so - as with
+    Redis - changes must be written back.  If the server was restarted, the
+    call is retried once on a fresh connection.
+    """
+
+    def __init__(self, address=SESSION_SOCKET, authkey=SESSION_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self._remote = None
+        self._lock = threading.Lock()
+
+    def _connect(self, stale=None):
+        with self._lock:
+            if self._remote is None or self._remote is stale:
+                manager = SessionManager(address=self.address, authkey=self.authkey.encode())
+                manager.connect()
+                self._remote = manager.sessions()
+            return self._remote
+
+    def _call(self, method, *args):
+        remote = self._remote or self._connect()
+        try:
+            return getattr(remote, method)(*args)
+        except (EOFError, OSError):
+            log.warning("Session server connection lost, reconnecting", extra={'fields': {'address': self.address}})
+            return getattr(self._connect(stale=remote), method)(*args)
+
+    def get(self, chat_id, default=None):
+        session = self._call('get', chat_id)
+        return session if session is not None else default
+
+    def peek(self, chat_id, default=None):
+        session = self._call('peek', chat_id)
+        return session if session is not None else default
+
+    def set(self, chat_id, session):
+        self._call('set', chat_id, session)
+
+    def delete(self, chat_id):
+        return self._call('delete', chat_id)
+
+    def claim(self, name):
+        return self._call('claim', name)
+
+    def __len__(self):
+        return self._call('size')
+
+
+def create_session_store(on_evict=remove_session_file):
+    """Build the session store selected by SESSION_BACKEND"""
+    if SESSION_BACKEND == 'redis':
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(REDIS_URL), on_evict=on_evict)
+    if SESSION_BACKEND == 'shared':
+        # Files of expired sessions are reclaimed by the spool sweeper, not on_evict
+        return SharedSessionStore()
+    return MemorySessionStore(on_evict=on_evict)
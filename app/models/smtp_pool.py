@@ -0,0 +1,161 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PooledConnection:
+    """An SMTP connection plus the bookkeeping the pool needs"""
+
+    __slots__ = ('server', 'created_at', 'last_used', 'messages')
+
+    def __init__(self, server):
+        now = time.monotonic()
+        self.server = server
+        self.created_at = now
+        self.last_used = now
+        self.messages = 0
+
+    def close(self):
+        """Close the connection, ignoring errors from an already dead socket"""
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Bounded, thread-safe pool of authenticated SMTP connections
+
+    Idle connections are kept on a LIFO stack so the hottest connection is
+    reused first and the stalest ones sink to the bottom, where they are
+    closed once they pass ``idle_timeout``.  A connection that has been idle
+    longer than ``health_check_interval`` is probed with NOOP before reuse,
+    and connections are retired after ``max_messages`` sends so the relay
+    never sees one session carry an unbounded number of messages.
+    """
+
+    def __init__(self, factory, max_size=4, idle_timeout=60.0, max_messages=100,
+                 health_check_interval=10.0, acquire_timeout=30.0):
+        self._factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def _evict_idle_locked(self, now):
+        """Close connections that sat idle past the timeout (caller holds the lock)"""
+        stale = []
+        while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            stale.append(self._idle.pop(0))
+        self._created -= len(stale)
+        return stale
+
+    def _is_healthy(self, conn):
+        """Probe a connection with NOOP if it has been idle for a while"""
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            code, _ = conn.server.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None):
+        """Take a connection from the pool, opening a new one if below max_size"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    stale = self._evict_idle_locked(time.monotonic())
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._created < self.max_size:
+                        self._created += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a free SMTP connection")
+                    self._cond.wait(remaining)
+            for old in stale:
+                old.close()
+
+            if conn is None:
+                try:
+                    return PooledConnection(self._factory())
+                except BaseException:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn):
+                return conn
+            # Dead connection: drop it and go round again for a fresh one
+            self.release(conn, discard=True)
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is spent or broken"""
+        conn.last_used = time.monotonic()
+        retire = discard or conn.messages >= self.max_messages
+        with self._cond:
+            if retire:
+                self._created -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if retire:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled smtplib.SMTP instance"""
+        conn = self.acquire()
+        try:
+            yield conn.server
+        except smtplib.SMTPServerDisconnected:
+            self.release(conn, discard=True)
+            raise
+        except smtplib.SMTPException:
+            # The server answered, so the session itself is still usable
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            conn.messages += 1
+            self.release(conn)
+
+    def send(self, send_func):
+        """Run send_func(server), reconnecting once if the server dropped the connection"""
+        try:
+            with self.connection() as server:
+                return send_func(server)
+        except smtplib.SMTPServerDisconnected:
+            with self.connection() as server:
+                return send_func(server)
+
+    def close_all(self):
+        """Close every idle connection (e.g. on shutdown or after fork)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Return a snapshot of pool occupancy"""
+        with self._cond:
+            return {'open': self._created, 'idle': len(self._idle), 'max_size': self.max_size}
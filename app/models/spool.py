@@ -0,0 +1,245 @@
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from config.settings import (
+    SPOOL_BACKEND,
+    SPOOL_DIR,
+    SPOOL_TMPFS_DIR,
+    SPOOL_MEMORY_MAX_KB,
+    SPOOL_QUOTA_MB,
+    SPOOL_SWEEP_INTERVAL,
+    SPOOL_GRACE,
+)
+from utils.logger import get_logger
+from utils.metrics import Counter, directory_size
+
+log = get_logger(__name__)
+
+# <chat_id>-<random>: a directory that belongs to one upload (older layouts used just <chat_id>)
+_UPLOAD_DIRECTORY = re.compile(r'-?\d+-[0-9a-f]{16}')
+
+REJECTED = Counter('tsb_spool_rejected_total', 'Uploads refused because the spool quota was reached')
+RECLAIMED = Counter('tsb_spool_reclaimed_bytes_total', 'Bytes of abandoned uploads removed by the sweeper')
+
+
+class SpoolFull(Exception):
+    """Raised when an upload would take the spool over its byte quota"""
+
+
+def safe_filename(filename):
+    """The bare file name of a user-supplied name (no directories, never empty)"""
+    name = os.path.basename(str(filename).replace('\\', '/')).strip()
+    return name if name not in ('', '.', '..') else 'upload'
+
+
+class Spool:
+    """Owns the temp files uploads are downloaded to
+
+    Every file gets a directory of its own, ``<root>/<chat_id>-<random>/``,
+    so concurrent uploads never share a path, and the user-supplied name is
+    reduced to a bare file name.  ``allocate`` is the admission check: it
+    reserves the upload's expected size against ``quota`` bytes and raises
+    SpoolFull rather than let the disk fill up; ``release`` deletes the file
+    and gives its bytes back.
+
+    Backends: 'disk' keeps files under ``directory``, 'tmpfs' under
+    ``tmpfs_directory`` (RAM), and 'memory' puts files of up to
+    ``memory_max`` bytes on tmpfs and larger ones on disk.
+
+    Every ``sweep_interval`` seconds a background thread removes files older
+    than ``grace`` seconds that ``in_use(chat_id, path)`` no longer claims
+    (sessions that expired, were abandoned or died with the process), and
+    re-measures the spool so files of other workers count against the quota.
+    """
+
+    def __init__(self, backend=SPOOL_BACKEND, directory=SPOOL_DIR, tmpfs_directory=SPOOL_TMPFS_DIR,
+                 memory_max=SPOOL_MEMORY_MAX_KB * 1024, quota=SPOOL_QUOTA_MB * 1024 * 1024,
+                 sweep_interval=SPOOL_SWEEP_INTERVAL, grace=SPOOL_GRACE, in_use=None):
+        if backend not in ('disk', 'tmpfs', 'memory'):
+            raise ValueError(f"Unknown spool backend {backend!r}")
+        if backend != 'disk' and not os.path.isdir(os.path.dirname(os.path.abspath(tmpfs_directory))):
+            log.warning("No tmpfs for the spool, using disk", extra={'fields': {'directory': tmpfs_directory}})
+            backend = 'disk'
+        self.backend = backend
+        self.directory = os.path.abspath(directory)
+        self.tmpfs_directory = os.path.abspath(tmpfs_directory)
+        self.memory_max = memory_max
+        self.quota = quota
+        self.sweep_interval = sweep_interval
+        self.grace = grace
+        self.in_use = in_use or (lambda chat_id, path: False)
+        self._held = {}          # path -> bytes reserved by this process
+        self._downloading = set()
+        self._used = 0
+        self._foreign = 0        # bytes under the roots that other processes hold (as of the last sweep)
+        self._counts = {'allocated': 0, 'rejected': 0, 'released': 0, 'reclaimed': 0, 'reclaimed_bytes': 0}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._sweeper = None
+
+    @property
+    def roots(self):
+        if self.backend == 'disk':
+            return [self.directory]
+        if self.backend == 'tmpfs':
+            return [self.tmpfs_directory]
+        return [self.tmpfs_directory, self.directory]
+
+    def _root_for(self, size):
+        if self.backend == 'tmpfs' or (self.backend == 'memory' and size and size <= self.memory_max):
+            return self.tmpfs_directory
+        return self.directory
+
+    def usage(self):
+        """Bytes counted against the quota"""
+        return self._used + self._foreign
+
+    def start(self):
+        """Measure what is already spooled, then start the sweeper thread (idempotent)"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        with self._start_lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            # Files of other workers or of a crashed run count before the first upload is admitted
+            self.sweep()
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='spool-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def allocate(self, chat_id, filename, size=0):
+        """A fresh path for a chat's upload of ``size`` bytes (0 if unknown); raises SpoolFull"""
+        self.start()
+        size = max(int(size or 0), 0)
+        directory = os.path.join(self._root_for(size), f"{chat_id}-{uuid.uuid4().hex[:16]}")
+        path = os.path.join(directory, safe_filename(filename))
+        with self._lock:
+            if self.quota and self.usage() + max(size, 1) > self.quota:
+                self._counts['rejected'] += 1
+                REJECTED.inc()
+                raise SpoolFull(f"Upload spool is full ({self.usage()} of {self.quota} bytes in use)")
+            self._held[path] = size
+            self._downloading.add(path)
+            self._used += size
+            self._counts['allocated'] += 1
+        os.makedirs(directory, exist_ok=True)
+        return path
+
+    def settle(self, path):
+        """The download to ``path`` finished: account its real size instead of the estimate"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self._lock:
+            self._downloading.discard(path)
+            if path in self._held:
+                self._used += size - self._held[path]
+                self._held[path] = size
+
+    def release(self, path):
+        """Delete an upload and give its bytes back (paths outside the spool are left alone)"""
+        if not path:
+            return
+        path = os.path.abspath(path)
+        directory = os.path.dirname(path)
+        if os.path.dirname(directory) not in self.roots:
+            return
+        # The bytes are given back only once they are off the disk, so an upload admitted
+        # in the meantime cannot take the spool over its quota
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning("Temp file cleanup failed", extra={'fields': {'path': path, 'error': str(e)}})
+        try:
+            os.rmdir(directory)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Not empty: what else is in an upload's own directory (e.g. the preprocessor's
+            # output) goes with it; a shared directory of the old layout is left alone
+            if _UPLOAD_DIRECTORY.fullmatch(os.path.basename(directory)):
+                shutil.rmtree(directory, ignore_errors=True)
+        with self._lock:
+            self._used -= self._held.pop(path, 0)
+            self._downloading.discard(path)
+            self._counts['released'] += 1
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("Spool sweep failed")
+
+    def sweep(self):
+        """Remove abandoned uploads and re-measure the spool; returns bytes reclaimed"""
+        cutoff = time.time() - self.grace
+        reclaimed = 0
+        total = 0
+        for root in self.roots:
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    # Uploads are the files directly inside; subdirectories (preprocessor output) go with them
+                    paths = [path for path in (os.path.join(entry.path, name) for name in os.listdir(entry.path))
+                             if not os.path.isdir(path)] if is_dir else [entry.path]
+                    size = directory_size(entry.path) if is_dir else entry.stat(follow_symlinks=False).st_size
+                    old = entry.stat(follow_symlinks=False).st_mtime < cutoff
+                except OSError:
+                    continue  # removed while we were looking
+                if old and not self._claimed(entry.name, paths):
+                    self._reclaim(entry.path, paths, is_dir)
+                    reclaimed += size
+                    with self._lock:
+                        self._counts['reclaimed'] += len(paths)
+                        self._counts['reclaimed_bytes'] += size
+                else:
+                    total += size
+        with self._lock:
+            # Another worker's sweeper may have removed an upload this process still counted
+            for path in [path for path in self._held if path not in self._downloading]:
+                if not os.path.exists(path):
+                    self._used -= self._held.pop(path)
+            self._foreign = max(0, total - self._used)
+        if reclaimed:
+            RECLAIMED.add(reclaimed)
+            log.info("Spool swept", extra={'fields': {'reclaimed_bytes': reclaimed, 'bytes': total}})
+        return reclaimed
+
+    def _claimed(self, name, paths):
+        # Directories are named <chat_id>-<random>; older layouts used just <chat_id>
+        head, sep, _ = name.rpartition('-')
+        try:
+            chat_id = int(head if sep and head else name)
+        except ValueError:
+            chat_id = None
+        with self._lock:
+            if any(path in self._downloading for path in paths):
+                return True
+        return chat_id is not None and any(self.in_use(chat_id, path) for path in paths)
+
+    def _reclaim(self, path, paths, is_dir):
+        for file_path in paths:
+            self.release(file_path)
+        if is_dir:
+            shutil.rmtree(path, ignore_errors=True)  # nothing in it is claimed
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # already gone
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, backend=self.backend, bytes=self.usage(), quota=self.quota,
+                        files=len(self._held))
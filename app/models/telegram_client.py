@@ -0,0 +1,197 @@
+import threading
+import time
+from config.settings import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    TELEGRAM_POOL_SIZE,
+    TELEGRAM_CONNECT_TIMEOUT,
+    TELEGRAM_READ_TIMEOUT,
+    TELEGRAM_MAX_RETRIES,
+    TELEGRAM_DOWNLOAD_MAX_MB,
+)
+from utils.metrics import Counter, Histogram
+
+REQUEST_SECONDS = Histogram('tsb_telegram_request_seconds', 'Bot API call latency, retries included', ['method'])
+REQUEST_ERRORS = Counter('tsb_telegram_errors_total', 'Bot API calls that failed, by error code', ['method', 'code'])
+DOWNLOAD_BYTES = Counter('tsb_telegram_download_bytes_total', 'Bytes downloaded from the Bot API file endpoint')
+DOWNLOAD_RATE = Histogram('tsb_telegram_download_bytes_per_second', 'Throughput of individual file downloads',
+                          buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6))
+
+
+def record_download(written, seconds):
+    """Account one finished file download"""
+    DOWNLOAD_BYTES.add(written)
+    REQUEST_SECONDS.observe(seconds, 'download')
+    if seconds > 0:
+        DOWNLOAD_RATE.observe(written / seconds)
+
+
+def download_limit(max_size):
+    """Bytes a download may take: ``max_size``, or TELEGRAM_DOWNLOAD_MAX_MB when it is unknown"""
+    return max_size or TELEGRAM_DOWNLOAD_MAX_MB * 1024 * 1024
+
+
+def content_length(headers):
+    """The Content-Length a response announces (None if it does not)"""
+    try:
+        return int(headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        return None
+
+
+class TelegramAPIError(Exception):
+    """Raised when the Bot API answers with ok=false or retries are exhausted"""
+
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+class FileTooLarge(TelegramAPIError):
+    """Raised when a file download goes past its size limit"""
+
+    def __init__(self, limit):
+        super().__init__(f"File is larger than {limit} bytes")
+        self.limit = limit
+
+
+class TelegramClient:
+    """Bot API client sharing one pooled keep-alive session across all calls
+
+    429 responses are retried after the ``retry_after`` the API asks for;
+    5xx responses and connection errors are retried with exponential backoff.
+    ``requests`` is imported and the session opened on the first call, so
+    constructing a client costs nothing at startup.
+    """
+
+    def __init__(self, token=None, base_url=None, pool_size=None, connect_timeout=None,
+                 read_timeout=None, max_retries=None, backoff=0.5):
+        self.token = token or BOT_TOKEN
+        self.base_url = (base_url or TELEGRAM_API_URL).rstrip('/')
+        self.timeout = (
+            connect_timeout or TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout or TELEGRAM_READ_TIMEOUT
+        )
+        self.max_retries = TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+
+        self.pool_size = pool_size or TELEGRAM_POOL_SIZE
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def _request(self, method, url, max_retries=None, timeout=None, **kwargs):
+        """Issue an HTTP request, retrying on 429, 5xx and connection errors"""
+        import requests
+        max_retries = self.max_retries if max_retries is None else max_retries
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries:
+                    raise TelegramAPIError(f"Request failed: {str(e)}")
+                delay = self.backoff * 2 ** attempt
+            else:
+                if response.status_code == 429:
+                    retry_after = self._retry_after(response)
+                    if attempt >= max_retries:
+                        raise TelegramAPIError("Too Many Requests", 429, retry_after)
+                    delay = retry_after
+                elif response.status_code >= 500 and attempt < max_retries:
+                    delay = self.backoff * 2 ** attempt
+                else:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def _retry_after(self, response):
+        try:
+            return float(response.json()['parameters']['retry_after'])
+        except Exception:
+            return self.backoff
+
+    def call(self, method, params=None, **kwargs):
+        """Call a Bot API method and return its ``result``"""
+        start = time.perf_counter()
+        try:
+            return self._call(method, params, **kwargs)
+        except TelegramAPIError as e:
+            REQUEST_ERRORS.inc(method, str(e.error_code or 'network'))
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method)
+
+    def _call(self, method, params=None, **kwargs):
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        response = self._request('POST', url, json=params or {}, **kwargs)
+        try:
+            data = response.json()
+        except ValueError:
+            raise TelegramAPIError(f"Invalid response from {method}", response.status_code)
+        if not data.get('ok'):
+            parameters = data.get('parameters') or {}
+            raise TelegramAPIError(
+                data.get('description', f"{method} failed"),
+                data.get('error_code', response.status_code),
+                parameters.get('retry_after')
+            )
+        return data['result']
+
+    def send_message(self, chat_id, text, **params):
+        """Send a text message to a chat"""
+        return self.call('sendMessage', {'chat_id': chat_id, 'text': text, **params})
+
+    def get_file(self, file_id):
+        """Resolve a file_id to its File object (contains file_path)"""
+        return self.call('getFile', {'file_id': file_id})
+
+    def download_file(self, file_path, destination, chunk_size=64 * 1024, max_size=None):
+        """Stream a file from the Bot API file endpoint to disk; returns bytes written
+
+        Raises FileTooLarge, leaving a partial file behind, once the file
+        goes past ``max_size`` bytes (the size the spool reserved for it;
+        TELEGRAM_DOWNLOAD_MAX_MB if that is unknown).
+        """
+        url = f"{self.base_url}/file/bot{self.token}/{file_path}"
+        limit = download_limit(max_size)
+        written = 0
+        start = time.perf_counter()
+        with self._request('GET', url, stream=True) as response:
+            if response.status_code != 200:
+                REQUEST_ERRORS.inc('download', str(response.status_code))
+                raise TelegramAPIError(f"File download failed with HTTP {response.status_code}",
+                                       response.status_code)
+            if (content_length(response.headers) or 0) > limit:
+                REQUEST_ERRORS.inc('download', 'too_large')
+                raise FileTooLarge(limit)
+            with open(destination, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    written += len(chunk)
+                    if written > limit:
+                        REQUEST_ERRORS.inc('download', 'too_large')
+                        raise FileTooLarge(limit)
+                    f.write(chunk)
+        record_download(written, time.perf_counter() - start)
+        return written
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
@@ -0,0 +1,238 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+from config.settings import (
+    UPDATE_JOURNAL,
+    JOURNAL_SYNC,
+    JOURNAL_DEDUP_WINDOW,
+    JOURNAL_COMPACT_INTERVAL,
+    SESSION_TTL,
+)
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# Row states: accepted but not handled yet, handled, conversation over (payload dropped)
+RECEIVED, HANDLED, CLOSED = 0, 1, 2
+
+# update_ids remembered in memory so most duplicates never reach SQLite
+RECENT_IDS = 100000
+
+
+class _Entry:
+    __slots__ = ('update_id', 'chat_id', 'payload', 'inserted', 'done')
+
+    def __init__(self, update_id, chat_id, payload):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.payload = payload
+        self.inserted = False
+        self.done = threading.Event()
+
+
+class UpdateJournal:
+    """Append-only SQLite (WAL) journal of incoming updates, keyed by update_id
+
+    ``record`` returns only once the update is committed, so the webhook is
+    acknowledged after the update is safe; an update_id seen before is
+    reported as a duplicate (Telegram redelivers when it misses an answer).
+    A single writer thread commits everything queued since its last commit
+    in one transaction, so concurrent requests share one fsync (group
+    commit).  Rows of finished conversations lose their payload and are
+    deleted once they fall out of the dedup window; what is left is exactly
+    what ``pending`` hands back for replay after a crash.
+
+    ``sync`` is the SQLite synchronous level: 'full' survives power loss,
+    'normal' survives a process crash, 'off' leaves flushing to the OS.
+    """
+
+    def __init__(self, path=UPDATE_JOURNAL, sync=JOURNAL_SYNC, dedup_window=JOURNAL_DEDUP_WINDOW,
+                 compact_interval=JOURNAL_COMPACT_INTERVAL, max_batch=1000):
+        self.path = path
+        self.sync = sync
+        self.dedup_window = dedup_window
+        self.compact_interval = compact_interval
+        self.max_batch = max_batch
+        self._queue = collections.deque()  # _Entry, or (op, *args) for bookkeeping writes
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._recent = collections.OrderedDict()
+        self._db = None
+        self._thread = None
+        self._last_compaction = time.monotonic()
+        self._counts = {'recorded': 0, 'duplicates': 0, 'commits': 0, 'writes': 0, 'replayed': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA auto_vacuum=INCREMENTAL')  # only takes effect on a new file
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(f'PRAGMA synchronous={self.sync.upper()}')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS updates ('
+                'update_id INTEGER PRIMARY KEY, chat_id INTEGER, received REAL NOT NULL, '
+                'state INTEGER NOT NULL DEFAULT 0, payload TEXT)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS updates_chat ON updates (chat_id, state)')
+        return self._db
+
+    def start(self):
+        """Open the database and start the writer thread (idempotent)"""
+        with self._cond:
+            self._connect()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='update-journal', daemon=True)
+                self._thread.start()
+
+    def record(self, update):
+        """Durably journal an update; returns False if its update_id was seen before"""
+        return self.record_many([update])[0]
+
+    def record_many(self, updates):
+        """Journal a batch of updates in one commit; returns an accepted flag per update"""
+        accepted = [True] * len(updates)
+        if not self.enabled:
+            return accepted
+        entries = []
+        with self._cond:
+            for i, update in enumerate(updates):
+                update_id = update.get('update_id')
+                if update_id is None:
+                    continue
+                if update_id in self._recent:
+                    self._counts['duplicates'] += 1
+                    accepted[i] = False
+                    continue
+                self._recent[update_id] = None
+                if len(self._recent) > RECENT_IDS:
+                    self._recent.popitem(last=False)
+                message = update.get('message') or {}
+                entries.append((i, _Entry(update_id, (message.get('chat') or {}).get('id'), json.dumps(update))))
+        if not entries:
+            return accepted
+        self.start()
+        with self._cond:
+            self._queue.extend(entry for _, entry in entries)
+            self._cond.notify()
+        for i, entry in entries:
+            entry.done.wait()
+            if not entry.inserted:
+                self._counts['duplicates'] += 1
+                accepted[i] = False
+        return accepted
+
+    def discard(self, update):
+        """Forget an update that was recorded but then refused, so its redelivery is accepted"""
+        update_id = update.get('update_id')
+        if self.enabled and update_id is not None:
+            with self._cond:
+                self._recent.pop(update_id, None)
+            self._enqueue(('discard', update_id))
+
+    def handled(self, update):
+        """Mark an update as handled (not waited for)"""
+        if self.enabled and update.get('update_id') is not None:
+            self._enqueue(('handled', update['update_id']))
+
+    def close(self, chat_id):
+        """The chat's conversation is over: its handled updates are no longer needed for replay"""
+        if self.enabled:
+            self._enqueue(('close', chat_id))
+
+    def _enqueue(self, item):
+        self.start()
+        with self._cond:
+            self._queue.append(item)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    if not self._cond.wait(timeout=self.compact_interval):
+                        break
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch))]
+            try:
+                if batch:
+                    self._commit(batch)
+                if time.monotonic() - self._last_compaction >= self.compact_interval:
+                    self.compact()
+            except Exception:
+                log.exception("Journal writer error")
+
+    def _commit(self, batch):
+        db = self._db
+        entries = [item for item in batch if isinstance(item, _Entry)]
+        self._db_lock.acquire()
+        try:
+            db.execute('BEGIN')
+            for item in batch:
+                if isinstance(item, _Entry):
+                    item.inserted = db.execute(
+                        'INSERT OR IGNORE INTO updates (update_id, chat_id, received, payload) VALUES (?, ?, ?, ?)',
+                        (item.update_id, item.chat_id, time.time(), item.payload)).rowcount == 1
+                elif item[0] == 'handled':
+                    db.execute('UPDATE updates SET state = ? WHERE update_id = ? AND state = ?',
+                               (HANDLED, item[1], RECEIVED))
+                elif item[0] == 'close':
+                    db.execute('UPDATE updates SET state = ?, payload = NULL WHERE chat_id = ? AND state = ?',
+                               (CLOSED, item[1], HANDLED))
+                elif item[0] == 'discard':
+                    db.execute('DELETE FROM updates WHERE update_id = ?', (item[1],))
+            db.execute('COMMIT')
+            self._counts['commits'] += 1
+            self._counts['writes'] += len(batch)
+            self._counts['recorded'] += sum(1 for entry in entries if entry.inserted)
+        except sqlite3.Error as e:
+            log.error("Journal commit failed", extra={'fields': {'error': str(e), 'batch': len(batch)}})
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            for entry in entries:
+                entry.inserted = True  # fail open: better to risk a duplicate than drop the update
+        finally:
+            self._db_lock.release()
+            for entry in entries:
+                entry.done.set()
+
+    def compact(self):
+        """Drop rows past the dedup window and conversations older than a session can live"""
+        now = time.time()
+        self._last_compaction = time.monotonic()
+        with self._db_lock:
+            db = self._connect()
+            db.execute('UPDATE updates SET state = ?, payload = NULL WHERE state < ? AND received < ?',
+                       (CLOSED, CLOSED, now - SESSION_TTL))
+            db.execute('DELETE FROM updates WHERE state = ? AND received < ?', (CLOSED, now - self.dedup_window))
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            db.execute('PRAGMA incremental_vacuum')
+
+    def pending(self):
+        """Updates of unfinished conversations, oldest first: [(update, handled)]"""
+        if not self.enabled:
+            return []
+        with self._db_lock:
+            db = self._connect()
+            rows = db.execute(
+                'SELECT payload, state FROM updates WHERE state < ? ORDER BY update_id', (CLOSED,)).fetchall()
+            recent = db.execute('SELECT update_id FROM (SELECT update_id FROM updates ORDER BY update_id DESC '
+                                'LIMIT ?) ORDER BY update_id', (RECENT_IDS,)).fetchall()
+        with self._cond:
+            for update_id, in recent:
+                self._recent[update_id] = None
+        self._counts['replayed'] += len(rows)
+        return [(json.loads(payload), state == HANDLED) for payload, state in rows]
+
+    def stats(self):
+        stats = dict(self._counts, enabled=self.enabled, queued=len(self._queue))
+        stats['avg_batch'] = stats['writes'] / stats['commits'] if stats['commits'] else 0
+        return stats
@@ -1,11 +1,65 @@
-from flask import Blueprint, request
-from app.controllers.handlers import handle_command
+from flask import Blueprint, Response, request, jsonify
+from config.settings import DISPATCH_WORKERS
+from app.controllers.handlers import (
+    handle_command,
+    process_update,
+    replay_journal,
+    warm_up,
+    journal,
+    outbound,
+    delivery_queue,
+    reminders,
+    attachment_cache,
+    spool,
+)
+from app.controllers.dispatcher import Dispatcher
+from utils.metrics import REGISTRY, CONTENT_TYPE
 
 # Create a Blueprint object
 app = Blueprint('app', __name__)
 
+# With DISPATCH_WORKERS set, updates are handled off the request thread,
+# in order per chat and in parallel across chats
+dispatcher = Dispatcher(handler=process_update) if DISPATCH_WORKERS else None
+
+@app.record_once
+def start_background_services(state):
+    """Reload persisted reminders once the blueprint is registered on an app"""
+    reminders.start()
+    REGISTRY.start_flusher()
+    replay_journal()
+    warm_up()
+
 # Define routes using the blueprint
 @app.route('/message', methods=["POST"])
 def message():
     data = request.get_json()  # Get the incoming data
-    return handle_command(data)  # Call the handler for the command
+    if not isinstance(data, dict):
+        return handle_command(data)  # Not an update: answered with the usual error, nothing to journal
+    if not journal.record(data):
+        return "Duplicate update ignored."  # Telegram redelivered an update we already have
+    if dispatcher is None:
+        return process_update(data)  # Call the handler for the command
+    try:
+        queued = dispatcher.submit(data)
+    except Exception:
+        journal.discard(data)  # never left RECEIVED, to be replayed on every start
+        raise
+    if not queued:
+        # Shard is full: a non-2xx makes Telegram redeliver the update later
+        journal.discard(data)
+        return "Busy, please retry.", 503
+    return "Update queued."
+
+@app.route('/stats', methods=["GET"])
+def stats():
+    stats = {'delivery': delivery_queue.metrics(), 'attachment_cache': attachment_cache.stats(),
+             'journal': journal.stats(), 'outbound': outbound.stats(), 'spool': spool.stats()}
+    if dispatcher is not None:
+        stats['dispatcher'] = dispatcher.stats()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    # Prometheus text format; merged across workers when METRICS_DIR is set
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,195 @@
+"""Ingesting logs into the analytics store, and querying it instead of grepping.
+
+Writes a synthetic JSON log of --mb MB spread over a week (webhook spans,
+email.delivery records with content types, warnings) and a captured update
+stream, then:
+
+  full ingest         both files from scratch, through --window-mb mmap windows
+  re-ingest           nothing new: only the stored offsets are checked
+  append              --append lines added, the last one half-written; only the
+                      complete ones are stored, the rest once it is finished
+  rotate              the log replaced by a new, shorter file: read from the start
+
+and times "p50/p95 delivery latency per content type over the last 7 days"
+against the store and against a scan that parses the whole log, asserting
+both give the same numbers.
+
+Usage: python -m benchmarks.analytics [--mb 128] [--window-mb 16] [--append 10000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+MB = 1024 * 1024
+CONTENT_TYPES = ['text', 'photo', 'document']
+
+
+def log_line(rng, ts):
+    """One JSON log record as the bot writes them"""
+    roll = rng.random()
+    chat_id = rng.randint(1, 5000)
+    if roll < 0.25:
+        content_type = rng.choice(CONTENT_TYPES)
+        base = {'text': 400, 'photo': 1500, 'document': 2500}[content_type]
+        success = rng.random() > 0.03
+        record = {'ts': ts, 'level': 'INFO', 'logger': 'tsb.controllers.handlers', 'msg': 'email.delivery',
+                  'span': 'email.delivery', 'chat_id': chat_id, 'content_type': content_type, 'bulk': False,
+                  'parts': 1, 'success': success, 'duration_ms': round(rng.lognormvariate(0, 0.5) * base, 3)}
+    elif roll < 0.97:
+        record = {'ts': ts, 'level': 'INFO', 'logger': 'tsb.routes', 'msg': 'webhook', 'span': 'webhook',
+                  'chat_id': chat_id, 'update_id': rng.randint(1, 10 ** 9),
+                  'duration_ms': round(rng.expovariate(1 / 2.0), 3)}
+    else:
+        record = {'ts': ts, 'level': 'WARNING', 'logger': 'tsb.models.smtp_pool',
+                  'msg': 'SMTP connection failed, retrying', 'error': 'SMTPServerDisconnected: Connection unexpectedly closed'}
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def update_line(rng, ts, update_id):
+    message = {'message_id': update_id, 'date': int(ts), 'chat': {'id': rng.randint(1, 5000)}}
+    kind = rng.random()
+    if kind < 0.6:
+        message['text'] = rng.choice(['/send_mail', '/calculate 2+2', 'someone@example.com', 'Hello there'])
+    elif kind < 0.8:
+        message['photo'] = [{'file_id': 'p', 'file_size': 120000}]
+    else:
+        message['document'] = {'file_id': 'd', 'file_name': 'report.pdf'}
+    return json.dumps({'update_id': update_id, 'message': message}, separators=(',', ':')) + '\n'
+
+
+def write_log(path, rng, size, start, end):
+    """Append records with timestamps from start to end until the file reaches `size` bytes"""
+    lines = 0
+    with open(path, 'a') as f:
+        estimate = max(1, size // 200)
+        while f.tell() < size:
+            ts = round(start + (end - start) * min(1.0, lines / estimate), 6)
+            f.write(log_line(rng, ts))
+            lines += 1
+    return lines
+
+
+def scan_latency(path, since):
+    """The latency query done the grep way: parse every line of the log"""
+    durations = {}
+    with open(path, 'rb') as f:
+        for line in f:
+            if b'email.delivery' not in line:
+                continue
+            record = json.loads(line)
+            if record.get('span') == 'email.delivery' and record['ts'] >= since:
+                durations.setdefault(record['content_type'], []).append(record['duration_ms'])
+    from app.models.event_store import percentile
+    results = {}
+    for content_type, values in durations.items():
+        values.sort()
+        results[content_type] = (len(values), percentile(values, 0.5), percentile(values, 0.95))
+    return results
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mb', type=int, default=128, help="size of the synthetic log")
+    parser.add_argument('--window-mb', type=int, default=16, help="mmap window")
+    parser.add_argument('--append', type=int, default=10000, help="lines appended after the first ingest")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='analytics-')
+    os.environ['LOG_CONSOLE'] = 'False'
+    os.environ['LOG_FILE'] = os.path.join(workdir, 'bot-own.jsonl')
+    from app.models.event_store import EventStore
+
+    rng = random.Random(7)
+    now = time.time()
+    week = 7 * 86400
+    log_path = os.path.join(workdir, 'bot.jsonl')
+    updates_path = os.path.join(workdir, 'updates.jsonl')
+    try:
+        start = time.perf_counter()
+        lines = write_log(log_path, rng, args.mb * MB, now - 10 * 86400, now - 3600)
+        with open(updates_path, 'w') as f:
+            updates = max(1000, lines // 10)
+            for update_id in range(updates):
+                f.write(update_line(rng, now - week + week * update_id / updates, update_id))
+        size = os.path.getsize(log_path) + os.path.getsize(updates_path)
+        print(f"generated {lines:,} log lines and {updates:,} updates ({size / MB:.0f} MB) "
+              f"in {time.perf_counter() - start:.1f}s\n")
+
+        store = EventStore(os.path.join(workdir, 'analytics.db'), window=args.window_mb * MB)
+        print(f"{'step':<14}{'events':>10}{'MB read':>9}{'seconds':>9}{'MB/s':>8}")
+
+        def step(label, paths):
+            start = time.perf_counter()
+            stats = {'lines': 0, 'skipped': 0, 'bytes': 0}
+            for path in paths:
+                for key, value in store.ingest(path).items():
+                    stats[key] += value
+            elapsed = time.perf_counter() - start
+            print(f"{label:<14}{stats['lines']:>10,}{stats['bytes'] / MB:>9.1f}{elapsed:>9.3f}"
+                  f"{stats['bytes'] / MB / elapsed:>8.0f}")
+            return stats
+
+        rss = peak_rss_mb()
+        full = step('full ingest', [log_path, updates_path])
+        rss = peak_rss_mb() - rss
+        assert full['lines'] == lines + updates and full['skipped'] == 0, full
+        again = step('re-ingest', [log_path, updates_path])
+        assert again['lines'] == 0 and again['bytes'] == 0, again
+
+        with open(log_path, 'a') as f:
+            for _ in range(args.append - 1):
+                f.write(log_line(rng, now - 60))
+            tail = log_line(rng, now - 30)
+            f.write(tail[:len(tail) // 2])
+        appended = step('append', [log_path])
+        assert appended['lines'] == args.append - 1, appended
+        with open(log_path, 'a') as f:
+            f.write(tail[len(tail) // 2:])
+        finished = step('line finished', [log_path])
+        assert finished['lines'] == 1, finished
+
+        rotated = log_path + '.new'
+        rotated_lines = write_log(rotated, rng, MB, now - 600, now - 1)
+        os.replace(rotated, log_path)
+        after = step('rotate', [log_path])
+        assert after['lines'] == rotated_lines, after
+        print(f"\npeak RSS grew by {rss:.0f} MB during the full ingest ({size / MB:.0f} MB of input)")
+        store.close()
+
+        # The latency question, on a log that was not rotated
+        shutil.rmtree(workdir)
+        os.makedirs(workdir)
+        write_log(log_path, rng, args.mb * MB, now - 10 * 86400, now - 3600)
+        store = EventStore(os.path.join(workdir, 'analytics.db'), window=args.window_mb * MB)
+        store.ingest(log_path)
+        since = now - week
+        start = time.perf_counter()
+        scanned = scan_latency(log_path, since)
+        scan_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        queried = store.latency('email.delivery', since, now, by='content_type')
+        query_seconds = time.perf_counter() - start
+        queried = {key[0]: (count, p50, p95) for key, count, p50, p95, p99, slowest in queried}
+        assert queried == scanned, (queried, scanned)
+        print(f"\np50/p95 delivery latency per content type, last 7 days "
+              f"({sum(v[0] for v in queried.values()):,} deliveries)")
+        print(f"  parse the whole log  {scan_seconds * 1000:>9.0f} ms")
+        print(f"  query the store      {query_seconds * 1000:>9.0f} ms")
+        for content_type, (count, p50, p95) in sorted(queried.items()):
+            print(f"  {content_type:<10}{count:>9,}  p50 {p50:>7.1f} ms  p95 {p95:>7.1f} ms")
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Attachment cache: repeated sends of the same file, and hit rate under a Zipf workload.
+
+Part 1 uploads and emails one popular document --sends times (as if it were
+forwarded from many chats), with the cache disabled and enabled, against the
+fake Bot API (with --latency per call) and a local SMTP sink.  Part 2 draws
+uploads of --files distinct files from a Zipf distribution through a cache
+capped at --cap-mb and reports hit rate and evictions.
+
+Usage: python -m benchmarks.attachment_cache [--sends 50] [--size-mb 5] [--latency 0.05]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.fakes import FakeBotAPI, spawn_smtp_sink, use_bot_api, use_smtp_sink
+
+MB = 1024 * 1024
+
+
+def document_message(chat_id, file_unique_id):
+    return {'chat': {'id': chat_id}, 'document': {
+        'file_id': f'file-{file_unique_id}-{chat_id}',  # file_id differs per chat, the unique id does not
+        'file_unique_id': file_unique_id,
+        'file_name': f'{file_unique_id}.pdf'}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sends', type=int, default=50)
+    parser.add_argument('--size-mb', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--uploads', type=int, default=1000)
+    parser.add_argument('--cap-mb', type=int, default=10)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(file_size=args.size_mb * MB, latency=args.latency).start()
+    use_bot_api(api)
+    proc, port = spawn_smtp_sink()
+    use_smtp_sink(port)
+
+    from app.controllers import handlers
+    from app.models.attachment_cache import AttachmentCache
+    from app.models.session import Session, Step
+    from app.models.spool import Spool
+
+    handlers.send_message = lambda chat_id, text: "Message sent successfully."
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    handlers.spool = Spool(directory=os.path.join(workdir, 'spool'))
+
+    def upload(chat_id, file_unique_id):
+        session = Session(step=Step.WAITING_FOR_FILE, email='bench@example.com', content_type='file')
+        with contextlib.redirect_stdout(io.StringIO()):
+            handlers.handle_file_upload(chat_id, document_message(chat_id, file_unique_id), session)
+        return session
+
+    print(f"{args.sends} sends of one {args.size_mb} MB document, {args.latency * 1000:.0f} ms API latency\n")
+    print(f"{'mode':<12}{'upload ms':>11}{'send ms':>10}{'send cpu ms':>13}{'getFile':>9}{'downloads':>11}{'encodes':>9}")
+    try:
+        for label, cap in (('no cache', 0), ('cache', 1024 * MB)):
+            handlers.attachment_cache = AttachmentCache(os.path.join(workdir, label.replace(' ', '_')), max_bytes=cap)
+            api.calls.clear()
+            upload_time = send_time = send_cpu = 0.0
+            for chat_id in range(args.sends):
+                start = time.perf_counter()
+                session = upload(chat_id, 'popular-doc')
+                upload_time += time.perf_counter() - start
+
+                start, cpu = time.perf_counter(), time.process_time()
+                email = handlers.prepare_email(session, 'Cache benchmark')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    success, message = handlers.deliver_email(email)
+                assert success, message
+                email.cleanup()
+                send_time += time.perf_counter() - start
+                send_cpu += time.process_time() - cpu
+            stats = handlers.attachment_cache.stats()
+            encodes = stats['encoded_misses'] if cap else args.sends
+            print(f"{label:<12}{upload_time / args.sends * 1000:>11.1f}{send_time / args.sends * 1000:>10.1f}"
+                  f"{send_cpu / args.sends * 1000:>13.1f}"
+                  f"{api.calls.get('getFile', 0):>9}{api.calls.get('download', 0):>11}{encodes:>9}")
+            if cap:
+                assert api.calls.get('download') == 1 and stats['hits'] == args.sends - 1
+                assert stats['encoded_misses'] == 1 and stats['encoded_hits'] == args.sends - 1
+
+        # Part 2: bounded cache under a skewed workload (downloads only)
+        api.file_size = MB
+        api.latency = 0
+        cache = handlers.attachment_cache = AttachmentCache(os.path.join(workdir, 'zipf'),
+                                                           max_bytes=args.cap_mb * MB, cache_encoded=False)
+        weights = [1 / rank ** 1.1 for rank in range(1, args.files + 1)]
+        rng = random.Random(42)
+        for chat_id in range(args.uploads):
+            file_unique_id = f'doc-{rng.choices(range(args.files), weights)[0]}'
+            session = upload(chat_id, file_unique_id)
+            os.remove(session.file_path)
+        stats = cache.stats()
+        hit_rate = stats['hits'] / (stats['hits'] + stats['misses'])
+        print(f"\nZipf(1.1) over {args.files} x 1 MB files, {args.uploads} uploads, {args.cap_mb} MB cap: "
+              f"hit rate {hit_rate:.1%}, {stats['evictions']} evictions, {stats['bytes'] / MB:.1f} MB on disk")
+        assert stats['bytes'] <= args.cap_mb * MB, "cache exceeded its size cap"
+    finally:
+        handlers.email_sender.pool.close_all()
+        api.stop()
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
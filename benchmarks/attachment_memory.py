@@ -0,0 +1,76 @@
+"""Peak Python heap while sending 1/10/50 MB attachments, streamed vs in-memory.
+
+Usage: python -m benchmarks.attachment_memory [--sizes 1 10 50]
+"""
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.fakes import spawn_smtp_sink, use_smtp_sink
+
+MB = 1024 * 1024
+
+
+def peak_during(func):
+    """Run func and return the tracemalloc peak in MB"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / MB
+    finally:
+        tracemalloc.stop()
+
+
+def send_in_memory(sender, path):
+    """The previous implementation: read, encode and serialize the whole message"""
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['From'] = sender.sender_email
+    msg['To'] = 'bench@example.com'
+    msg['Subject'] = 'Memory benchmark'
+    msg.attach(MIMEText('See attachment', 'plain'))
+    with open(path, 'rb') as f:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(f.read())
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+    msg.attach(part)
+    sender.pool.send(lambda server: server.send_message(msg))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50])
+    args = parser.parse_args()
+
+    proc, port = spawn_smtp_sink()
+    use_smtp_sink(port)
+    from app.models.mail_sender import EmailSender
+    sender = EmailSender()
+
+    print(f"{'size':>6} {'in-memory peak':>16} {'streamed peak':>15}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in args.sizes:
+                path = os.path.join(tmp, f'attachment_{size}mb.bin')
+                with open(path, 'wb') as f:
+                    for _ in range(size):
+                        f.write(os.urandom(MB))
+
+                old = peak_during(lambda: send_in_memory(sender, path))
+                new = peak_during(lambda: sender.send_attachment_email(
+                    'bench@example.com', 'Memory benchmark', 'See attachment', path))
+                print(f"{size:>4}MB {old:>13.1f}MB {new:>12.2f}MB")
+                os.remove(path)
+    finally:
+        sender.pool.close_all()
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Bulk mail: one attachment to many recipients over a local SMTP sink.
+
+Compares one send_attachment_email call per recipient (re-encodes the file
+every time) with a BulkMessage sent over a single connection, with and
+without PIPELINING, then repeats the bulk runs with a text-only message,
+where round trips rather than payload bytes dominate.  The sink runs in a
+child process, so "client cpu" is the bot's own cost.  Asserts the attachment is encoded exactly once and that
+refused recipients show up in the report.
+
+Usage: python -m benchmarks.bulk_mail [--recipients 500] [--size-mb 5] [--naive 50]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import spawn_smtp_sink, use_smtp_sink
+
+MB = 1024 * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--recipients', type=int, default=500)
+    parser.add_argument('--size-mb', type=int, default=5)
+    parser.add_argument('--naive', type=int, default=50,
+                        help="recipients for the per-recipient baseline (extrapolated)")
+    args = parser.parse_args()
+
+    proc, port = spawn_smtp_sink()
+    use_smtp_sink(port)
+    from app.models.mail_sender import EmailSender
+    from app.models.bulk_mail import BulkMessage, send_bulk
+    from app.models import mime_stream
+    sender = EmailSender()
+
+    recipients = [f"user{i}@example.com" for i in range(args.recipients)]
+    recipients[::100] = [f"reject{i}@example.com" for i in range(len(recipients[::100]))]
+    expected_refused = len(recipients[::100])
+
+    # Count base64 passes over the file
+    encodes = {'count': 0}
+    iter_base64 = mime_stream.iter_base64
+
+    def counting_iter_base64(*a, **kw):
+        encodes['count'] += 1
+        return iter_base64(*a, **kw)
+
+    mime_stream.iter_base64 = counting_iter_base64
+    import app.models.bulk_mail as bulk_mail
+    bulk_mail.iter_base64 = counting_iter_base64
+
+    print(f"{args.recipients} recipients, {args.size_mb} MB attachment\n")
+    print(f"{'mode':<30}{'seconds':>10}{'msgs/s':>10}{'client cpu':>12}{'encodes':>10}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.pdf')
+            with open(path, 'wb') as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(MB))
+
+            encodes['count'] = 0
+            scale = args.recipients / args.naive
+            start, cpu = time.perf_counter(), time.process_time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for recipient in recipients[1:args.naive + 1]:
+                    sender.send_attachment_email(recipient, 'Bulk benchmark', 'See attachment', path)
+            elapsed = (time.perf_counter() - start) * scale
+            cpu = (time.process_time() - cpu) * scale
+            print(f"{'per-recipient (extrapolated)':<30}{elapsed:>10.2f}{args.recipients / elapsed:>10.1f}"
+                  f"{cpu:>12.2f}{round(encodes['count'] * scale):>10}")
+
+            for file_path in (path, None):
+                for pipelining in (False, True):
+                    body = 'See attachment' if file_path else 'Plain text announcement'
+                    bulk = BulkMessage(sender.sender_email, recipients, 'Bulk benchmark', body, file_path)
+                    encodes['count'] = 0
+                    start, cpu = time.perf_counter(), time.process_time()
+                    with sender.pool.connection() as server:
+                        send_bulk(server, bulk, pipelining=pipelining)
+                    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+                    label = f"bulk {'attachment' if file_path else 'text'}, {'pipelined' if pipelining else 'sequential'}"
+                    print(f"{label:<30}{elapsed:>10.2f}{args.recipients / elapsed:>10.1f}{cpu:>12.2f}"
+                          f"{encodes['count']:>10}")
+
+                    assert encodes['count'] == bulk.encodings == (1 if file_path else 0), \
+                        "attachment must be encoded exactly once"
+                    refused = [r for r, (code, _) in bulk.results.items() if code != 250]
+                    assert len(bulk.results) == len(recipients), "every recipient needs a status"
+                    assert len(refused) == expected_refused, f"expected {expected_refused} refusals, got {len(refused)}"
+                    assert not bulk.pending(), "refusals are final, nothing should be left pending"
+                    bulk.close()
+
+            print("\n" + bulk.report(max_failures=3))
+    finally:
+        sender.pool.close_all()
+        proc.terminate()
+
+
+if __name__ == '__main__':
+    main()
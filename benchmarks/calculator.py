@@ -0,0 +1,97 @@
+"""Throughput of /calculate: cached vs uncached compilation, vectorized ranges, hostile input.
+
+Also asserts that a set of hostile expressions is rejected within the time
+budget instead of hanging the worker or executing code.
+
+Usage: python -m benchmarks.calculator [--evaluations 20000]
+"""
+import argparse
+import time
+
+EXPRESSIONS = [
+    '2 + 3 * 4',
+    '(1 + 2) ** 10 / 7',
+    'sqrt(2) * sin(pi / 4) + log(100, 10)',
+    'factorial(20) // 3',
+    'max(1, 2, 3) + min(4, 5) - abs(-6)',
+]
+
+RANGE_EXPRESSIONS = [
+    'sum(x**2 for x in 1..1e6)',
+    'mean(sqrt(x) for x in 1..1e6 if x % 3 == 0)',
+    'sum(1/x for x in 1..1e6)',
+    'sum(x**3 - x for x in 1..10**20)',
+]
+
+HOSTILE = [
+    '9**9**9**9',
+    '10**100000',
+    '__import__("os").system("true")',
+    '(1).__class__.__bases__',
+    'factorial(100000)',
+    'max(x for x in 1..1e12)',
+    'sum(x**50 for x in 1..1e12)',
+    '-' * 900 + '1',
+    '"a" * 10**9',
+    '([1] * 10**4) * 10**4',
+    '[1] * 10**9',
+    'min(1..5)',
+    'lambda: 1',
+]
+
+
+def rate(func, evaluations):
+    start = time.perf_counter()
+    for i in range(evaluations):
+        func(i)
+    return evaluations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--evaluations', type=int, default=20000)
+    args = parser.parse_args()
+
+    from app.models import calculator
+
+    def uncached(i):
+        calculator.compile_expression.cache_clear()
+        calculator.evaluate(EXPRESSIONS[i % len(EXPRESSIONS)])
+
+    def cached(i):
+        calculator.evaluate(EXPRESSIONS[i % len(EXPRESSIONS)])
+
+    def legacy(i):
+        eval(EXPRESSIONS[i % len(EXPRESSIONS)].replace('sqrt', 'abs').replace('sin', 'abs')
+             .replace('log', 'pow').replace('factorial', 'abs').replace('pi', '3.14'))
+
+    print(f"{'mode':<28}{'evals/s':>12}")
+    print(f"{'legacy eval()':<28}{rate(legacy, args.evaluations):>12,.0f}")
+    print(f"{'compiled, uncached':<28}{rate(uncached, args.evaluations):>12,.0f}")
+    print(f"{'compiled, cached':<28}{rate(cached, args.evaluations):>12,.0f}")
+
+    print(f"\nvectorized ranges (numpy {'on' if calculator._numpy() is not None else 'off'})")
+    for expression in RANGE_EXPRESSIONS:
+        start = time.perf_counter()
+        try:
+            result = calculator.evaluate(expression)
+        except calculator.CalculationError as e:
+            result = f"error: {e}"
+        print(f"  {expression:<48}{(time.perf_counter() - start) * 1000:>9.1f} ms  = {result}")
+
+    print("\nhostile input")
+    for expression in HOSTILE:
+        start = time.perf_counter()
+        try:
+            calculator.evaluate(expression)
+            outcome = 'ACCEPTED'
+        except calculator.CalculationError as e:
+            outcome = str(e)
+        elapsed = time.perf_counter() - start
+        print(f"  {expression[:40]:<42}{elapsed * 1000:>9.2f} ms  {outcome}")
+        assert outcome != 'ACCEPTED', f"{expression!r} should be rejected"
+        assert elapsed < calculator.TIME_BUDGET * 2, f"{expression!r} exceeded the time budget"
+
+
+if __name__ == '__main__':
+    main()
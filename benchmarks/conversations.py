@@ -0,0 +1,64 @@
+"""Replay synthetic /send_mail conversations through handle_command.
+
+Reports updates/sec for the dispatch path (Telegram and SMTP stubbed out)
+and bytes per session for 100k concurrent half-finished conversations,
+comparing the Session record with the free-form dict it replaced.
+
+Usage: python -m benchmarks.conversations [--chats 20000] [--sessions 100000]
+"""
+import argparse
+import time
+import tracemalloc
+
+CONVERSATION = ['/send_mail', 'someone@example.com', '1', 'Hello there', 'skip']
+
+
+def updates(chats):
+    for chat_id in range(chats):
+        for text in CONVERSATION:
+            yield {'update_id': chat_id, 'message': {'chat': {'id': chat_id}, 'text': text}}
+
+
+def bytes_per_session(make, count):
+    """Average traced bytes for `count` sessions built by make(i)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = {i: make(i) for i in range(count)}
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del sessions
+    return used / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=20000)
+    parser.add_argument('--sessions', type=int, default=100000)
+    args = parser.parse_args()
+
+    from app.controllers import handlers
+    from app.models.session import Session, Step
+
+    # Keep the measurement on dispatch and session handling only
+    handlers.send_message = lambda chat_id, text: "Message sent successfully."
+    handlers.delivery_queue.submit = lambda job: True
+
+    batch = list(updates(args.chats))
+    start = time.perf_counter()
+    for update in batch:
+        handlers.handle_command(update)
+    elapsed = time.perf_counter() - start
+    print(f"handle_command: {len(batch) / elapsed:,.0f} updates/sec ({len(batch)} updates)")
+
+    now = time.time()
+    as_dict = bytes_per_session(lambda i: {
+        'step': 'waiting_for_text_message', 'start_time': now + i,
+        'email': f'user{i}@example.com', 'content_type': 'text'}, args.sessions)
+    as_record = bytes_per_session(lambda i: Session(
+        step=Step.WAITING_FOR_TEXT_MESSAGE, start_time=now + i,
+        email=f'user{i}@example.com', content_type='text'), args.sessions)
+    print(f"bytes/session at {args.sessions:,} sessions: dict {as_dict:.0f}, Session {as_record:.0f}")
+
+
+if __name__ == '__main__':
+    main()
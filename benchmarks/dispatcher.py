@@ -0,0 +1,58 @@
+"""Stress the per-chat Dispatcher with 10k simulated chats.
+
+Every chat sends a run of numbered updates; the handler simulates a little
+I/O and records arrival order.  Verifies that each chat's updates were
+handled strictly in order and reports throughput for several pool sizes.
+
+Usage: python -m benchmarks.dispatcher [--chats 10000] [--per-chat 5] [--work-ms 1]
+"""
+import argparse
+import random
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--per-chat', type=int, default=5)
+    parser.add_argument('--work-ms', type=float, default=1.0,
+                        help="simulated I/O time per update")
+    args = parser.parse_args()
+
+    from app.controllers.dispatcher import Dispatcher
+
+    # Interleave chats randomly, keeping each chat's own sequence in order
+    streams = [[(chat_id, seq) for seq in range(args.per_chat)] for chat_id in range(args.chats)]
+    order = [chat_id for chat_id in range(args.chats) for _ in range(args.per_chat)]
+    random.Random(42).shuffle(order)
+    cursors = [0] * args.chats
+    updates = []
+    for chat_id in order:
+        updates.append({'message': {'chat': {'id': chat_id}, 'text': str(streams[chat_id][cursors[chat_id]][1])}})
+        cursors[chat_id] += 1
+
+    print(f"{'workers':>8} {'updates/s':>10} {'max shard ms':>13} {'ordered':>8}")
+    for workers in (1, 8, 32, 128):
+        seen = [[] for _ in range(args.chats)]
+
+        def handler(update):
+            message = update['message']
+            seen[message['chat']['id']].append(int(message['text']))
+            time.sleep(args.work_ms / 1000)
+
+        dispatcher = Dispatcher(handler=handler, workers=workers, queue_size=1000)
+        start = time.perf_counter()
+        for update in updates:
+            dispatcher.submit(update, timeout=None)
+        dispatcher.join()
+        elapsed = time.perf_counter() - start
+
+        ordered = all(s == list(range(args.per_chat)) for s in seen)
+        max_ms = max(s['max_processing'] for s in dispatcher.stats()['shards']) * 1000
+        print(f"{workers:>8} {len(updates) / elapsed:>10.0f} {max_ms:>13.1f} {str(ordered):>8}")
+        if not ordered:
+            raise SystemExit("per-chat ordering violated")
+
+
+if __name__ == '__main__':
+    main()
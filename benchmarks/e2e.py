@@ -0,0 +1,295 @@
+"""End-to-end benchmark: whole conversations through POST /message, mail delivered.
+
+The bot runs as a child process (main.py, Flask or ASGI mode) in a scratch
+directory, talking to an in-process fake Bot API and SMTP sink, so nothing
+leaves 127.0.0.1 and the suite can run in CI.  A replay driver plays the
+text, photo and document flows from --users concurrent chats (or replays
+captured updates from a JSON-lines file), and waits until every
+conversation has received its final "sent successfully" reply.
+
+For each flow it reports:
+  updates/s and conversations/s (end to end, mail delivered)
+  p50/p95/p99 latency of POST /message
+  peak RSS and open file descriptors of the bot process (Linux /proc)
+
+The run fails if a conversation does not finish or the bot leaks file
+descriptors.  --output writes the results as JSON for comparing runs.
+
+Usage: python -m benchmarks.e2e [--flows text,photo,document] [--conversations 200]
+                                [--users 20] [--size-kb 256] [--latency 0.0]
+                                [--mode flask|asgi] [--replay updates.jsonl] [--output e2e.json]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import FakeBotAPI, SMTPSink, free_port, wait_for_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DONE_MARKERS = ('sent successfully to', 'failed to send to')
+# Besides the Telegram and SMTP keep-alive pools, which fill up under load, a few fds may come and go
+FD_SLACK = 8
+# update_ids are unique across drives: the bot's journal drops ones it has seen
+UPDATE_IDS = itertools.count(1)
+
+
+def flow_updates(flow, chat_id):
+    """The updates one chat sends for a complete conversation of the given flow"""
+    if flow == 'text':
+        texts = ['/send_mail', 'someone@example.com', '1', 'Benchmark body', 'Benchmark']
+    else:
+        texts = ['/send_mail', 'someone@example.com', '2' if flow == 'photo' else '3', '2', None,
+                 'skip', 'Benchmark']
+    for text in texts:
+        message = {'chat': {'id': chat_id}}
+        if text is not None:
+            message['text'] = text
+        elif flow == 'photo':
+            message['photo'] = [{'file_id': f'photo-{chat_id}', 'file_unique_id': f'p{chat_id}',
+                                 'width': 1280, 'height': 960}]
+        else:
+            message['document'] = {'file_id': f'doc-{chat_id}', 'file_unique_id': f'd{chat_id}',
+                                   'file_name': f'report-{chat_id}.pdf'}
+        yield message
+
+
+def load_replay(path):
+    """Captured updates, one JSON object per line, grouped by chat in arrival order"""
+    chats = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                update = json.loads(line)
+                chats.setdefault(update['message']['chat']['id'], []).append(update['message'])
+    return chats
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+class BotProcess:
+    """main.py in a scratch directory, with /proc sampling of its RSS and open fds"""
+
+    def __init__(self, mode, env):
+        self.workdir = tempfile.mkdtemp(prefix='e2e-bot-')
+        self.port = free_port()
+        env = dict(env, PORT=str(self.port), SERVER_MODE=mode, PYTHONPATH=ROOT)
+        self.proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=self.workdir,
+                                     env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_port(self.port)
+        self.peak_rss = 0
+        self._sampling = False
+
+    def rss(self):
+        try:
+            with open(f'/proc/{self.proc.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def open_fds(self):
+        try:
+            return len(os.listdir(f'/proc/{self.proc.pid}/fd'))
+        except OSError:
+            return 0
+
+    def start_sampling(self, interval=0.05):
+        self.peak_rss = self.rss()
+        self._sampling = True
+
+        def sample():
+            while self._sampling:
+                self.peak_rss = max(self.peak_rss, self.rss())
+                time.sleep(interval)
+
+        threading.Thread(target=sample, daemon=True).start()
+
+    def stop_sampling(self):
+        self._sampling = False
+        self.peak_rss = max(self.peak_rss, self.rss())
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def drive(port, conversations, users):
+    """POST each chat's messages in order, `users` chats at a time; returns (latencies, elapsed)"""
+    latencies = []
+    lock = threading.Lock()
+    pending = iter(conversations.items())
+
+    def user():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        own = []
+        try:
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    break
+                _, messages = item
+                for message in messages:
+                    with lock:
+                        update_id = next(UPDATE_IDS)
+                    body = json.dumps({'update_id': update_id, 'message': message})
+                    start = time.perf_counter()
+                    connection.request('POST', '/message', body, {'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                    own.append(time.perf_counter() - start)
+                    if response.status >= 400:
+                        raise RuntimeError(f"POST /message answered {response.status}")
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(own)
+
+    threads = [threading.Thread(target=user) for _ in range(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def wait_for_replies(api, chat_ids, timeout, seen=0):
+    """Block until every chat got its final delivery report (looking at replies from index
+    ``seen`` on); returns (chats still waiting, chats whose email failed)"""
+    deadline = time.monotonic() + timeout
+    waiting = set(chat_ids)
+    failed = set()
+    while waiting and time.monotonic() < deadline:
+        with api.lock:
+            new, seen = api.sent[seen:], len(api.sent)
+        for chat_id, text in new:
+            if text and chat_id in waiting and any(marker in text for marker in DONE_MARKERS):
+                waiting.discard(chat_id)
+                if DONE_MARKERS[1] in text:
+                    failed.add(chat_id)
+        if waiting:
+            time.sleep(0.01)
+    return waiting, failed
+
+
+def run_flow(name, conversations, args, api, sink, env):
+    bot = BotProcess(args.mode, env)
+    try:
+        # Warm up: one conversation, so imports and pool connections are not in the numbers
+        warmup_chat = 10 ** 9
+        replies_before = len(api.sent)
+        drive(bot.port, {warmup_chat: list(flow_updates('text', warmup_chat))}, 1)
+        wait_for_replies(api, [warmup_chat], args.timeout, replies_before)
+        fds_before = bot.open_fds()
+        messages_before = sink.messages
+        replies_before = len(api.sent)
+
+        bot.start_sampling()
+        start = time.perf_counter()
+        latencies, posted = drive(bot.port, conversations, args.users)
+        # Captured traffic need not end in a finished conversation, so a replay does not wait
+        missing, failed = (wait_for_replies(api, conversations, args.timeout, replies_before)
+                           if name != 'replay' else (set(), set()))
+        elapsed = time.perf_counter() - start
+        bot.stop_sampling()
+        time.sleep(0.2)  # let temp-file cleanup after delivery finish
+        fds_after = bot.open_fds()
+    finally:
+        bot.stop()
+
+    latencies.sort()
+    result = {
+        'flow': name,
+        'conversations': len(conversations),
+        'updates': len(latencies),
+        'updates_per_s': len(latencies) / posted,
+        'conversations_per_s': (len(conversations) - len(missing) - len(failed)) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_rss_mb': bot.peak_rss / 2 ** 20,
+        'fds_before': fds_before,
+        'fds_after': fds_after,
+        'emails': sink.messages - messages_before,
+        'failed': len(failed),
+        'unfinished': len(missing),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flows', default='text,photo,document')
+    parser.add_argument('--conversations', type=int, default=200, help="conversations per flow")
+    parser.add_argument('--users', type=int, default=20, help="chats talking at the same time")
+    parser.add_argument('--size-kb', type=int, default=256, help="size of each uploaded photo/document")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated Bot API round trip in seconds")
+    parser.add_argument('--mode', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--replay', help="JSON-lines file of captured updates to replay instead of the flows")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds to wait for deliveries to finish")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    telegram_pool = max(args.users, 10)
+    pool_fds = telegram_pool + int(os.environ.get('SMTP_POOL_SIZE', '4'))
+    api = FakeBotAPI(file_size=args.size_kb * 1024, latency=args.latency).start()
+    sink = SMTPSink().start()
+    env = dict(os.environ, BOT_TOKEN=api.token, TELEGRAM_API_URL=api.url,
+               TELEGRAM_POOL_SIZE=str(telegram_pool),
+               SMTP_HOST='127.0.0.1', SMTP_PORT=str(sink.port), SMTP_USER='bot@example.com',
+               SMTP_PASS='', SMTP_STARTTLS='False', LOG_CONSOLE='False',
+               # The fake API has no flood limits; measure the bot, not Telegram's caps
+               TELEGRAM_GLOBAL_RATE='0', TELEGRAM_CHAT_RATE='0', TELEGRAM_GROUP_RATE='0',
+               OUTBOX_COALESCE_WINDOW='0',
+               # A full queue asks the user to send the subject again, which the driver never does
+               DELIVERY_QUEUE_SIZE=str(max(args.conversations, 100)))
+
+    if args.replay:
+        workloads = [('replay', load_replay(args.replay))]
+    else:
+        workloads = [(flow, {chat_id: list(flow_updates(flow, chat_id))
+                             for chat_id in range(1, args.conversations + 1)})
+                     for flow in args.flows.split(',')]
+
+    results = []
+    print(f"{'flow':<10}{'upd/s':>8}{'conv/s':>8}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}"
+          f"{'RSS MB':>8}{'fds':>10}{'emails':>8}{'failed':>8}")
+    try:
+        for name, conversations in workloads:
+            result = run_flow(name, conversations, args, api, sink, env)
+            results.append(result)
+            print(f"{name:<10}{result['updates_per_s']:>8.0f}{result['conversations_per_s']:>8.1f}"
+                  f"{result['p50_ms']:>8.1f}{result['p95_ms']:>8.1f}{result['p99_ms']:>8.1f}"
+                  f"{result['peak_rss_mb']:>8.1f}{result['fds_before']:>5}->{result['fds_after']:<4}"
+                  f"{result['emails']:>8}{result['failed']:>8}")
+    finally:
+        api.stop()
+        sink.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+    for result in results:
+        if result['flow'] != 'replay':
+            assert result['unfinished'] == 0, f"{result['flow']}: {result['unfinished']} conversations unfinished"
+        assert result['fds_after'] - result['fds_before'] <= pool_fds + FD_SLACK, \
+            f"{result['flow']}: open fds grew from {result['fds_before']} to {result['fds_after']}"
+
+
+if __name__ == '__main__':
+    main()
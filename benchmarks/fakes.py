@@ -0,0 +1,303 @@
+"""Local stand-ins for the external services the bot talks to.
+
+Nothing here touches the network beyond 127.0.0.1, so the benchmarks can run
+in CI.  Run ``python -m benchmarks.fakes smtp|botapi [port]`` to start one on
+its own.
+"""
+import itertools
+import json
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def free_port():
+    """Return a TCP port that is free on localhost right now"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    """Wait until something accepts connections on the localhost port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+class SMTPSink:
+    """aiosmtpd-backed SMTP server that accepts and discards every message
+
+    It advertises PIPELINING (aiosmtpd reads commands off a buffered stream,
+    so pipelined groups work) and refuses recipients whose address contains
+    ``reject``, so callers can exercise per-recipient failures.
+    """
+
+    def __init__(self, port=None):
+        from aiosmtpd.controller import Controller
+
+        self.port = port or free_port()
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.controller = Controller(self, hostname='127.0.0.1', port=self.port, data_size_limit=None)
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self._lock:
+            self.connections += 1
+        session.host_name = hostname
+        return responses[:-1] + ['250-PIPELINING'] + responses[-1:]
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if 'reject' in address:
+            return '550 5.1.1 Recipient rejected'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(envelope.content or b'')
+        return '250 OK'
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+
+class _BotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, payload):
+        self._reply(status, json.dumps(payload).encode())
+
+    def _params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        return json.loads(raw) if raw else {}
+
+    def do_POST(self):
+        api = self.server.api
+        method = self.path.rsplit('/', 1)[-1].split('?', 1)[0]
+        params = self._params()
+        with api.lock:
+            api.calls[method] = api.calls.get(method, 0) + 1
+        handler = getattr(api, f'method_{method}', None)
+        if handler is None:
+            return self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        if api.latency:
+            time.sleep(api.latency)
+        status, payload = handler(params)
+        self._json(status, payload)
+
+    def do_GET(self):
+        api = self.server.api
+        prefix = f'/file/bot{api.token}/'
+        if not self.path.startswith(prefix):
+            return self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        size = api.files.get(self.path[len(prefix):])
+        with api.lock:
+            api.calls['download'] = api.calls.get('download', 0) + 1
+        if size is None:
+            return self._json(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        block = b'x' * 65536
+        remaining = size
+        while remaining:
+            n = min(remaining, len(block))
+            self.wfile.write(block[:n])
+            remaining -= n
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        pass  # clients hanging up mid-benchmark are expected
+
+
+class FakeBotAPI:
+    """In-process Bot API serving sendMessage, getFile and file downloads
+
+    Every file_id resolves to a file of ``file_size`` bytes.  ``sent`` keeps
+    (chat_id, text) for each accepted sendMessage.  ``latency`` delays every
+    API method to imitate the round trip to api.telegram.org.
+
+    With ``global_rate``/``chat_rate`` set, sendMessage enforces flood
+    limits like Telegram: over ``global_rate`` messages/s in total, or
+    ``chat_rate``/s per chat (``chat_burst`` saved up), it answers 429 with
+    a ``retry_after``, and ``throttled`` counts those refusals.
+    """
+
+    def __init__(self, token='TEST:TOKEN', port=None, file_size=64 * 1024, latency=0.0,
+                 global_rate=0, chat_rate=0, chat_burst=1):
+        self.token = token
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.throttled = 0
+        self._allowance = {}  # None (global) or chat_id -> (tokens, updated)
+        self.file_size = file_size
+        self.files = {}
+        self.calls = {}
+        self.sent = []
+        self.lock = threading.Lock()
+        self.updates = deque()
+        self.updates_ready = threading.Condition(self.lock)
+        self.httpd = _HTTPServer(('127.0.0.1', port or 0), _BotAPIHandler)
+        self.httpd.api = self
+        self.port = self.httpd.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}'
+
+    def _spend(self, key, rate, burst, now):
+        # Lock held.  Token bucket per key; True if a message may go now
+        tokens, updated = self._allowance.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return False
+        self._allowance[key] = (tokens - 1, now)
+        return True
+
+    def _refund(self, key):
+        tokens, updated = self._allowance[key]
+        self._allowance[key] = (tokens + 1, updated)
+
+    def method_sendMessage(self, params):
+        with self.lock:
+            chat_id = params.get('chat_id')
+            now = time.monotonic()
+            allowed = not self.global_rate or self._spend(None, self.global_rate, self.global_rate, now)
+            if allowed and self.chat_rate and not self._spend(chat_id, self.chat_rate, self.chat_burst, now):
+                if self.global_rate:
+                    self._refund(None)
+                allowed = False
+            if not allowed:
+                self.throttled += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+            self.sent.append((chat_id, params.get('text')))
+            message_id = len(self.sent)
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}}}
+
+    def method_getFile(self, params):
+        file_id = params.get('file_id', '')
+        file_path = f'documents/{file_id}'
+        self.files[file_path] = self.file_size
+        return 200, {'ok': True, 'result': {'file_id': file_id, 'file_size': self.file_size,
+                                            'file_path': file_path}}
+
+    def push_updates(self, updates):
+        """Queue updates for getUpdates to hand out"""
+        with self.updates_ready:
+            self.updates.extend(updates)
+            self.updates_ready.notify_all()
+
+    def method_getUpdates(self, params):
+        offset = params.get('offset', 0)
+        limit = params.get('limit', 100)
+        deadline = time.monotonic() + params.get('timeout', 0)
+        with self.updates_ready:
+            # Like Telegram, an offset confirms (drops) every earlier update
+            while self.updates and self.updates[0]['update_id'] < offset:
+                self.updates.popleft()
+            while not self.updates and time.monotonic() < deadline:
+                self.updates_ready.wait(deadline - time.monotonic())
+            batch = list(itertools.islice(self.updates, limit))
+        return 200, {'ok': True, 'result': batch}
+
+    def method_deleteWebhook(self, params):
+        return 200, {'ok': True, 'result': True}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def use_bot_api(api):
+    """Point the Telegram settings at a fake Bot API (call before importing app modules)"""
+    import os
+    os.environ.update({'BOT_TOKEN': api.token, 'TELEGRAM_API_URL': api.url})
+
+
+def spawn_fake(service, *args):
+    """Run a fake service in a child process; returns (process, port)"""
+    import subprocess
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, '-m', 'benchmarks.fakes', service, str(port), *args],
+                            stdout=subprocess.PIPE, text=True)
+    proc.stdout.readline()  # wait for the "listening" line
+    return proc, port
+
+
+def spawn_smtp_sink():
+    """Run an SMTP sink in a child process so its buffers stay out of our measurements"""
+    return spawn_fake('smtp')
+
+
+def use_smtp_sink(port):
+    """Point the mail settings at a local plaintext sink (call before importing app modules)"""
+    import os
+    os.environ.update({
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(port),
+        'SMTP_USER': 'bot@example.com',
+        'SMTP_PASS': '',
+        'SMTP_STARTTLS': 'False',
+    })
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a fake service in the foreground")
+    parser.add_argument('service', choices=['smtp', 'botapi'])
+    parser.add_argument('port', type=int, nargs='?')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds the fake Bot API waits before answering")
+    args = parser.parse_args()
+    port = args.port or free_port()
+    if args.service == 'smtp':
+        sink = SMTPSink(port).start()
+        print(f"SMTP sink listening on 127.0.0.1:{sink.port}", flush=True)
+    else:
+        api = FakeBotAPI(port=port, latency=args.latency).start()
+        print(f"Fake Bot API listening on {api.url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Per-update cost of logging on the text and document conversation paths.
+
+Replays /send_mail conversations through handle_command with Telegram and
+SMTP stubbed out (the document flow runs getFile, the download and the SMTP
+send against no-op stubs, so every span fires) and reports microseconds per
+update for:
+
+  off       level WARNING: spans and debug records are skipped on entry
+  info      INFO spans written as JSON lines to a temp file
+  debug     everything at DEBUG
+  sampled   DEBUG with LOG_SAMPLE_RATE-style sampling at 1%
+  print     logging off plus the print() calls the old code made per upload
+            and per attachment email (message dict, file info, headers),
+            written to a file the way they ended up in logs/bot_log.log
+
+Usage: python -m benchmarks.logging_overhead [--chats 5000]
+"""
+import argparse
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+TEXT_CONVERSATION = ['/send_mail', 'someone@example.com', '1', 'Hello there', 'skip']
+DOCUMENT_CONVERSATION = ['/send_mail', 'someone@example.com', '3', '2', None, 'skip', 'skip']
+
+
+def updates(chats, conversation):
+    for chat_id in range(chats):
+        for text in conversation:
+            message = {'chat': {'id': chat_id}}
+            if text is None:
+                message['document'] = {'file_id': f'file-{chat_id}', 'file_unique_id': f'u{chat_id}',
+                                       'file_name': 'report.txt', 'file_size': 4096}
+            else:
+                message['text'] = text
+            yield {'update_id': chat_id, 'message': message}
+
+
+def run(handlers, batch):
+    start = time.perf_counter()
+    for update in batch:
+        handlers.handle_command(update)
+    return (time.perf_counter() - start) / len(batch) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=5000)
+    args = parser.parse_args()
+
+    from utils import logger
+    from app.controllers import handlers
+    from app.models.attachment_cache import AttachmentCache
+    from app.models.spool import Spool
+
+    workdir = tempfile.mkdtemp(prefix='logbench-')
+    log_file = os.path.join(workdir, 'bot.jsonl')
+    print_file = open(os.path.join(workdir, 'bot_log.log'), 'w')
+    legacy = {'on': False}
+
+    def legacy_print(*values):
+        if legacy['on']:
+            print(*values, file=print_file)
+
+    def get_file(file_id):
+        info = {'file_id': file_id, 'file_path': f'documents/{file_id}.txt', 'file_size': 4096}
+        legacy_print(f"File info: {info}")
+        return info
+
+    def download_file(file_path, destination, chunk_size=None, max_size=None):
+        with open(destination, 'wb') as f:
+            f.write(b'x' * 4096)
+
+    def send_attachment(to_email, subject, body, file_path, encoded_path=None):
+        for line in ("Starting to send email with attachment...", f"To: {to_email}", f"Subject: {subject}",
+                     f"File path: {file_path}", f"File size: {os.path.getsize(file_path)} bytes",
+                     "Sending message...", "Message sent successfully!"):
+            legacy_print(line)
+        return original_send_attachment(to_email, subject, body, file_path, encoded_path=encoded_path)
+
+    original_handle_upload = handlers.handle_file_upload
+
+    def handle_file_upload(chat_id, message, session):
+        legacy_print(f"Message data: {message}")
+        return original_handle_upload(chat_id, message, session)
+
+    # Keep the measurement on dispatch, logging and spans only
+    handlers.send_message = lambda chat_id, text: "Message sent successfully."
+    handlers.delivery_queue.submit = lambda job: job.send() or True
+    handlers.telegram.get_file = get_file
+    handlers.telegram.download_file = download_file
+    handlers.attachment_cache = AttachmentCache(max_bytes=0)
+    handlers.spool = Spool(directory=os.path.join(workdir, 'spool'), quota=0)
+    handlers.email_sender.pool.send = lambda operation: None
+    original_send_attachment = handlers.email_sender.send_attachment_email
+    handlers.email_sender.send_attachment_email = send_attachment
+    handlers.STEP_HANDLERS[handlers.Step.WAITING_FOR_FILE] = handle_file_upload
+
+    modes = [
+        ('off', logging.WARNING, 1.0, False),
+        ('info', logging.INFO, 1.0, False),
+        ('debug', logging.DEBUG, 1.0, False),
+        ('sampled', logging.DEBUG, 0.01, False),
+        ('print', logging.WARNING, 1.0, True),
+    ]
+    text_batch = list(updates(args.chats, TEXT_CONVERSATION))
+    document_batch = list(updates(args.chats, DOCUMENT_CONVERSATION))
+    baseline = {}
+    print(f"{'mode':<10}{'text us/update':>16}{'document us/update':>20}{'records':>10}{'dropped':>9}")
+    try:
+        for name, level, rate, use_print in modes:
+            logger.shutdown_logging()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(log_file)
+            logger.configure_logging(level=level, log_file=log_file, console=False, sample_rate=rate)
+            legacy['on'] = use_print
+            run(handlers, text_batch[:500])  # warm up
+            text = run(handlers, text_batch)
+            document = run(handlers, document_batch)
+            logger.shutdown_logging()
+            print_file.flush()
+            records = sum(1 for _ in open(log_file)) if os.path.exists(log_file) else 0
+            baseline.setdefault('text', text)
+            baseline.setdefault('document', document)
+            print(f"{name:<10}{text:>10.1f} ({text - baseline['text']:+5.1f}){document:>13.1f} "
+                  f"({document - baseline['document']:+5.1f}){records:>10}{logger.dropped_records():>9}")
+    finally:
+        print_file.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Cost of recording metrics, and of a /metrics scrape merging several workers.
+
+Compares the per-thread Counter/Histogram from utils.metrics with the same
+histogram guarded by a single lock, single-threaded and with N threads
+hammering it, then times REGISTRY.render() over simulated worker snapshots
+in METRICS_DIR and checks the merged counts add up.
+
+Usage: python -m benchmarks.metrics [--observations 200000] [--threads 8] [--workers 8]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+
+class LockedHistogram:
+    """The obvious alternative: one shared dict behind one lock"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 3)
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+
+def ns_per_op(observe, observations, threads):
+    per_thread = observations // threads
+
+    def work():
+        for i in range(per_thread):
+            observe(i * 1e-5, 'sendMessage')
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (per_thread * threads) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--observations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    metrics_dir = tempfile.mkdtemp(prefix='metrics-')
+    os.environ['METRICS_DIR'] = metrics_dir
+    from utils import metrics
+    metrics.METRICS_DIR = metrics_dir
+
+    try:
+        histogram = metrics.Histogram('bench_seconds', 'benchmark', ['method'], registry=None)
+        counter = metrics.Counter('bench_total', 'benchmark', ['method'], registry=None)
+        locked = LockedHistogram(metrics.DEFAULT_BUCKETS)
+        print(f"{'operation':<30}{'1 thread ns/op':>16}{f'{args.threads} threads ns/op':>20}")
+        for name, observe in [('Counter.inc', lambda value, label: counter.inc(label)),
+                              ('Histogram.observe', histogram.observe),
+                              ('locked histogram', locked.observe)]:
+            single = ns_per_op(observe, args.observations, 1)
+            multi = ns_per_op(observe, args.observations, args.threads)
+            print(f"{name:<30}{single:>16.0f}{multi:>20.0f}")
+        total = histogram.snapshot()['samples'][0][1][-1]
+        assert total == args.observations + args.observations // args.threads * args.threads, total
+
+        # Simulated gunicorn workers: each left a snapshot with 1000 updates in METRICS_DIR
+        registry = metrics.Registry()
+        updates = metrics.Counter('tsb_bench_updates_total', 'benchmark', ['step'], registry=registry)
+        seconds = metrics.Histogram('tsb_bench_update_seconds', 'benchmark', ['step'], registry=registry)
+        for _ in range(1000):
+            updates.inc('waiting_for_email')
+            seconds.observe(0.003, 'waiting_for_email')
+        snapshot = registry.snapshot()
+        for worker in range(args.workers - 1):
+            with open(os.path.join(metrics_dir, f"{os.getpid() + 1 + worker}.json"), 'w') as f:
+                json.dump({'pid': os.getpid() + 1 + worker, 'time': time.time(), 'metrics': snapshot}, f)
+
+        start = time.perf_counter()
+        text = registry.render()
+        elapsed = time.perf_counter() - start
+        expected = 1000 * args.workers
+        assert f'tsb_bench_updates_total{{step="waiting_for_email"}} {expected}' in text, text
+        assert f'tsb_bench_update_seconds_count{{step="waiting_for_email"}} {expected}' in text, text
+        print(f"\nscrape merging {args.workers} workers: {elapsed * 1000:.2f} ms, "
+              f"{len(text.splitlines())} lines, counts add up to {expected}")
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Replies delivered per second against a Bot API that enforces flood limits.
+
+The fake Bot API answers 429 (retry_after=1) once a chat goes over
+--chat-rate messages/s (3 saved up) or all chats together over --global-rate.
+--chats chats each get --replies replies, one every --interval seconds,
+as a busy bot would produce them.  Modes:
+
+  direct           one TelegramClient.send_message per reply from --threads
+                   threads, 429s retried by the client (the old send_message)
+  scheduler        OutboundScheduler with the same limits as the API
+  over the limit   OutboundScheduler allowed twice the API's rates, so it
+                   runs into 429s and has to requeue
+
+For each mode: time until the last reply was delivered, replies and
+sendMessage calls per second, 429s and lost replies.  The scheduler modes
+fail if a reply is lost or a chat sees its replies out of order.
+
+Usage: python -m benchmarks.outbound [--chats 50] [--replies 10] [--interval 0.2]
+                                     [--global-rate 30] [--chat-rate 1] [--threads 32]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import FakeBotAPI, use_bot_api
+
+
+def reply_text(chat_id, i):
+    return f"chat {chat_id} reply {i}"
+
+
+def produce(submit, chats, replies, interval):
+    """Hand every chat one reply per round, a round every `interval` seconds"""
+    for i in range(replies):
+        start = time.monotonic()
+        for chat_id in range(1, chats + 1):
+            submit(chat_id, reply_text(chat_id, i))
+        time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+def delivered(api, chats, replies, separator):
+    """(replies received, chats whose replies were missing or out of order)"""
+    received = {}
+    with api.lock:
+        for chat_id, text in api.sent:
+            received.setdefault(chat_id, []).extend(text.split(separator))
+    broken = [chat_id for chat_id in range(1, chats + 1)
+              if received.get(chat_id, []) != [reply_text(chat_id, i) for i in range(replies)]]
+    return sum(len(texts) for texts in received.values()), broken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--replies', type=int, default=10, help="replies per chat")
+    parser.add_argument('--interval', type=float, default=0.2, help="seconds between a chat's replies")
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--chat-rate', type=float, default=1)
+    parser.add_argument('--threads', type=int, default=32, help="sending threads in direct mode")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(global_rate=args.global_rate, chat_rate=args.chat_rate, chat_burst=3).start()
+    use_bot_api(api)
+    from app.models.telegram_client import TelegramClient
+    from app.models.rate_limiter import OutboundScheduler, SEPARATOR
+
+    client = TelegramClient(pool_size=args.threads)
+    total = args.chats * args.replies
+    print(f"{'mode':<16}{'seconds':>9}{'replies/s':>11}{'sends/s':>9}{'429s':>7}{'lost':>7}")
+    try:
+        for mode in ('direct', 'scheduler', 'over the limit'):
+            with api.lock:
+                api.sent.clear()
+                api._allowance.clear()
+                api.throttled = 0
+            time.sleep(1)  # let the API's buckets refill between modes
+            start = time.perf_counter()
+            if mode == 'direct':
+                with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                    def send(chat_id, text):
+                        try:
+                            client.send_message(chat_id, text)
+                        except Exception:
+                            pass  # the reply is lost
+                    produce(lambda chat_id, text: executor.submit(send, chat_id, text),
+                            args.chats, args.replies, args.interval)
+            else:
+                factor = 1 if mode == 'scheduler' else 2
+                scheduler = OutboundScheduler(
+                    lambda chat_id, text: client.call('sendMessage', {'chat_id': chat_id, 'text': text},
+                                                      max_retries=0),
+                    global_rate=args.global_rate * factor, chat_rate=args.chat_rate * factor, chat_burst=3,
+                    senders=8)
+                produce(scheduler.submit, args.chats, args.replies, args.interval)
+                assert scheduler.close(timeout=120), "replies still queued after 120 s"
+            elapsed = time.perf_counter() - start
+            received, broken = delivered(api, args.chats, args.replies, SEPARATOR)
+            with api.lock:
+                sends, throttled = len(api.sent), api.throttled
+            print(f"{mode:<16}{elapsed:>9.1f}{received / elapsed:>11.1f}{sends / elapsed:>9.1f}"
+                  f"{throttled:>7}{total - received:>7}")
+            if mode != 'direct':
+                stats = scheduler.stats()
+                assert stats['dropped'] == 0 and received == total, f"{mode}: {total - received} replies lost"
+                assert not broken, f"{mode}: chats {broken[:5]} got replies missing or out of order"
+    finally:
+        client.close()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""getUpdates long-poll ingestion throughput against a fake Bot API.
+
+Queues synthetic /send_mail conversations across many chats, lets
+UpdatePoller drain them through handle_command, checks per-chat ordering
+and compares batch sizes of 1 and 100 updates per getUpdates call.
+
+Usage: python -m benchmarks.polling [--chats 500] [--latency 0.02]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.fakes import FakeBotAPI, use_bot_api
+
+CONVERSATION = ['/send_mail', 'someone@example.com', '1', 'Polling benchmark', '/cancel']
+
+
+def synthetic_updates(chats):
+    updates = []
+    update_id = 1
+    for text in CONVERSATION:
+        for chat_id in range(chats):
+            updates.append({'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'text': text}})
+            update_id += 1
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="simulated Bot API round trip in seconds")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency).start()
+    use_bot_api(api)
+    from app.controllers import handlers
+    from app.controllers.poller import UpdatePoller, OffsetStore
+    from app.models.telegram_client import TelegramClient
+
+    print(f"{'limit':>6} {'updates/s':>10} {'getUpdates calls':>17}")
+    try:
+        for limit in (1, 100):
+            updates = synthetic_updates(args.chats)
+            seen = {}
+
+            def handler(update):
+                chat_id = update['message']['chat']['id']
+                seen.setdefault(chat_id, []).append(update['update_id'])
+                return handlers.handle_command(update)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                poller = UpdatePoller(client=TelegramClient(pool_size=16), handler=handler,
+                                      offset_store=OffsetStore(os.path.join(tmp, 'offset')),
+                                      workers=16, timeout=1, limit=limit)
+                calls_before = api.calls.get('getUpdates', 0)
+                api.updates.clear()  # drop anything the previous round left unconfirmed
+                api.push_updates(updates)
+                start = time.perf_counter()
+                thread = threading.Thread(target=poller.run, daemon=True)
+                thread.start()
+                while poller.processed < len(updates):
+                    time.sleep(0.01)
+                elapsed = time.perf_counter() - start
+                poller.stop_event.set()
+                thread.join()
+                poller.stop()
+
+            assert all(ids == sorted(ids) for ids in seen.values()), "per-chat order violated"
+            calls = api.calls.get('getUpdates', 0) - calls_before
+            print(f"{limit:>6} {len(updates) / elapsed:>10.0f} {calls:>17}")
+    finally:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
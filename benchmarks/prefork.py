@@ -0,0 +1,182 @@
+"""Throughput of POST /message under gunicorn as the number of workers grows.
+
+The bot runs as `SERVER_MODE=prefork python main.py` (gunicorn with
+gunicorn.conf.py) with 1, 2, 4 ... --max-workers workers against the fake
+Bot API and SMTP sink of benchmarks.e2e, and plays --conversations text
+conversations from --connections keep-alive connections, the way Telegram
+delivers webhooks.  After each answered update its chat goes back to the
+pool and its next update is posted by whichever connection is free, so a
+chat's updates reach different workers and a conversation only finishes
+if the workers share its session.
+
+Reports updates/s, conversations/s (mail delivered), p50/p99 latency, and
+the speedup over one worker next to the number of CPUs available - the
+scaling can only be linear up to the cores there are to run the workers
+(and this driver) on.  A last run sends the master SIGHUP halfway through:
+workers are replaced on the fly and no conversation may be lost.
+
+The run fails if a conversation does not finish or an email fails.
+
+Usage: python -m benchmarks.prefork [--max-workers 4] [--conversations 300] [--connections 32]
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import signal
+import threading
+import time
+
+from benchmarks.e2e import UPDATE_IDS, BotProcess, flow_updates, percentile, wait_for_replies
+from benchmarks.fakes import FakeBotAPI, SMTPSink
+
+CHAT_IDS = iter(range(1, 10 ** 9))
+
+
+def post(conn, body):
+    conn.request('POST', '/message', body, {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def drive(port, conversations, connections):
+    """Post every chat's updates in order, each one from whichever of `connections` is free;
+    returns (latencies, elapsed)"""
+    latencies = []
+    lock = threading.Lock()
+    ready = queue.Queue()
+    for chat_id, messages in conversations.items():
+        ready.put(iter(messages))
+    remaining = [len(conversations)]
+
+    def post_updates():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        own = []
+        try:
+            while True:
+                messages = ready.get()
+                if messages is None:
+                    break
+                message = next(messages, None)
+                if message is None:
+                    with lock:
+                        remaining[0] -= 1
+                        if not remaining[0]:
+                            for _ in range(connections):
+                                ready.put(None)
+                    continue
+                with lock:
+                    update_id = next(UPDATE_IDS)
+                body = json.dumps({'update_id': update_id, 'message': message})
+                start = time.perf_counter()
+                try:
+                    response = post(conn, body)
+                except (http.client.RemoteDisconnected, ConnectionError):
+                    # A worker that is being replaced closed the keep-alive connection: retry the
+                    # update like Telegram does; the journal drops it if it was handled after all
+                    conn.close()
+                    response = post(conn, body)
+                own.append(time.perf_counter() - start)
+                if response.status >= 400:
+                    raise RuntimeError(f"POST /message answered {response.status}")
+                ready.put(messages)
+        except BaseException:
+            for _ in range(connections):  # the others would wait for this chat forever
+                ready.put(None)
+            raise
+        finally:
+            conn.close()
+            with lock:
+                latencies.extend(own)
+
+    threads = [threading.Thread(target=post_updates) for _ in range(connections)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def run(workers, args, api, sink, env, reload_after=None):
+    bot = BotProcess('prefork', dict(env, WEB_WORKERS=str(workers)))
+    try:
+        # Warm up every worker: imports and connection pools stay out of the numbers
+        warmup = {chat_id: list(flow_updates('text', chat_id)) for chat_id in
+                  (next(CHAT_IDS) for _ in range(workers * 4))}
+        seen = len(api.sent)
+        drive(bot.port, warmup, workers * 4)
+        wait_for_replies(api, warmup, args.timeout, seen)
+
+        conversations = {}
+        for _ in range(args.conversations):
+            chat_id = next(CHAT_IDS)
+            conversations[chat_id] = list(flow_updates('text', chat_id))
+        seen, emails = len(api.sent), sink.messages
+        if reload_after is not None:
+            threading.Timer(reload_after, os.kill, args=(bot.proc.pid, signal.SIGHUP)).start()
+        start = time.perf_counter()
+        latencies, posted = drive(bot.port, conversations, args.connections)
+        missing, failed = wait_for_replies(api, conversations, args.timeout, seen)
+        elapsed = time.perf_counter() - start
+    finally:
+        bot.stop()
+    latencies.sort()
+    return {
+        'updates_per_s': len(latencies) / posted,
+        'conversations_per_s': (len(conversations) - len(missing) - len(failed)) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'emails': sink.messages - emails,
+        'unfinished': len(missing),
+        'failed': len(failed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--conversations', type=int, default=300)
+    parser.add_argument('--connections', type=int, default=32, help="keep-alive connections posting updates")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds to wait for deliveries to finish")
+    args = parser.parse_args()
+
+    api = FakeBotAPI().start()
+    sink = SMTPSink().start()
+    env = dict(os.environ, BOT_TOKEN=api.token, TELEGRAM_API_URL=api.url,
+               SMTP_HOST='127.0.0.1', SMTP_PORT=str(sink.port), SMTP_USER='bot@example.com',
+               SMTP_PASS='', SMTP_STARTTLS='False', LOG_CONSOLE='False',
+               TELEGRAM_GLOBAL_RATE='0', TELEGRAM_CHAT_RATE='0', TELEGRAM_GROUP_RATE='0',
+               OUTBOX_COALESCE_WINDOW='0', DELIVERY_QUEUE_SIZE=str(max(args.conversations, 100)))
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+    counts = [1]
+    while counts[-1] * 2 <= args.max_workers:
+        counts.append(counts[-1] * 2)
+    runs = [(f"{n}", n, None) for n in counts] + [(f"{counts[-1]} + HUP", counts[-1], 0.5)]
+
+    print(f"{cpus} CPUs available")
+    print(f"{'workers':<9}{'upd/s':>8}{'conv/s':>8}{'p50 ms':>8}{'p99 ms':>8}{'speedup':>9}{'emails':>8}{'lost':>6}")
+    results = []
+    base = None
+    try:
+        for name, workers, reload_after in runs:
+            result = run(workers, args, api, sink, env, reload_after)
+            results.append((name, result))
+            base = base or result['updates_per_s']
+            print(f"{name:<9}{result['updates_per_s']:>8.0f}{result['conversations_per_s']:>8.1f}"
+                  f"{result['p50_ms']:>8.1f}{result['p99_ms']:>8.1f}{result['updates_per_s'] / base:>8.2f}x"
+                  f"{result['emails']:>8}{result['unfinished'] + result['failed']:>6}")
+    finally:
+        api.stop()
+        sink.stop()
+
+    for name, result in results:
+        assert result['unfinished'] == 0, f"{name} workers: {result['unfinished']} conversations unfinished"
+        assert result['failed'] == 0, f"{name} workers: {result['failed']} emails failed"
+
+
+if __name__ == '__main__':
+    main()
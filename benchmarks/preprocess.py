@@ -0,0 +1,229 @@
+"""Attachment preprocessing: bytes on the wire, send time, and what the webhook feels.
+
+Part 1 sends one email per sample attachment through handlers.deliver_email
+to a local SMTP sink, with preprocessing off and on:
+
+  photo.jpg       a 12 MP camera-style JPEG (quality 95)
+  screenshot.png  a 4K PNG screenshot with a photo in it
+  data.csv        --csv-mb of CSV rows
+  report.docx     a .docx (already deflated inside, so zipping is skipped)
+  video.mp4       --big-mb of incompressible bytes, split at --split-mb
+
+and reports the bytes the sink received, the local send time (preprocessing
+included) and the time the same send would take over an --uplink-mbps link
+(preprocessing + bytes / bandwidth; the sink is on localhost).
+
+Part 2 times handle_command on the calling thread (a /calculate, replies
+discarded) while --photos photos are preprocessed by delivery threads at the
+same time, with the transforms in the process pool and, for comparison, on
+the delivery threads themselves (PREPROCESS_WORKERS=0), where they compete
+with the handler for the GIL.
+
+Asserts that preprocessing shrinks the photo, the PNG and the CSV, that
+every part of the split file stays under the limit, and that the parts
+join back to the original.
+
+Usage: python -m benchmarks.preprocess [--uplink-mbps 20] [--csv-mb 8] [--big-mb 40] [--photos 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from benchmarks.fakes import SMTPSink, use_smtp_sink
+
+MB = 1024 * 1024
+
+
+def make_samples(directory, args):
+    """Write the sample attachments; returns {name: path}"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(42)
+    paths = {}
+
+    # Smooth gradients plus sensor-like noise: compresses like a photo, not like a flat image
+    width, height = 4000, 3000
+    base = Image.merge('RGB', [Image.linear_gradient('L').rotate(angle).resize((width, height))
+                               for angle in (0, 90, 45)])
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    photo = Image.blend(base, noise, 0.25)
+    paths['photo.jpg'] = os.path.join(directory, 'photo.jpg')
+    photo.save(paths['photo.jpg'], 'JPEG', quality=95)
+
+    # Flat panels, lines of "text" and a photo in a window
+    shot = Image.new('RGB', (3840, 2160), (245, 245, 245))
+    shot.paste(photo.resize((2000, 1500)), (1600, 500))
+    draw = ImageDraw.Draw(shot)
+    for y in range(0, 2160, 18):
+        x = 40
+        while x < 3800:
+            word = rng.randint(20, 90)
+            draw.rectangle((x, y + 4, x + word, y + 12), fill=(rng.randint(0, 80),) * 3)
+            x += word + 8
+    for _ in range(12):
+        x, y = rng.randint(0, 3300), rng.randint(0, 1800)
+        draw.rectangle((x, y, x + 500, y + 300), fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    paths['screenshot.png'] = os.path.join(directory, 'screenshot.png')
+    shot.save(paths['screenshot.png'], 'PNG')
+
+    paths['data.csv'] = os.path.join(directory, 'data.csv')
+    with open(paths['data.csv'], 'w') as f:
+        f.write('id,timestamp,chat_id,status,amount,comment\n')
+        row = 0
+        while f.tell() < args.csv_mb * MB:
+            row += 1
+            f.write(f"{row},2026-10-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d},"
+                    f"{rng.randint(1, 10 ** 6)},{rng.choice(['sent', 'failed', 'queued'])},"
+                    f"{rng.random() * 1000:.2f},{rng.choice(['', 'retry', 'bulk', 'photo attached'])}\n")
+
+    paths['report.docx'] = os.path.join(directory, 'report.docx')
+    with zipfile.ZipFile(paths['report.docx'], 'w', zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr('word/document.xml', '<w:p><w:r><w:t>Quarterly report</w:t></w:r></w:p>' * 40000)
+        docx.writestr('word/media/image1.bin', rng.randbytes(2 * MB))
+
+    paths['video.mp4'] = os.path.join(directory, 'video.mp4')
+    with open(paths['video.mp4'], 'wb') as f:
+        for _ in range(args.big_mb):
+            f.write(rng.randbytes(MB))
+    return paths
+
+
+def send(handlers, sink, path, workdir):
+    """deliver_email for one attachment; returns (bytes on the wire, seconds, preprocessing seconds, parts)"""
+    # A directory of its own, as the spool gives every upload
+    directory = tempfile.mkdtemp(dir=workdir)
+    upload = os.path.join(directory, os.path.basename(path))
+    shutil.copyfile(path, upload)
+    email = handlers.OutgoingEmail('someone@example.com', 'Preprocessing benchmark', 'See attached.', upload)
+    wire, messages = sink.bytes, sink.messages
+    preprocess = handlers.preprocessor.process
+
+    def timed(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return preprocess(*a, **kw)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    timings = []
+    handlers.preprocessor.process = timed
+    try:
+        start = time.perf_counter()
+        success, message = handlers.deliver_email(email)
+        elapsed = time.perf_counter() - start
+    finally:
+        del handlers.preprocessor.process
+    assert success, message
+    deadline = time.monotonic() + 10
+    while sink.messages - messages < len(email.parts) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    result = sink.bytes - wire, elapsed, sum(timings), list(email.parts)
+    return result, email, directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uplink-mbps', type=float, default=20, help="bandwidth for the modelled send time")
+    parser.add_argument('--csv-mb', type=int, default=8)
+    parser.add_argument('--big-mb', type=int, default=40)
+    parser.add_argument('--split-mb', type=int, default=18)
+    parser.add_argument('--photos', type=int, default=8, help="photos preprocessed during the webhook timing")
+    parser.add_argument('--workers', type=int, default=2, help="preprocessing processes")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='preprocess-')
+    os.chdir(workdir)  # the bot's logs and data go here
+    sink = SMTPSink().start()
+    use_smtp_sink(sink.port)
+    os.environ.setdefault('BOT_TOKEN', 'TEST:TOKEN')
+    os.environ['LOG_CONSOLE'] = 'False'
+
+    from app.controllers import handlers
+    from app.models.attachment_preprocessor import AttachmentPreprocessor
+
+    handlers.send_message = lambda chat_id, text: "Message sent successfully."
+    try:
+        samples = make_samples(workdir, args)
+        pooled = AttachmentPreprocessor(enabled=True, workers=args.workers, split_bytes=args.split_mb * MB)
+        configs = (('off', AttachmentPreprocessor(enabled=False)), ('on', pooled))
+        pooled.process(samples['screenshot.png'])  # start the pool outside the numbers
+        pooled.cleanup(samples['screenshot.png'])
+
+        rate = args.uplink_mbps * 1e6 / 8
+        print(f"{'attachment':<16}{'size MB':>8}{'prep':>5}{'wire MB':>9}{'parts':>6}{'send ms':>9}"
+              f"{'prep ms':>9}{f'@{args.uplink_mbps:g} Mbit/s':>15}")
+        wire = {}
+        for name, path in samples.items():
+            for label, preprocessor in configs:
+                handlers.preprocessor = preprocessor
+                (size, elapsed, prep, parts), email, directory = send(handlers, sink, path, workdir)
+                wire[name, label] = size
+                if label == 'on' and name == 'video.mp4':
+                    assert len(parts) > 1 and all(os.path.getsize(p) <= args.split_mb * MB for p in parts)
+                    with open(path, 'rb') as original:
+                        joined = b''.join(open(p, 'rb').read() for p in parts)
+                        assert joined == original.read(), "split parts do not join back to the original"
+                email.cleanup()
+                shutil.rmtree(directory, ignore_errors=True)
+                print(f"{name if label == 'off' else '':<16}{os.path.getsize(path) / MB:>8.1f}{label:>5}"
+                      f"{size / MB:>9.2f}{len(parts):>6}{elapsed * 1000:>9.0f}{prep * 1000:>9.0f}"
+                      f"{(prep + size / rate):>14.1f}s")
+        for name in ('photo.jpg', 'screenshot.png', 'data.csv'):
+            assert wire[name, 'on'] < wire[name, 'off'] * 0.8, f"{name} was not shrunk"
+
+        # Part 2: the webhook thread while photos are being preprocessed
+        update = {'message': {'chat': {'id': 1}, 'text': '/calculate sum(x^2 for x in 1..1000)'}}
+
+        def webhook_latency(background):
+            latencies = []
+            threads = [threading.Thread(target=background) for _ in range(args.photos)] if background else []
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 1.0
+            while (threads and any(t.is_alive() for t in threads)) or (not threads and time.monotonic() < deadline):
+                start = time.perf_counter()
+                handlers.handle_command(update)
+                latencies.append(time.perf_counter() - start)
+                time.sleep(0.005)
+            for thread in threads:
+                thread.join()
+            latencies.sort()
+            return latencies
+
+        def photo_worker(preprocessor):
+            def run():
+                directory = tempfile.mkdtemp(dir=workdir)
+                upload = os.path.join(directory, 'photo.jpg')
+                shutil.copyfile(samples['photo.jpg'], upload)
+                preprocessor.process(upload)
+                preprocessor.cleanup(upload)
+                shutil.rmtree(directory, ignore_errors=True)
+            return run
+
+        inline = AttachmentPreprocessor(enabled=True, workers=0)
+        handlers.handle_command(update)  # compile the expression outside the numbers
+        print(f"\n/calculate on the webhook thread while {args.photos} photos are preprocessed "
+              f"({os.cpu_count()} CPUs)")
+        print(f"{'preprocessing':<22}{'calls':>7}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for label, background in (('none (idle)', None),
+                                  (f'process pool ({args.workers})', photo_worker(pooled)),
+                                  ('delivery threads', photo_worker(inline))):
+            latencies = webhook_latency(background)
+            print(f"{label:<22}{len(latencies):>7}{statistics.median(latencies) * 1000:>9.2f}"
+                  f"{latencies[int(len(latencies) * 0.99)] * 1000:>9.2f}{latencies[-1] * 1000:>9.2f}")
+        pooled.close()
+    finally:
+        sink.stop()
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Memory and thread cost of pending reminders: heap scheduler vs thread-per-reminder.
+
+The old set_reminder started one sleeping thread per reminder, so the legacy
+run is capped (default 5k threads) and extrapolated; the scheduler run
+schedules the full count.
+
+Usage: python -m benchmarks.reminders [--reminders 100000] [--legacy 5000]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def legacy_set_reminder(time_in_minutes, task, chat_id, send_message_func, stop):
+    """The previous implementation, with a stop event so the benchmark can exit"""
+    def remind():
+        if not stop.wait(time_in_minutes * 60):
+            send_message_func(chat_id, f"Reminder: {task}")
+
+    threading.Thread(target=remind, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reminders', type=int, default=100000)
+    parser.add_argument('--legacy', type=int, default=5000)
+    args = parser.parse_args()
+
+    from app.models.reminder import ReminderScheduler
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = ReminderScheduler(send_func=lambda chat_id, text: None,
+                                      db_path=os.path.join(tmp, 'reminders.db'))
+        base_rss, base_threads = rss_mb(), threading.active_count()
+        start = time.perf_counter()
+        for i in range(args.reminders):
+            scheduler.schedule(i % 5000, f"task number {i}", 3600 + i)
+        elapsed = time.perf_counter() - start
+        sched_rss = rss_mb() - base_rss
+        sched_threads = threading.active_count() - base_threads
+
+    stop = threading.Event()
+    base_rss, base_threads = rss_mb(), threading.active_count()
+    for i in range(args.legacy):
+        legacy_set_reminder(60, f"task number {i}", i % 5000, lambda chat_id, text: None, stop)
+    legacy_rss = rss_mb() - base_rss
+    legacy_threads = threading.active_count() - base_threads
+    stop.set()
+    scale = args.reminders / args.legacy
+
+    print(f"scheduler: {args.reminders:,} reminders, {sched_threads} thread(s), "
+          f"+{sched_rss:.1f} MB RSS, {args.reminders / elapsed:,.0f} schedules/sec")
+    print(f"legacy:    {args.legacy:,} reminders, {legacy_threads} threads, +{legacy_rss:.1f} MB RSS "
+          f"(~{legacy_threads * scale:,.0f} threads, ~{legacy_rss * scale:,.0f} MB at {args.reminders:,})")
+
+
+if __name__ == '__main__':
+    main()
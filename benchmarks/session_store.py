@@ -0,0 +1,118 @@
+"""Session store throughput and the Redis store's expiry rules, without a Redis server.
+
+Times get/set/delete round trips and len() (what the tsb_active_sessions
+gauge calls on every scrape) against MemorySessionStore and
+RedisSessionStore, by default on fakeredis (pip install fakeredis); pass
+--redis-url to use a real server instead (its keys under a throwaway
+prefix are deleted afterwards).
+
+Then checks the Redis store's rules with a 2 s TTL:
+
+  - a session that is read stays alive, and sweep() leaves its upload alone
+  - sweep() looking at a session does not extend its TTL
+  - once the session expires, sweep() hands its upload to on_evict
+  - len() counts live sessions only: not deleted or expired ones
+
+Usage: python -m benchmarks.session_store [--sessions 20000] [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import time
+import uuid
+
+
+def redis_client(url):
+    if url:
+        import redis
+        return redis.Redis.from_url(url)
+    import fakeredis
+    return fakeredis.FakeRedis()
+
+
+def rates(store, count):
+    """ops/s for set, get, len and delete over `count` sessions"""
+    from app.models.session import Session, Step
+
+    results = {}
+    start = time.perf_counter()
+    for chat_id in range(count):
+        store[chat_id] = Session(step=Step.WAITING_FOR_SUBJECT, email='someone@example.com')
+    results['set'] = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for chat_id in range(count):
+        store.get(chat_id)
+    results['get'] = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        assert len(store) == count, f"len() is {len(store)}, expected {count}"
+    results['len'] = 100 / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for chat_id in range(count):
+        del store[chat_id]
+    results['delete'] = count / (time.perf_counter() - start)
+    assert len(store) == 0, f"len() is {len(store)} after deleting every session"
+    return results
+
+
+def check_expiry(client, prefix):
+    """Walk a 2 s TTL through the cases in the module docstring"""
+    from app.models.session import Session, Step
+    from app.models.session_store import RedisSessionStore
+
+    evicted = []
+    store = RedisSessionStore(client, ttl=2, prefix=prefix, on_evict=lambda s: evicted.append(s.file_path),
+                              sweep_interval=3600)
+    store[1] = Session(step=Step.WAITING_FOR_DESCRIPTION, file_path='/spool/1/report.pdf')
+    store[2] = Session(step=Step.WAITING_FOR_EMAIL)
+    store[3] = Session(step=Step.WAITING_FOR_EMAIL)
+    del store[3]
+    assert len(store) == 2, f"len() is {len(store)}, expected 2"
+
+    # t=1: reading the session moves its expiry to t=3; the upload's check is still due at t=2
+    time.sleep(1)
+    assert store.get(1) is not None
+    time.sleep(1.2)
+
+    # t=2.2: the check is due but the session is alive, so the upload stays
+    assert store.sweep() == 0 and not evicted, "sweep() removed the upload of a live session"
+    assert len(store) == 1, f"len() is {len(store)} after session 2 expired, expected 1"
+
+    # t=3.2: sweep() must not have kept session 1 alive
+    time.sleep(1)
+    assert store.peek(1) is None, "sweep() extended the session's TTL"
+    assert store.sweep() == 1 and evicted == ['/spool/1/report.pdf'], f"upload not evicted: {evicted}"
+    assert len(store) == 0, f"len() is {len(store)} once every session expired"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--redis-url', help="a real Redis server instead of fakeredis")
+    args = parser.parse_args()
+
+    from app.models.session_store import MemorySessionStore, RedisSessionStore
+
+    client = redis_client(args.redis_url)
+    prefix = f"tsb-bench-{uuid.uuid4().hex[:8]}:"
+    stores = [
+        ('memory', MemorySessionStore(max_sessions=args.sessions)),
+        ('redis' if args.redis_url else 'fakeredis', RedisSessionStore(client, prefix=prefix + 'rates:')),
+    ]
+    try:
+        print(f"{'store':<11}{'set/s':>10}{'get/s':>10}{'len/s':>10}{'delete/s':>10}")
+        for name, store in stores:
+            result = rates(store, args.sessions)
+            print(f"{name:<11}{result['set']:>10,.0f}{result['get']:>10,.0f}{result['len']:>10,.0f}"
+                  f"{result['delete']:>10,.0f}")
+
+        check_expiry(client, prefix + 'expiry:')
+        print("\nexpiry rules: ok")
+    finally:
+        for key in client.scan_iter(match=prefix + '*'):
+            client.delete(key)
+
+
+if __name__ == '__main__':
+    main()
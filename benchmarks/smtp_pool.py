@@ -0,0 +1,65 @@
+"""Emails/sec with the pooled EmailSender versus a fresh connection per email.
+
+Usage: python -m benchmarks.smtp_pool [--emails 400]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import SMTPSink, use_smtp_sink
+
+
+def run(send, emails, concurrency):
+    """Send `emails` messages from `concurrency` threads and return emails/sec"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: send(i), range(emails)))
+    elapsed = time.perf_counter() - start
+    failures = sum(1 for ok, _ in results if not ok)
+    if failures:
+        raise RuntimeError(f"{failures} sends failed: {results[0][1]}")
+    return emails / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--emails', type=int, default=400)
+    args = parser.parse_args()
+
+    sink = SMTPSink().start()
+    use_smtp_sink(sink.port)
+    from app.models.mail_sender import EmailSender
+    from app.models.smtp_pool import SMTPConnectionPool
+
+    print(f"{'senders':>8} {'per-email conn':>16} {'pooled':>10} {'speedup':>8}")
+    try:
+        for concurrency in (1, 8, 32):
+            unpooled = EmailSender(pool=PerEmailConnection())
+            unpooled.pool.factory = unpooled._create_smtp_server
+            pooled = EmailSender(pool=SMTPConnectionPool(
+                unpooled._create_smtp_server, max_size=concurrency, max_messages=1000))
+
+            def send_with(sender):
+                return lambda i: sender.send_text_email('bench@example.com', f'Bench {i}', 'Hello')
+
+            baseline = run(send_with(unpooled), args.emails, concurrency)
+            rate = run(send_with(pooled), args.emails, concurrency)
+            pooled.pool.close_all()
+            print(f"{concurrency:>8} {baseline:>13.1f}/s {rate:>7.1f}/s {rate / baseline:>7.2f}x")
+        print(f"sink saw {sink.messages} messages over {sink.connections} connections")
+    finally:
+        sink.stop()
+
+
+class PerEmailConnection:
+    """Pool stand-in reproducing the old connect/EHLO/QUIT per message"""
+
+    factory = None
+
+    def send(self, send_func):
+        with self.factory() as server:
+            return send_func(server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""Disk used by uploads under sustained load: bounded by the spool, or not.
+
+--users threads play document conversations through handle_command for
+--seconds (Telegram and SMTP stubbed out, every upload --size-kb bytes).
+Of every ten conversations six are sent, two are cancelled after the upload
+and two are abandoned after it; sessions expire after --ttl seconds.  The
+spool directory also starts with --orphans files left behind by a
+"crashed" earlier process.  Modes:
+
+  unmanaged   no quota, no sweeper: what the upload directory used to do
+  spool       --quota-mb quota with admission control, sweeper every 0.5 s
+  spool-asgi  the same spool, conversations handled by the ASGI handlers;
+              every email's first SMTP attempt fails, so it is re-sent after
+              the backoff while the sweeper is running
+
+Reports the peak and final bytes on disk (sampled every 50 ms), uploads
+accepted and refused, and bytes the sweeper reclaimed.  The spool mode fails
+if disk usage ever goes over the quota or anything is left once the load
+stops and the sessions have expired; spool-asgi also fails if a retry finds
+its attachment already swept.
+
+Usage: python -m benchmarks.spool [--users 8] [--seconds 10] [--size-kb 256]
+                                  [--quota-mb 32] [--ttl 2] [--orphans 50]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DOCUMENT_CONVERSATION = ['/send_mail', 'someone@example.com', '3', '2', None, 'skip', 'Spool benchmark']
+
+
+def document(chat_id, size):
+    return {'file_id': f'doc-{chat_id}', 'file_unique_id': f'd{chat_id}', 'file_name': 'report.pdf',
+            'file_size': size}
+
+
+def converse(handlers, handle, chat_id, outcome, size):
+    """Play one document conversation; returns False if the upload was refused"""
+    for text in DOCUMENT_CONVERSATION:
+        message = {'chat': {'id': chat_id}}
+        if text is None:
+            message['document'] = document(chat_id, size)
+            handle({'message': message})
+            session = handlers.user_sessions.get(chat_id)
+            if session is None or session.file_path is None:
+                return False
+            if outcome == 'cancel':
+                handle({'message': {'chat': {'id': chat_id}, 'text': '/cancel'}})
+            if outcome != 'send':
+                return True
+            continue
+        message['text'] = text
+        handle({'message': message})
+    return True
+
+
+def run(handlers, args, spool, async_handlers=None):
+    """Drive the load against `spool`; returns the measurements
+
+    With async_handlers, updates go through handle_command_async on an event
+    loop in a background thread instead of through handle_command.
+    """
+    from app.models.session_store import MemorySessionStore
+    from utils.metrics import directory_size
+
+    size = args.size_kb * 1024
+    handlers.spool = spool
+    handlers.user_sessions = MemorySessionStore(ttl=args.ttl, on_evict=lambda s: spool.release(s.file_path))
+    spool.in_use = handlers.upload_in_use
+
+    handle, loop = handlers.handle_command, None
+    if async_handlers is not None:
+        # The async module binds these at import time
+        async_handlers.spool, async_handlers.user_sessions = spool, handlers.user_sessions
+        async_handlers.attachment_cache = handlers.attachment_cache
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        def handle(update):
+            return asyncio.run_coroutine_threadsafe(async_handlers.handle_command_async(update), loop).result()
+
+    # Files a crashed process left behind, an hour old
+    old = time.time() - 3600
+    for i in range(args.orphans):
+        directory = os.path.join(spool.directory, f"{10 ** 9 + i}-orphan")
+        os.makedirs(directory)
+        path = os.path.join(directory, 'report.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (old, old))
+        os.utime(directory, (old, old))
+
+    chat_ids = itertools.count(1)
+    outcomes = ['send'] * 6 + ['cancel'] * 2 + ['abandon'] * 2
+    counts = {'accepted': 0, 'refused': 0}
+    lock = threading.Lock()
+    peak = [0]
+    sampling = [True]
+    deadline = time.monotonic() + args.seconds
+
+    def sample():
+        while sampling[0]:
+            peak[0] = max(peak[0], directory_size(spool.directory))
+            time.sleep(0.05)
+
+    def user():
+        while time.monotonic() < deadline:
+            with lock:
+                chat_id = next(chat_ids)
+            accepted = converse(handlers, handle, chat_id, outcomes[chat_id % len(outcomes)], size)
+            with lock:
+                counts['accepted' if accepted else 'refused'] += 1
+            if not accepted:
+                time.sleep(0.01)  # a refused user tries again a moment later
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    users = [threading.Thread(target=user) for _ in range(args.users)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+
+    # Let deliveries finish and sessions expire, then give the sweeper a round
+    if loop is not None:
+        async def drain():
+            await asyncio.gather(*async_handlers._delivery_tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(drain(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+    time.sleep(args.ttl + 1.0)
+    spool.sweep()
+    sampling[0] = False
+    sampler.join()
+    return dict(counts, peak=peak[0], final=directory_size(spool.directory),
+                reclaimed=spool.stats()['reclaimed_bytes'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--size-kb', type=int, default=256)
+    parser.add_argument('--quota-mb', type=int, default=32)
+    parser.add_argument('--ttl', type=float, default=2, help="seconds before an idle session expires")
+    parser.add_argument('--orphans', type=int, default=50, help="files left over from a crashed process")
+    args = parser.parse_args()
+
+    from app.controllers import handlers, async_handlers
+    from app.models.attachment_cache import AttachmentCache
+    from app.models.spool import Spool
+
+    size = args.size_kb * 1024
+
+    def download_file(file_path, destination, chunk_size=None, max_size=None):
+        with open(destination, 'wb') as f:
+            f.write(b'x' * size)
+
+    def submit(job):
+        # "SMTP" takes 50 ms, then the delivery reports back as usual
+        threading.Timer(0.05, job.on_done, args=(True, "sent")).start()
+        return True
+
+    # The ASGI mode's "SMTP": the first attempt per email fails, the retry needs the attachment
+    attempts = {}
+    lost = []
+
+    def deliver_email(email):
+        time.sleep(0.05)
+        attempts[id(email)] = attempts.get(id(email), 0) + 1
+        if attempts[id(email)] == 1:
+            return False, "temporary failure"
+        if not os.path.exists(email.file_path):
+            lost.append(email.file_path)
+            return False, "attachment was swept"
+        return True, "sent"
+
+    async def async_get_file(file_id):
+        return handlers.telegram.get_file(file_id)
+
+    async def async_download_file(file_path, destination, chunk_size=None, max_size=None):
+        download_file(file_path, destination, chunk_size)
+
+    # Keep the measurement on the upload lifecycle only
+    handlers.send_message = lambda chat_id, text: "Message sent successfully."
+    handlers.telegram.get_file = lambda file_id: {'file_path': f'documents/{file_id}', 'file_size': size}
+    handlers.telegram.download_file = download_file
+    handlers.delivery_queue.submit = submit
+    handlers.attachment_cache = AttachmentCache(max_bytes=0)
+    handlers.deliver_email = deliver_email
+    async_handlers.telegram.get_file = async_get_file
+    async_handlers.telegram.download_file = async_download_file
+
+    workdir = tempfile.mkdtemp(prefix='spool-')
+    quota = args.quota_mb * 2 ** 20
+    modes = [
+        ('unmanaged', dict(quota=0, sweep_interval=3600, grace=10 ** 9)),
+        ('spool', dict(quota=quota, sweep_interval=0.5, grace=1)),
+        ('spool-asgi', dict(quota=quota, sweep_interval=0.5, grace=1)),
+    ]
+    print(f"{'mode':<11}{'accepted':>10}{'refused':>9}{'peak MB':>9}{'final MB':>10}{'reclaimed MB':>14}")
+    try:
+        for name, options in modes:
+            spool = Spool(backend='disk', directory=os.path.join(workdir, name), **options)
+            result = run(handlers, args, spool, async_handlers if name == 'spool-asgi' else None)
+            print(f"{name:<11}{result['accepted']:>10}{result['refused']:>9}{result['peak'] / 2 ** 20:>9.1f}"
+                  f"{result['final'] / 2 ** 20:>10.1f}{result['reclaimed'] / 2 ** 20:>14.1f}")
+            if name != 'unmanaged':
+                assert result['peak'] <= quota, f"disk usage peaked at {result['peak']} bytes, quota {quota}"
+                assert result['final'] == 0, f"{result['final']} bytes left on disk"
+            if name == 'spool-asgi':
+                assert not lost, f"{len(lost)} retries found their attachment swept, e.g. {lost[0]}"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
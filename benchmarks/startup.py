@@ -0,0 +1,174 @@
+"""Cold start: import time and first-request latency of main.py.
+
+Import time is measured with ``python -X importtime`` on what each server
+mode imports before it can serve (flask: main.app, asgi: uvicorn and
+app.asgi, polling: the poller), in a fresh interpreter every run and with
+the interpreter's own startup imports left out.  Reports the total, the
+heaviest top-level imports, and fails if a mode imports one of the stacks
+that are meant to load on first use (the mail stack, requests, NumPy,
+aiohttp; Flask outside flask mode).
+
+Then main.py is started (--runs times per server mode, warm-up on and off)
+against a fake Bot API and SMTP sink, and the benchmark reports the
+median time from spawning the process until:
+
+  listen        the port accepts connections
+  1st response  POST /message (/start) has been answered
+  1st reply     the reply to it reached the Bot API
+  1st email     a text conversation started after that has been delivered
+
+Usage: python -m benchmarks.startup [--runs 5] [--modes flask,asgi,polling] [--top 5]
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.e2e import ROOT, flow_updates
+from benchmarks.fakes import FakeBotAPI, SMTPSink, free_port
+
+# What each mode imports before it serves its first update
+MODE_IMPORTS = {
+    'flask': 'import main; main.app',
+    'asgi': 'import uvicorn, app.asgi',
+    'polling': 'import app.controllers.poller',
+}
+# Loaded on first use (or by the warm-up thread), never at startup
+DEFERRED = ('requests', 'smtplib', 'email.mime', 'numpy', 'aiohttp', 'aiosmtplib')
+
+
+def importtime(statement, env, cwd):
+    """{top-level module: cumulative microseconds} imported by ``statement``, beyond a bare interpreter"""
+    def run(code):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=cwd,
+                                capture_output=True, text=True, check=True)
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules[name[1:].rstrip()] = int(cumulative)  # nested imports are indented further
+        return modules
+
+    bare = run('pass')
+    imported = run(statement)
+    return {name.strip(): us for name, us in imported.items()
+            if not name.startswith(' ') and name.strip() not in bare}, \
+        {name.strip() for name in imported}
+
+
+def wait_until(predicate, timeout=30, interval=0.002):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return time.perf_counter()
+        time.sleep(interval)
+    raise RuntimeError("timed out")
+
+
+def accepting(port):
+    with socket.socket() as sock:
+        return sock.connect_ex(('127.0.0.1', port)) == 0
+
+
+def post(port, update):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('POST', '/message', body=json.dumps(update), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def cold_start(mode, env, api, sink):
+    """Milliseconds from spawning main.py to each milestone of its first requests"""
+    workdir = tempfile.mkdtemp(prefix='startup-bot-')
+    port = free_port()
+    with api.lock:
+        api.sent.clear()
+    emails = sink.messages
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=workdir,
+                            env=dict(env, PORT=str(port), SERVER_MODE=mode, PYTHONPATH=ROOT),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        listen = wait_until(lambda: accepting(port))
+        status = post(port, {'update_id': 1, 'message': {'chat': {'id': 1}, 'text': '/start'}})
+        response = time.perf_counter()
+        assert status == 200, f"{mode}: POST /message answered {status}"
+        reply = wait_until(lambda: len(api.sent) > 0)
+        for i, message in enumerate(flow_updates('text', 2), start=2):
+            post(port, {'update_id': i, 'message': message})
+        email = wait_until(lambda: sink.messages > emails)
+        return {name: (t - start) * 1000 for name, t in
+                (('listen', listen), ('response', response), ('reply', reply), ('email', email))}
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', default='flask,asgi,polling')
+    parser.add_argument('--top', type=int, default=5, help="heaviest imports to list per mode")
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+
+    api = FakeBotAPI().start()
+    sink = SMTPSink().start()
+    env = dict(os.environ, BOT_TOKEN=api.token, TELEGRAM_API_URL=api.url,
+               SMTP_HOST='127.0.0.1', SMTP_PORT=str(sink.port), SMTP_USER='bot@example.com',
+               SMTP_PASS='', SMTP_STARTTLS='False', LOG_CONSOLE='False',
+               TELEGRAM_GLOBAL_RATE='0', TELEGRAM_CHAT_RATE='0', OUTBOX_COALESCE_WINDOW='0',
+               PYTHONPATH=ROOT)
+
+    failures = []
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    try:
+        print(f"{'mode':<9}{'import ms':>10}  heaviest imports")
+        for mode in modes:
+            totals = []
+            for _ in range(args.runs):
+                # No warm-up thread: its imports would be counted as the main thread's
+                top, imported = importtime(MODE_IMPORTS[mode], dict(env, STARTUP_WARMUP='False'), workdir)
+                totals.append(sum(top.values()) / 1000)
+            heaviest = sorted(top.items(), key=lambda item: -item[1])[:args.top]
+            print(f"{mode:<9}{statistics.median(totals):>10.1f}  "
+                  + ", ".join(f"{name} {us / 1000:.1f}" for name, us in heaviest))
+            unwanted = DEFERRED + (('flask',) if mode != 'flask' else ())
+            eager = sorted(name for name in imported
+                           if any(name == prefix or name.startswith(prefix + '.') for prefix in unwanted))
+            if eager:
+                failures.append(f"{mode} imports {', '.join(eager[:5])} at startup")
+
+        print(f"\n{'mode':<9}{'warm-up':<9}{'listen':>8}{'1st response':>14}{'1st reply':>11}{'1st email':>11}"
+              "   (ms since spawn, median)")
+        for mode in modes:
+            if mode == 'polling':
+                continue  # no HTTP endpoint to time
+            for warmup in ('True', 'False'):
+                runs = [cold_start(mode, dict(env, STARTUP_WARMUP=warmup), api, sink) for _ in range(args.runs)]
+                median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+                print(f"{mode:<9}{'on' if warmup == 'True' else 'off':<9}{median['listen']:>8.0f}"
+                      f"{median['response']:>14.0f}{median['reply']:>11.0f}{median['email']:>11.0f}")
+    finally:
+        api.stop()
+        sink.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    assert not failures, "; ".join(failures)
+
+
+if __name__ == '__main__':
+    main()
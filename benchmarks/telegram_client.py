@@ -0,0 +1,50 @@
+"""sendMessage calls/sec through TelegramClient versus a bare requests.post per call.
+
+Usage: python -m benchmarks.telegram_client [--messages 2000]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.fakes import FakeBotAPI, use_bot_api
+
+
+def run(send, messages, concurrency):
+    """Send `messages` from `concurrency` threads and return messages/sec"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(messages)))
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    api = FakeBotAPI().start()
+    use_bot_api(api)
+    from app.models.telegram_client import TelegramClient
+
+    url = f"{api.url}/bot{api.token}/sendMessage"
+
+    def per_call(i):
+        response = requests.post(url, json={'chat_id': i, 'text': 'benchmark'})
+        response.raise_for_status()
+
+    print(f"{'threads':>8} {'per-call':>12} {'client':>12} {'speedup':>8}")
+    try:
+        for concurrency in (1, 8, 32):
+            client = TelegramClient(pool_size=concurrency)
+            baseline = run(per_call, args.messages, concurrency)
+            rate = run(lambda i: client.send_message(i, 'benchmark'), args.messages, concurrency)
+            client.close()
+            print(f"{concurrency:>8} {baseline:>10.0f}/s {rate:>10.0f}/s {rate / baseline:>7.2f}x")
+    finally:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Load test POST /message on the Flask server and the ASGI server.
+
+Both servers run as child processes against a fake Bot API (with simulated
+network latency) and a local SMTP sink.  Each virtual user plays complete
+text-email conversations on its own chat.
+
+Usage: python -m benchmarks.webhook_load [--users 50] [--conversations 400] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmarks.fakes import free_port, spawn_fake, wait_for_port
+
+CONVERSATION = ['/send_mail', 'someone@example.com', '1', 'Load test body', 'skip']
+TOKEN = 'TEST:TOKEN'
+
+
+def start_server(mode, env):
+    port = free_port()
+    env = dict(env, PORT=str(port), SERVER_MODE=mode)
+    proc = subprocess.Popen([sys.executable, 'main.py'], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return proc, port
+
+
+async def drive(port, users, conversations):
+    """Run conversations from `users` concurrent chats; returns (latencies, elapsed)"""
+    url = f'http://127.0.0.1:{port}/message'
+    latencies = []
+    pending = iter(range(conversations))
+    update_ids = iter(range(1, 10 ** 9))
+
+    async def user(client):
+        for chat_id in pending:
+            for text in CONVERSATION:
+                update = {'update_id': next(update_ids),
+                          'message': {'chat': {'id': chat_id}, 'text': text}}
+                start = time.perf_counter()
+                async with client.post(url, json=update) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+    connector = aiohttp.TCPConnector(limit=users)
+    async with aiohttp.ClientSession(connector=connector) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client) for _ in range(users)))
+        return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--conversations', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="simulated Bot API round trip in seconds")
+    args = parser.parse_args()
+
+    api, api_port = spawn_fake('botapi', '--latency', str(args.latency))
+    sink, smtp_port = spawn_fake('smtp')
+    env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}',
+               TELEGRAM_POOL_SIZE=str(args.users), SMTP_HOST='127.0.0.1', SMTP_PORT=str(smtp_port),
+               SMTP_USER='bot@example.com', SMTP_PASS='', SMTP_STARTTLS='False')
+
+    print(f"{'mode':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for mode in ('flask', 'asgi'):
+            server, port = start_server(mode, env)
+            try:
+                latencies, elapsed = asyncio.run(drive(port, args.users, args.conversations))
+            finally:
+                server.terminate()
+                server.wait()
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[int(len(latencies) * 0.99)] * 1000
+            print(f"{mode:>6} {len(latencies) / elapsed:>8.0f} {p50:>8.1f} {p99:>8.1f}")
+    finally:
+        api.terminate()
+        sink.terminate()
+
+
+if __name__ == '__main__':
+    main()
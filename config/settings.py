@@ -9,3 +9,122 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 # You can add more configuration settings here as needed
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"  # Convert 'True'/'False' string to boolean
+
+# The mail and HTTP stacks are imported on first use.  STARTUP_WARMUP imports them in a background
+# thread once the server is up instead: worth it for workers started ahead of traffic, but it competes
+# with the first requests of a worker that gets traffic right away
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "False").lower() == "true"
+
+# SMTP server and connection pool
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASS = os.getenv("SMTP_PASS")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "True").lower() == "true"
+SMTP_DEBUG = os.getenv("SMTP_DEBUG", "False").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_POOL_IDLE_TIMEOUT = float(os.getenv("SMTP_POOL_IDLE_TIMEOUT", "60"))
+SMTP_POOL_MAX_MESSAGES = int(os.getenv("SMTP_POOL_MAX_MESSAGES", "100"))
+
+# Background email delivery
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "100"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "4"))
+
+# Telegram Bot API client
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip('/')
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "10"))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "30"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+# Largest file download when Telegram does not report the size (the public Bot API serves up to 20 MB)
+TELEGRAM_DOWNLOAD_MAX_MB = int(os.getenv("TELEGRAM_DOWNLOAD_MAX_MB", "20"))
+
+# Outbound replies: Telegram allows about 30 messages/s in total, 1/s per chat and 20/min per group
+# (0 = no limit); replies to one chat queued within the coalesce window go out as one message
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+OUTBOX_COALESCE_WINDOW = float(os.getenv("OUTBOX_COALESCE_WINDOW", "0.05"))
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "4"))
+
+# Conversation session storage: "memory" (this process), "shared" (a session server that every
+# worker on the host reaches over a Unix socket; gunicorn.conf.py starts one) or "redis"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_SOCKET = os.getenv("SESSION_SOCKET", "data/sessions.sock")
+SESSION_AUTHKEY = os.getenv("SESSION_AUTHKEY", "")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Upload spool: "disk", "tmpfs" (RAM) or "memory" (files up to SPOOL_MEMORY_MAX_KB on tmpfs, larger on disk).
+# Uploads that would exceed the quota are refused (0 = no quota); the sweeper removes abandoned files
+SPOOL_BACKEND = os.getenv("SPOOL_BACKEND", "disk").lower()
+SPOOL_DIR = os.getenv("SPOOL_DIR", "temp_files")
+SPOOL_TMPFS_DIR = os.getenv("SPOOL_TMPFS_DIR", "/dev/shm/tsb-spool")
+SPOOL_MEMORY_MAX_KB = int(os.getenv("SPOOL_MEMORY_MAX_KB", "1024"))
+SPOOL_QUOTA_MB = int(os.getenv("SPOOL_QUOTA_MB", "1024"))
+SPOOL_SWEEP_INTERVAL = float(os.getenv("SPOOL_SWEEP_INTERVAL", "60"))
+SPOOL_GRACE = int(os.getenv("SPOOL_GRACE", "600"))
+
+# Long-polling (getUpdates) ingestion mode
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))
+POLL_LIMIT = int(os.getenv("POLL_LIMIT", "100"))
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "8"))
+POLL_OFFSET_FILE = os.getenv("POLL_OFFSET_FILE", "data/update_offset")
+
+# Per-chat ordered update dispatcher (0 workers = handle updates inline in the request)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "0"))
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "1000"))
+
+# Reminder persistence and the longest delay /remindme accepts
+REMINDER_DB = os.getenv("REMINDER_DB", "data/reminders.db")
+REMINDER_MAX_DAYS = int(os.getenv("REMINDER_MAX_DAYS", "365"))
+
+# Bulk mail: recipient cap and how much encoded attachment is kept in memory before spilling to disk
+BULK_MAX_RECIPIENTS = int(os.getenv("BULK_MAX_RECIPIENTS", "1000"))
+BULK_SPOOL_MEMORY = int(os.getenv("BULK_SPOOL_MEMORY", str(16 * 1024 * 1024)))
+
+# Downloaded attachment cache (0 MB disables it); optionally keeps the base64 MIME body too
+ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", "data/attachment_cache")
+ATTACHMENT_CACHE_MAX_MB = int(os.getenv("ATTACHMENT_CACHE_MAX_MB", "512"))
+ATTACHMENT_CACHE_ENCODED = os.getenv("ATTACHMENT_CACHE_ENCODED", "True").lower() == "true"
+
+# Attachment preprocessing before send, in a process pool (0 workers = on the delivery thread):
+# photos over the target size are downscaled/recompressed (needs Pillow), large documents of the
+# listed types are zipped, and attachments still over PREPROCESS_SPLIT_MB go out in several emails
+# (18 MB is ~24 MB once base64-encoded, under the common 25 MB message limit; 0 = never split)
+PREPROCESS_ATTACHMENTS = os.getenv("PREPROCESS_ATTACHMENTS", "False").lower() == "true"
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+PREPROCESS_TIMEOUT = float(os.getenv("PREPROCESS_TIMEOUT", "60"))
+PREPROCESS_IMAGE_TARGET_KB = int(os.getenv("PREPROCESS_IMAGE_TARGET_KB", "1024"))
+PREPROCESS_IMAGE_MAX_SIDE = int(os.getenv("PREPROCESS_IMAGE_MAX_SIDE", "2560"))
+PREPROCESS_IMAGE_QUALITY = int(os.getenv("PREPROCESS_IMAGE_QUALITY", "85"))
+PREPROCESS_ZIP_TYPES = os.getenv("PREPROCESS_ZIP_TYPES", ".txt,.csv,.docx").lower().split(',')
+PREPROCESS_ZIP_MIN_KB = int(os.getenv("PREPROCESS_ZIP_MIN_KB", "256"))
+PREPROCESS_SPLIT_MB = int(os.getenv("PREPROCESS_SPLIT_MB", "18"))
+
+# Logging: JSON lines written by a background thread; DEBUG/INFO records (and spans) can be sampled
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG else "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "logs/bot.jsonl")
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "True").lower() == "true"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Metrics: with several worker processes, each writes its snapshot to METRICS_DIR and /metrics merges them
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Analytics store LOG_FILE and ANALYTICS_SOURCES (more logs, captured update streams) are ingested
+# into, see app/analytics.py; files are read incrementally through mmap windows of ANALYTICS_WINDOW_MB
+ANALYTICS_DB = os.getenv("ANALYTICS_DB", "data/analytics.db")
+ANALYTICS_SOURCES = [path for path in os.getenv("ANALYTICS_SOURCES", "").split(',') if path]
+ANALYTICS_WINDOW_MB = int(os.getenv("ANALYTICS_WINDOW_MB", "64"))
+
+# Journal of incoming updates: dedup of redelivered update_ids and session replay after a crash ("" disables)
+UPDATE_JOURNAL = os.getenv("UPDATE_JOURNAL", "data/updates.db")
+JOURNAL_SYNC = os.getenv("JOURNAL_SYNC", "full").lower()  # full, normal or off
+JOURNAL_DEDUP_WINDOW = int(os.getenv("JOURNAL_DEDUP_WINDOW", "86400"))
+JOURNAL_COMPACT_INTERVAL = float(os.getenv("JOURNAL_COMPACT_INTERVAL", "300"))
@@ -0,0 +1,127 @@
+"""Production server: gunicorn with preforked workers
+
+    gunicorn -c gunicorn.conf.py main:app        (or SERVER_MODE=prefork python main.py)
+
+WEB_WORKERS processes (default: one per CPU) with WEB_THREADS threads each.
+Workers import the app after they are forked (no preload_app), so every
+thread, Bot API and SMTP connection pool and SQLite connection belongs to
+the worker that uses it, and ``kill -HUP <master>`` boots workers on the new
+code, then lets the old ones finish their requests, queued emails and
+replies before they exit.
+
+State the workers share: sessions live in a session server the master
+starts (SESSION_BACKEND=shared, over a Unix socket - no external service);
+the update journal, reminders, spool and attachment cache are on disk and
+safe to use from several processes; metrics are merged from METRICS_DIR.
+Telegram's global flood limit is per bot, so it is split between the
+workers.
+
+This file runs in the master, which must not import the app: modules it
+loaded (and their threads) would be inherited half-dead by every worker.
+"""
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = f"{os.getenv('HOST', '127.0.0.1')}:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv('WEB_WORKERS', '0')) or multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+keepalive = 5
+timeout = 60
+graceful_timeout = 30
+preload_app = False
+
+# Settings the workers inherit.  The master keeps its environment across
+# reloads, so every value is only filled in when it is missing.
+if workers > 1 and os.getenv('SESSION_BACKEND', 'memory').lower() == 'memory':
+    os.environ['SESSION_BACKEND'] = 'shared'
+os.environ.setdefault('SESSION_SOCKET', os.path.join(tempfile.gettempdir(), f"tsb-sessions-{os.getpid()}.sock"))
+os.environ.setdefault('SESSION_AUTHKEY', secrets.token_hex(16))
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"tsb-metrics-{os.getpid()}"))
+
+
+def _session_server_up():
+    with socket.socket(socket.AF_UNIX) as sock:
+        return sock.connect_ex(os.environ['SESSION_SOCKET']) == 0
+
+
+def _start_session_server(server):
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    process = subprocess.Popen([sys.executable, main], env=dict(os.environ, SERVER_MODE='sessions'),
+                               start_new_session=True)
+    # This file is re-executed on reload, the environment is not: remember the server there
+    os.environ['SESSION_SERVER_PID'] = str(process.pid)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and process.poll() is None:
+        if _session_server_up():
+            server.log.info("Session server running (pid %s) on %s", process.pid, os.environ['SESSION_SOCKET'])
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"Session server did not start on {os.environ['SESSION_SOCKET']}")
+
+
+def _clear_metrics():
+    # Snapshots of a previous run would be merged into this one's metrics
+    directory = os.environ['METRICS_DIR']
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+
+
+def on_starting(server):
+    _clear_metrics()
+    if os.environ.get('SESSION_BACKEND') == 'shared':
+        _start_session_server(server)
+
+
+def pre_fork(server, worker):
+    # A worker is about to be (re)spawned: bring the session server back first if it died
+    if os.environ.get('SESSION_BACKEND') == 'shared' and not _session_server_up():
+        server.log.warning("Session server is not running, restarting it")
+        _start_session_server(server)
+
+
+def post_fork(server, worker):
+    # In the new worker, before it imports the app and reads the settings
+    rate = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+    os.environ['TELEGRAM_GLOBAL_RATE'] = str(rate / server.num_workers)
+
+
+def worker_exit(server, worker):
+    # Also called in the master for workers that are already gone; only a worker that loaded the app drains
+    handlers = sys.modules.get('app.controllers.handlers')
+    if handlers is None:
+        return
+    routes = sys.modules.get('app.routes')
+    if routes is not None and routes.dispatcher is not None:
+        routes.dispatcher.join()
+    if not handlers.shutdown(timeout=graceful_timeout / 2):
+        server.log.warning("Worker %s exited with emails or replies still queued", worker.pid)
+
+
+def on_exit(server):
+    # The session server would also exit by itself once the master is gone
+    pid = os.environ.pop('SESSION_SERVER_PID', None)
+    if pid is not None:
+        try:
+            os.kill(int(pid), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    if os.path.exists(os.environ['SESSION_SOCKET']):
+        os.remove(os.environ['SESSION_SOCKET'])
+    _clear_metrics()
+    try:
+        os.rmdir(os.environ['METRICS_DIR'])
+    except OSError:
+        pass  # not created, or holding files that are not ours
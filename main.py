@@ -1,12 +1,51 @@
-from flask import Flask
-from app.routes import app as bot_routes
 import os
+import sys
 
-app = Flask(__name__)
 
-# Register routes
-app.register_blueprint(bot_routes)
+def create_app():
+    """The Flask app serving the bot's routes"""
+    from flask import Flask
+    from app.routes import app as bot_routes
+
+    flask_app = Flask(__name__)
+
+    # Register routes
+    flask_app.register_blueprint(bot_routes)
+    return flask_app
+
+
+def __getattr__(name):
+    # Flask is only imported when the app is asked for (`gunicorn main:app`, or
+    # flask mode below), so the ASGI and polling modes start without it
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5002))
-    app.run(port=port)
\ No newline at end of file
+    mode = os.environ.get('SERVER_MODE', 'flask')
+    if mode == 'prefork':
+        # Production: gunicorn with preforked workers, configured by gunicorn.conf.py
+        config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', config, 'main:app'])
+    elif mode == 'sessions':
+        # The session server the prefork workers share (gunicorn.conf.py starts it)
+        from app.models.session_store import serve_sessions
+        serve_sessions()
+    elif mode == 'asgi':
+        # Async server mode: same /message contract, served by uvicorn
+        import uvicorn
+        uvicorn.run('app.asgi:app', port=port)
+    elif mode == 'polling':
+        # Pull updates with getUpdates instead of receiving webhooks (works behind NAT)
+        from app.controllers.poller import UpdatePoller
+        poller = UpdatePoller()
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            poller.stop()
+    else:
+        create_app().run(port=port)
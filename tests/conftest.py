@@ -0,0 +1,16 @@
+import os
+import tempfile
+
+# Settings are read at import time: keep the bot's files out of the working tree
+_workdir = tempfile.mkdtemp(prefix='tsb-tests-')
+for name, value in {
+    'LOG_FILE': os.path.join(_workdir, 'bot.jsonl'),
+    'LOG_CONSOLE': 'False',
+    'UPDATE_JOURNAL': '',
+    'REMINDER_DB': os.path.join(_workdir, 'reminders.db'),
+    'SPOOL_DIR': os.path.join(_workdir, 'spool'),
+    'ATTACHMENT_CACHE_DIR': os.path.join(_workdir, 'attachment_cache'),
+    'ANALYTICS_DB': os.path.join(_workdir, 'analytics.db'),
+    'POLL_OFFSET_FILE': os.path.join(_workdir, 'update_offset'),
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,33 @@
+import re
+
+import pytest
+
+from app.models.calculator import CalculationError, evaluate
+
+
+@pytest.mark.parametrize('expression, result', [
+    ('sum(x for x in 1..10)', 55),
+    ('sum(x for x in -3..3)', 0),
+    ('sum(x for x in 1..2*5)', 55),
+    ('sum(sum(y for y in 1..x) for x in 1..100)', 171700),
+    ('sum(x**2 for x in 1..1e6)', 333333833333500000),
+    ('sum(x for x in 1..10**20)', 10 ** 20 * (10 ** 20 + 1) // 2),
+    ('sum(x**3 for x in range(10**7, 0, -2))', sum(x ** 3 for x in range(10 ** 7, 0, -2))),
+    ('mean(x for x in 1..1e9)', 500000000.5),
+    ('len(x for x in 1..1e12)', 10 ** 12),
+])
+def test_ranges(expression, result):
+    assert evaluate(expression) == result
+
+
+@pytest.mark.parametrize('expression, message', [
+    ('factorial(2.5)', "factorial() takes a whole number"),
+    ('sum(x for x in 1.5..3)', "Range bounds must be whole numbers"),
+    ('(1..3) * 2', "Ranges can only be looped over"),
+    ('sum(x for x in 1..n)', "Unknown name 'n'"),
+    ('max(x for x in 1..1e12)', "Range is too large"),
+    ('1 | 2', "Unsupported operator"),
+])
+def test_errors_say_what_is_wrong(expression, message):
+    with pytest.raises(CalculationError, match=re.escape(message)):
+        evaluate(expression)
@@ -0,0 +1,61 @@
+import random
+import threading
+import time
+
+from app.controllers.dispatcher import Dispatcher
+
+
+def interleaved_updates(chats, per_chat, seed=42):
+    """Every chat's numbered updates, shuffled across chats but in order within each chat"""
+    order = [chat_id for chat_id in range(chats) for _ in range(per_chat)]
+    random.Random(seed).shuffle(order)
+    next_seq = [0] * chats
+    updates = []
+    for chat_id in order:
+        updates.append({'message': {'chat': {'id': chat_id}, 'text': str(next_seq[chat_id])}})
+        next_seq[chat_id] += 1
+    return updates
+
+
+def test_updates_of_a_chat_are_handled_in_order():
+    chats, per_chat = 500, 8
+    seen = [[] for _ in range(chats)]
+    active = set()
+    overlaps = []
+    lock = threading.Lock()
+    rng = random.Random(7)
+
+    def handler(update):
+        chat_id = update['message']['chat']['id']
+        with lock:
+            if chat_id in active:
+                overlaps.append(chat_id)
+            active.add(chat_id)
+        if rng.random() < 0.05:
+            time.sleep(0.001)  # an occasional slow update must not let later ones overtake it
+        seen[chat_id].append(int(update['message']['text']))
+        with lock:
+            active.discard(chat_id)
+
+    dispatcher = Dispatcher(handler=handler, workers=16, queue_size=64)
+    for update in interleaved_updates(chats, per_chat):
+        assert dispatcher.submit(update, timeout=None)
+    dispatcher.join()
+
+    assert not overlaps, f"chats handled on two threads at once: {sorted(set(overlaps))[:10]}"
+    out_of_order = [chat_id for chat_id in range(chats) if seen[chat_id] != list(range(per_chat))]
+    assert not out_of_order, f"chat {out_of_order[0]} saw {seen[out_of_order[0]]}"
+    assert sum(shard.processed for shard in dispatcher.shards) == chats * per_chat
+
+
+def test_updates_without_a_chat_go_to_the_first_shard():
+    handled = []
+    dispatcher = Dispatcher(handler=handled.append, workers=4, queue_size=8)
+    malformed = [{'update_id': 1}, {'message': {}}, {'message': {'text': 'hi'}}, {'message': {'chat': None}},
+                 {'message': {'chat': {'id': [1]}}}, {'message': 'text'}]
+    for update in malformed:
+        assert dispatcher.submit(update)
+    dispatcher.join()
+
+    assert handled == malformed
+    assert dispatcher.shards[0].processed == len(malformed)
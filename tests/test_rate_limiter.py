@@ -0,0 +1,85 @@
+import threading
+import time
+
+from app.models.rate_limiter import OutboundScheduler
+from app.models.telegram_client import TelegramAPIError
+
+# Too long for two to be coalesced into one message, so every reply is one send
+LENGTH = 3000
+
+
+def reply(chat_id, i):
+    return f"{chat_id}:{i}:".ljust(LENGTH, '.')
+
+
+class RecordingAPI:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sends = []  # (monotonic time, chat_id, text)
+
+    def send(self, chat_id, text):
+        with self.lock:
+            self.sends.append((time.monotonic(), chat_id, text))
+
+    def times(self, chat_id=None):
+        with self.lock:
+            return sorted(t for t, c, _ in self.sends if chat_id is None or c == chat_id)
+
+    def texts(self, chat_id):
+        with self.lock:
+            return [text for _, c, text in self.sends if c == chat_id]
+
+
+def assert_within(times, rate, capacity, slack=0.02):
+    """No stretch of sends goes faster than the token bucket allows"""
+    for i in range(len(times)):
+        for j in range(i + 1, len(times)):
+            allowed = capacity + rate * (times[j] - times[i] + slack)
+            assert j - i + 1 <= allowed, f"{j - i + 1} sends in {times[j] - times[i]:.3f}s, bucket allows {allowed:.2f}"
+
+
+def test_sends_never_exceed_the_chat_group_and_global_limits():
+    api = RecordingAPI()
+    scheduler = OutboundScheduler(api.send, global_rate=40, chat_rate=10, chat_burst=3, group_rate=5,
+                                  coalesce_window=0, senders=4)
+    chats = list(range(1, 9)) + [-100, -200]
+    replies = 6
+    try:
+        for i in range(replies):
+            for chat_id in chats:
+                assert scheduler.submit(chat_id, reply(chat_id, i))
+        assert scheduler.flush(timeout=30)
+    finally:
+        scheduler.close(timeout=5)
+
+    assert len(api.times()) == len(chats) * replies
+    assert_within(api.times(), rate=40, capacity=1)
+    for chat_id in chats:
+        assert api.texts(chat_id) == [reply(chat_id, i) for i in range(replies)]
+        if chat_id < 0:
+            assert_within(api.times(chat_id), rate=5, capacity=1)
+        else:
+            assert_within(api.times(chat_id), rate=10, capacity=3)
+
+
+def test_flood_control_delays_replies_without_losing_them():
+    api = RecordingAPI()
+    throttled = []
+
+    def send(chat_id, text):
+        if not throttled:
+            throttled.append(time.monotonic())
+            raise TelegramAPIError("Too Many Requests", error_code=429, retry_after=0.3)
+        api.send(chat_id, text)
+
+    scheduler = OutboundScheduler(send, global_rate=0, chat_rate=0, coalesce_window=0, senders=2)
+    try:
+        for i in range(3):
+            scheduler.submit(7, reply(7, i))
+        assert scheduler.flush(timeout=10)
+    finally:
+        scheduler.close(timeout=5)
+
+    assert api.texts(7) == [reply(7, i) for i in range(3)]
+    assert api.times(7)[0] - throttled[0] >= 0.3
+    assert scheduler.stats()['throttled'] == 1 and scheduler.stats()['dropped'] == 0
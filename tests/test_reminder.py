@@ -0,0 +1,24 @@
+import threading
+
+from app.models.reminder import ReminderScheduler
+
+
+def test_a_reminder_is_delivered_through_its_own_send_function(tmp_path):
+    delivered = []
+    done = threading.Event()
+
+    def record(via):
+        def send(chat_id, text):
+            delivered.append((via, chat_id, text))
+            if len(delivered) == 2:
+                done.set()
+        return send
+
+    scheduler = ReminderScheduler(send_func=record('scheduler'), db_path=str(tmp_path / 'reminders.db'))
+    scheduler.schedule(1, 'stretch', 0.05)
+    scheduler.schedule(2, 'call mom', 0.05, send_func=record('own'))
+    cancelled = scheduler.schedule(3, 'never', 0.05, send_func=record('cancelled'))
+    assert scheduler.cancel(cancelled)
+
+    assert done.wait(5)
+    assert sorted(delivered) == [('own', 2, 'Reminder: call mom'), ('scheduler', 1, 'Reminder: stretch')]
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.models.spool import Spool, SpoolFull
+from utils.metrics import directory_size
+
+
+@pytest.fixture
+def make_spool(tmp_path):
+    def make(**options):
+        options.setdefault('sweep_interval', 3600)
+        return Spool(backend='disk', directory=str(tmp_path / 'spool'), **options)
+    return make
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+
+def test_uploads_over_the_quota_are_refused_until_space_is_released(make_spool):
+    spool = make_spool(quota=1000)
+    first = spool.allocate(1, 'a.pdf', 600)
+    with pytest.raises(SpoolFull):
+        spool.allocate(2, 'b.pdf', 600)
+    spool.allocate(2, 'c.pdf', 400)
+    with pytest.raises(SpoolFull):
+        spool.allocate(3, 'unknown-size.pdf')  # an unknown size still needs a byte
+
+    spool.release(first)
+    assert spool.usage() == 400
+    spool.allocate(2, 'b.pdf', 600)
+
+
+def test_settle_accounts_the_real_size(make_spool):
+    spool = make_spool(quota=1000)
+    path = spool.allocate(1, 'photo.jpg', 100)
+    write(path, 700)
+    spool.settle(path)
+    assert spool.usage() == 700
+    with pytest.raises(SpoolFull):
+        spool.allocate(2, 'doc.pdf', 400)
+
+
+def test_concurrent_uploads_never_take_the_disk_over_the_quota(make_spool):
+    quota, size = 64 * 1024, 8 * 1024
+    spool = make_spool(quota=quota)
+    peak = [0]
+    refused = [0]
+    lock = threading.Lock()
+
+    def user(chat_id):
+        for _ in range(40):
+            try:
+                path = spool.allocate(chat_id, 'report.pdf', size)
+            except SpoolFull:
+                with lock:
+                    refused[0] += 1
+                continue
+            write(path, size)
+            spool.settle(path)
+            with lock:
+                peak[0] = max(peak[0], directory_size(spool.directory))
+            spool.release(path)
+
+    threads = [threading.Thread(target=user, args=(chat_id,)) for chat_id in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert 0 < peak[0] <= quota
+    assert refused[0] > 0  # 16 users of 8 KiB each do not fit in 64 KiB at once
+    assert spool.usage() == 0 and directory_size(spool.directory) == 0
+
+
+def test_sweep_reclaims_an_abandoned_upload_with_preprocessor_output(make_spool):
+    spool = make_spool(quota=10 ** 6, grace=60)
+    path = spool.allocate(1, 'photo.png', 5000)
+    write(path, 5000)
+    spool.settle(path)
+    processed = os.path.join(os.path.dirname(path), 'processed')
+    os.makedirs(processed)
+    write(os.path.join(processed, 'photo.jpg'), 1000)
+    old = time.time() - 3600
+    os.utime(os.path.dirname(path), (old, old))
+
+    assert spool.sweep() == 6000
+    assert not os.path.exists(os.path.dirname(path))
+    assert spool.usage() == 0
+    assert spool.sweep() == 0
+
+
+def test_sweep_keeps_uploads_that_are_in_use(make_spool):
+    claimed = set()
+    spool = make_spool(quota=10 ** 6, grace=0, in_use=lambda chat_id, path: path in claimed)
+    path = spool.allocate(1, 'report.pdf', 100)
+    write(path, 100)
+    spool.settle(path)
+    claimed.add(path)
+    old = time.time() - 3600
+    os.utime(os.path.dirname(path), (old, old))
+
+    assert spool.sweep() == 0 and os.path.exists(path)
+    claimed.clear()
+    assert spool.sweep() == 100 and not os.path.exists(path)
+
+
+def test_release_removes_the_preprocessor_output_with_the_upload(make_spool):
+    spool = make_spool(quota=10 ** 6)
+    path = spool.allocate(1, 'data.csv', 100)
+    write(path, 100)
+    os.makedirs(os.path.join(os.path.dirname(path), 'processed'))
+    write(os.path.join(os.path.dirname(path), 'processed', 'data.csv.zip'), 10)
+
+    spool.release(path)
+    assert not os.path.exists(os.path.dirname(path))
@@ -0,0 +1,60 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.models.telegram_client import FileTooLarge, TelegramClient
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    """/file/bot<token>/<size>[/unannounced]: <size> bytes, with or without a Content-Length"""
+
+    def do_GET(self):
+        parts = self.path.split('/')
+        size = int(parts[3])
+        self.send_response(200)
+        if parts[-1] != 'unannounced':
+            self.send_header('Content-Length', str(size))
+        self.end_headers()
+        for offset in range(0, size, 4096):
+            self.wfile.write(b'x' * min(4096, size - offset))
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # the client hangs up on a file that is too large
+
+
+@pytest.fixture(scope='module')
+def client():
+    server = _Server(('127.0.0.1', 0), _FileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield TelegramClient(token='T', base_url=f'http://127.0.0.1:{server.server_address[1]}', max_retries=0)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('path', ['50000', '50000/unannounced'])
+def test_download_within_the_limit(client, tmp_path, path):
+    destination = tmp_path / 'file'
+    assert client.download_file(path, str(destination), chunk_size=4096, max_size=50000) == 50000
+    assert destination.stat().st_size == 50000
+
+
+@pytest.mark.parametrize('path', ['50001', '1000000/unannounced'])
+def test_download_stops_past_the_limit(client, tmp_path, path):
+    destination = tmp_path / 'file'
+    with pytest.raises(FileTooLarge):
+        client.download_file(path, str(destination), chunk_size=4096, max_size=50000)
+    assert not destination.exists() or destination.stat().st_size <= 50000
+
+
+def test_unknown_size_is_capped_by_the_setting(client, tmp_path, monkeypatch):
+    monkeypatch.setattr('app.models.telegram_client.TELEGRAM_DOWNLOAD_MAX_MB', 1)
+    with pytest.raises(FileTooLarge):
+        client.download_file(f'{1024 * 1024 + 1}/unannounced', str(tmp_path / 'file'))
@@ -0,0 +1,65 @@
+"""Singletons built on first use, so importing a module stays cheap
+
+A module-level object whose construction pulls in a heavy stack (the mail
+sender imports smtplib and the email package, for instance) is wrapped in
+``Lazy``: the factory, and the imports inside it, run the first time the
+object is used instead of when the module is imported.  A cold start then
+only pays for what its first requests need.
+"""
+import threading
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class Lazy:
+    """Stands in for ``factory()``, which is called on first attribute access
+
+    Reads and writes of attributes go to the real object, so callers (and
+    benchmarks that patch its methods) cannot tell the difference.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def resolve(self):
+        """The real object, built now if it has not been yet"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, '_instance', self._factory())
+        return self._instance
+
+    @property
+    def resolved(self):
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+    def __repr__(self):
+        return repr(self._instance) if self._instance is not None else f"<Lazy {self._factory!r}>"
+
+
+def in_background(name, *steps):
+    """Run ``steps`` (callables) one after another in a daemon thread; returns the thread
+
+    For work deferred past startup that is still worth doing before the
+    first request needs it.  A failing step is logged and skipped: whatever
+    it prepared happens on first use instead.
+    """
+    def run():
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                log.exception("Background step failed", extra={'fields': {'thread': name}})
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,187 @@
+"""Structured logging for the bot: JSON lines, written off the request path.
+
+Records go through a QueueHandler into a bounded queue and are formatted and
+written by a QueueListener thread, so a slow disk or console never stalls a
+handler; when the queue is full the record is dropped and counted instead.
+DEBUG and INFO records can be sampled with LOG_SAMPLE_RATE; warnings and
+errors are always kept.
+
+    log = get_logger(__name__)
+    log.info("email queued", extra={'fields': {'chat_id': chat_id}})
+    with span(log, 'smtp.send', to=to_email):
+        ...
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from config.settings import LOG_LEVEL, LOG_FILE, LOG_CONSOLE, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE
+
+ROOT_LOGGER = 'tsb'
+
+_listener = None
+_queue_handler = None
+_sample_rate = LOG_SAMPLE_RATE
+_lock = threading.Lock()
+_plain_formatter = logging.Formatter()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg plus any extra fields"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, default=str, separators=(',', ':'))
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of DEBUG/INFO records; spans decide for themselves"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1 or getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking on a full queue"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback now (args and exc_info may not
+        # survive the thread hop) but leave the JSON encoding to the writer
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _plain_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=LOG_LEVEL, log_file=LOG_FILE, console=LOG_CONSOLE,
+                      sample_rate=LOG_SAMPLE_RATE, queue_size=LOG_QUEUE_SIZE):
+    """Attach the queue handler and start the writer thread (idempotent)"""
+    global _listener, _queue_handler, _sample_rate
+    with _lock:
+        if _listener is not None:
+            return
+        _sample_rate = sample_rate
+        formatter = JSONFormatter()
+        handlers = []
+        if log_file:
+            directory = os.path.dirname(log_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handlers.append(logging.FileHandler(log_file))
+        if console:
+            handlers.append(logging.StreamHandler(sys.stderr))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _queue_handler.addFilter(SamplingFilter(sample_rate))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level)
+        root.propagate = False
+        root.handlers[:] = [_queue_handler] if handlers else [logging.NullHandler()]
+
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+            logging.getLogger(ROOT_LOGGER).handlers.clear()
+
+
+def dropped_records():
+    """Number of records dropped because the queue was full"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def get_logger(name):
+    """Return a logger under the bot's root logger, configuring logging on first use"""
+    if _listener is None:
+        configure_logging()
+    if name.startswith('app.') or name.startswith('utils.'):
+        name = name.split('.', 1)[1]
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class span:
+    """Time one stage and log it as a record with ``duration_ms``
+
+    The level check and sampling decision happen on entry, so a span that
+    will not be logged costs one attribute lookup and no clock reads.
+    Exceptions are recorded in the ``error`` field and re-raised.
+    """
+
+    __slots__ = ('logger', 'name', 'level', 'fields', 'start')
+
+    def __init__(self, logger, name, level=logging.INFO, sample_rate=None, **fields):
+        self.logger = logger
+        self.name = name
+        self.level = level
+        self.fields = fields
+        self.start = None
+        if logger.isEnabledFor(level):
+            rate = _sample_rate if sample_rate is None else sample_rate
+            if rate >= 1 or random.random() < rate:
+                self.start = 0.0
+
+    def __enter__(self):
+        if self.start is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is None:
+            return False
+        fields = self.fields
+        fields['span'] = self.name
+        fields['duration_ms'] = round((time.perf_counter() - self.start) * 1000, 3)
+        if exc_type is not None:
+            fields['error'] = f"{exc_type.__name__}: {exc}"
+        self.logger.log(self.level, self.name, extra={'fields': fields, 'sampled': True})
+        return False
@@ -0,0 +1,407 @@
+"""Prometheus-style counters, histograms and gauges, cheap enough to leave on.
+
+Each thread records into its own dict, so an increment or observation is a
+couple of dict/list operations with no lock; the per-thread values are only
+summed when /metrics is scraped.  Values recorded by threads that have since
+exited are folded into a shared total so they are not lost.
+
+With several worker processes (gunicorn), set METRICS_DIR: every process
+writes its snapshot to ``<METRICS_DIR>/<pid>.json`` every
+METRICS_FLUSH_INTERVAL seconds, and a scrape on any worker merges all of
+them.  Counters and histograms are summed; gauges are summed or maxed per
+metric, and gauges of workers that are no longer running are ignored.
+
+    UPDATES = Counter('tsb_updates_total', 'Updates handled', ['step'])
+    UPDATES.inc('waiting_for_email')
+    with SEND_SECONDS.time('text'):
+        ...
+"""
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from config.settings import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds: from a cached dict lookup up to a slow SMTP transaction
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+class Registry:
+    """The set of metrics exposed on /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._exit_hook = False
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self.metrics):
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        """Forget all recorded values (a forked worker must not re-report its parent's)"""
+        self._lock = threading.Lock()
+        for metric in self.metrics:
+            metric.reset()
+        if self._flusher is not None:
+            # Threads do not survive fork; the child gets its own flusher
+            self._flusher = None
+            self.start_flusher()
+
+    def snapshot(self):
+        """JSON-friendly view of every metric: {name: {type, help, labels, mode, samples}}"""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def write_snapshot(self, directory=None):
+        """Write this process's snapshot to <directory>/<pid>.json (atomically)"""
+        directory = directory or METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'metrics': self.snapshot()}, f)
+        os.replace(tmp_path, path)
+
+    def start_flusher(self, interval=METRICS_FLUSH_INTERVAL):
+        """Write the snapshot every ``interval`` seconds and at exit (multi-worker mode only)"""
+        if not METRICS_DIR:
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+
+            def flush():
+                while True:
+                    time.sleep(interval)
+                    self.write_snapshot()
+
+            self._flusher = threading.Thread(target=flush, name='metrics-flush', daemon=True)
+            self._flusher.start()
+            if not self._exit_hook:
+                self._exit_hook = True
+                atexit.register(self.write_snapshot)
+
+    def collect(self):
+        """Snapshots to expose: just ours, or every worker's when METRICS_DIR is set"""
+        if not METRICS_DIR:
+            return [self.snapshot()]
+        self.write_snapshot()
+        snapshots = []
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed or being replaced right now
+            metrics = data['metrics']
+            if not _pid_alive(data['pid']):
+                metrics = {name: m for name, m in metrics.items() if m['type'] != 'gauge'}
+            snapshots.append(metrics)
+        return snapshots
+
+    def render(self):
+        """The Prometheus text exposition of collect()"""
+        return render(merge(self.collect()))
+
+
+REGISTRY = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Metric:
+    """Per-thread storage shared by counters and histograms"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []    # (thread, values) for every thread that recorded something
+        self._retired = {}   # values of threads that have exited
+        if registry is not None:
+            registry.register(self)
+
+    def _values(self):
+        """This thread's value dict, created on first use"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+                if len(self._shards) % 64 == 0:
+                    self._retire_locked()
+            self._local.values = values
+            return values
+
+    def _retire_locked(self):
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                for key, value in values.items():
+                    self._merge_value(self._retired, key, value)
+        self._shards = alive
+
+    def _merge_value(self, target, key, value):
+        raise NotImplementedError
+
+    def reset(self):
+        # Called in a freshly forked child: the old lock may be held by a thread that no longer exists
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+
+    def _totals(self):
+        with self._lock:
+            self._retire_locked()
+            totals = {}
+            for key, value in self._retired.items():
+                self._merge_value(totals, key, value)
+            for _, values in self._shards:
+                for key, value in values.copy().items():  # dict.copy() is atomic under the GIL
+                    self._merge_value(totals, key, value)
+        return totals
+
+    def _zero(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        totals = self._totals()
+        if not totals and not self.labelnames:
+            totals[()] = self._zero()  # an unlabelled metric is exposed even before its first use
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labels': list(self.labelnames),
+            'samples': [[list(key), value] for key, value in totals.items()],
+        }
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by labels"""
+
+    type = 'counter'
+
+    def inc(self, *labels):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + 1
+
+    def add(self, amount, *labels):
+        values = self._values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def _merge_value(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def _zero(self):
+        return 0
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their sum and count
+
+    Values are stored as ``[bucket counts..., +Inf count, sum, count]`` and
+    only made cumulative when rendered.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, *labels):
+        values = self._values()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 3)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block in seconds"""
+        return _Timer(self, labels)
+
+    def _merge_value(self, target, key, value):
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                current[i] += v
+
+    def _zero(self):
+        return [0] * (len(self.buckets) + 3)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+class Gauge:
+    """A value computed at scrape time by ``func``
+
+    ``func`` returns a number, or a dict mapping label tuples to numbers.
+    ``mode`` says how workers combine: 'sum' for per-process state (in-memory
+    sessions), 'max' for state they share (a disk directory, Redis).
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, func, labelnames=(), mode='sum', registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        self.mode = mode
+        if registry is not None:
+            registry.register(self)
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        try:
+            value = self.func()
+        except Exception:
+            value = {}
+        if not isinstance(value, dict):
+            value = {(): value}
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labels': list(self.labelnames),
+            'mode': self.mode,
+            'samples': [[list(key), v] for key, v in value.items()],
+        }
+
+
+def merge(snapshots):
+    """Combine the snapshots of several workers into one"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, samples={})
+            samples = target['samples']
+            for key, value in metric['samples']:
+                key = tuple(key)
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif metric['type'] == 'histogram':
+                    for i, v in enumerate(value):
+                        current[i] += v
+                elif metric.get('mode') == 'max':
+                    samples[key] = max(current, value)
+                else:
+                    samples[key] = current + value
+    return merged
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render(merged):
+    """Prometheus text format (version 0.0.4) for a merged snapshot"""
+    lines = []
+    for name, metric in merged.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric['labels']
+        for key, value in sorted(metric['samples'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_labels(names, key)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + [math.inf], value):
+                cumulative += count
+                le = 'le="%s"' % _format_value(float(bound))
+                lines.append(f"{name}_bucket{_labels(names, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_format_value(value[-2])}")
+            lines.append(f"{name}_count{_labels(names, key)} {value[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def directory_size(path):
+    """Total size in bytes of the regular files under path (0 if it does not exist)"""
+    total = 0
+    try:
+        entries = os.scandir(path)
+    except OSError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    total += directory_size(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass  # removed while we were walking
+    return total